@@ -0,0 +1,113 @@
+"""
+Benchmarks for therapy_connect.
+
+Each module is a script run from the repository root, e.g.::
+
+    python -m benchmarks.auth
+
+They use the settings named by DJANGO_SETTINGS_MODULE (production by
+default) and run against a throwaway test database.
+"""
+
+import json
+import os
+import statistics
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+
+def setup():
+    """Configure Django so a benchmark can import models and views."""
+    os.environ.setdefault(
+        "DJANGO_SETTINGS_MODULE", "therapy_connect.settings.production"
+    )
+    if str(ROOT_DIR) not in sys.path:
+        sys.path.insert(0, str(ROOT_DIR))
+
+    import django
+
+    django.setup()
+
+
+@contextmanager
+def test_database():
+    """Create the test databases for the duration of the block."""
+    from django.test.utils import (
+        setup_databases,
+        setup_test_environment,
+        teardown_databases,
+        teardown_test_environment,
+    )
+
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=0)
+        teardown_test_environment()
+
+
+def measure(func, iterations, warmup=10):
+    """Call `func` repeatedly and return the duration of each call in seconds."""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def percentile(samples, percent):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def summarize(samples):
+    """Return throughput and latency percentiles (in ms) for a list of samples."""
+    total = sum(samples)
+    return {
+        "count": len(samples),
+        "per_second": len(samples) / total if total else 0.0,
+        "mean_ms": statistics.fmean(samples) * 1000 if samples else 0.0,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+    }
+
+
+def report(title, results, output=None):
+    """Print a results table and optionally write it as JSON to `output`."""
+    print(title)
+    for name, row in results.items():
+        values = ", ".join(
+            f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}"
+            for key, value in row.items()
+        )
+        print(f"  {name}: {values}")
+    if output:
+        Path(output).write_text(json.dumps(results, indent=2, sort_keys=True))
+
+
+def regressions(results, baseline, tolerance, key="p50_ms"):
+    """
+    The rows of `results` whose `key` grew by more than `tolerance` (0.2 for
+    20%) over `baseline`, as {name: (baseline, result)}. Rows missing from
+    either side are skipped.
+    """
+    slower = {}
+    for name, row in results.items():
+        before = baseline.get(name, {}).get(key)
+        after = row.get(key)
+        if before and after is not None and after > before * (1 + tolerance):
+            slower[name] = (before, after)
+    return slower
@@ -0,0 +1,59 @@
+"""
+Authenticated requests per second with SimpleJWT's JWTAuthentication
+(loads the User row per request) versus StatelessJWTAuthentication.
+
+    python -m benchmarks.auth [--iterations N] [--output results.json]
+"""
+
+import argparse
+
+from benchmarks import measure, report, setup, summarize, test_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    setup()
+
+    from django.contrib.auth import get_user_model
+    from rest_framework.test import APIRequestFactory
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+
+    from therapy_connect.accounts.authentication import StatelessJWTAuthentication
+    from therapy_connect.accounts.tokens import RoleRefreshToken
+    from therapy_connect.therapy.views import PatientAppointmentListView
+
+    with test_database():
+        user = get_user_model().objects.create_user(
+            email="bench@example.com",
+            mobile_number="100000000",
+            first_name="Bench",
+            last_name="Patient",
+            password="bench-password",
+        )
+        user.is_active = True
+        user.save()
+        access = str(RoleRefreshToken.for_user(user).access_token)
+
+        factory = APIRequestFactory()
+        results = {}
+        for auth_class in (JWTAuthentication, StatelessJWTAuthentication):
+            view = PatientAppointmentListView.as_view(
+                authentication_classes=[auth_class]
+            )
+
+            def request():
+                response = view(factory.get("/", HTTP_AUTHORIZATION=f"Bearer {access}"))
+                assert response.status_code == 200, response.status_code
+                response.render()
+
+            results[auth_class.__name__] = summarize(measure(request, args.iterations))
+
+    report("Authenticated requests (patient appointment list)", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+How long a password-reset email waits behind a burst of image jobs, with
+every task on one queue versus the queues and routes from the Celery
+settings.
+
+    python -m benchmarks.celery_queues [--images N] [--image-seconds S] \\
+        [--rounds N] [--output results.json]
+
+Workers run locally as subprocesses on kombu's filesystem transport, so no
+Redis is needed. Stand-in tasks sleep instead of resizing images or
+sending mail, and are published to the queue the real task is routed to.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from celery import Celery
+
+from benchmarks import ROOT_DIR, report, setup, summarize
+
+IMAGE_TASK = "therapy_connect.profiles.tasks.resize_profile_image"
+EMAIL_TASK = "therapy_connect.accounts.tasks.send_email"
+
+app = Celery("benchmarks")
+
+
+def configure(directory):
+    directory = Path(directory)
+    for name in ("broker", "processed", "control", "results"):
+        (directory / name).mkdir(exist_ok=True)
+    app.conf.update(
+        broker_url="filesystem://",
+        broker_transport_options={
+            "data_folder_in": str(directory / "broker"),
+            "data_folder_out": str(directory / "broker"),
+            "processed_folder": str(directory / "processed"),
+            "control_folder": str(directory / "control"),
+            "polling_interval": 0.01,
+        },
+        result_backend=f"file://{directory / 'results'}",
+        worker_hijack_root_logger=False,
+    )
+
+
+if os.environ.get("BENCHMARK_CELERY_DIR"):
+    configure(os.environ["BENCHMARK_CELERY_DIR"])
+
+
+@app.task(name="benchmark.image")
+def image_job(seconds):
+    time.sleep(seconds)
+
+
+@app.task(name="benchmark.email")
+def email_job():
+    return time.time()
+
+
+def start_worker(directory, queues, concurrency, prefetch):
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "celery",
+            "-A",
+            "benchmarks.celery_queues",
+            "worker",
+            "-Q",
+            ",".join(queues),
+            "-c",
+            str(concurrency),
+            "--prefetch-multiplier",
+            str(prefetch),
+            "-n",
+            f"{queues[0]}@benchmark",
+            "-l",
+            "warning",
+        ],
+        cwd=ROOT_DIR,
+        env={**os.environ, "BENCHMARK_CELERY_DIR": str(directory)},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def run_topology(args, directory, workers, image_queue, email_queue):
+    """Return the email latency of each round, in seconds."""
+    processes = [start_worker(directory, *worker) for worker in workers]
+    try:
+        # Wait until the workers consume both queues
+        for queue in {image_queue, email_queue}:
+            app.send_task("benchmark.email", queue=queue).get(timeout=60)
+
+        samples = []
+        for _ in range(args.rounds):
+            images = [
+                app.send_task(
+                    "benchmark.image", (args.image_seconds,), queue=image_queue
+                )
+                for _ in range(args.images)
+            ]
+            sent = time.time()
+            result = app.send_task("benchmark.email", queue=email_queue)
+            samples.append(result.get(timeout=600, interval=0.01) - sent)
+            for image in images:
+                image.get(timeout=600)
+        return samples
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("--image-seconds", type=float, default=0.5)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    setup()
+
+    from therapy_connect.celery_config import celery_app
+
+    def queue_for(task_name):
+        return celery_app.amqp.router.route({}, task_name)["queue"].name
+
+    image_queue = queue_for(IMAGE_TASK)
+    email_queue = queue_for(EMAIL_TASK)
+    c = args.concurrency
+    topologies = {
+        # Before: one worker with Celery's default prefetch takes everything
+        "single queue": ([(["default"], c, 4)], "default", "default"),
+        # After: the email and media workers from the local docker-compose
+        "routed": (
+            [([email_queue, "default"], c, 4), ([image_queue], c, 1)],
+            image_queue,
+            email_queue,
+        ),
+    }
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        configure(directory)
+        for name, (workers, images_to, emails_to) in topologies.items():
+            samples = run_topology(args, directory, workers, images_to, emails_to)
+            results[name] = summarize(samples)
+
+    title = (
+        f"Password-reset email latency behind {args.images} image jobs "
+        f"of {args.image_seconds}s"
+    )
+    report(title, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Per-request database overhead without connection reuse, with persistent
+connections (CONN_MAX_AGE) and with the psycopg connection pool.
+
+    python -m benchmarks.db_pool [--iterations N] [--output results.json]
+
+Each iteration goes through the request_started/request_finished signals
+around a single query, as a request handled by Django would. Needs the
+PostgreSQL database from the settings.
+"""
+
+import argparse
+
+from benchmarks import measure, report, setup, summarize, test_database
+
+CONFIGS = {
+    "connect_per_request": {"CONN_MAX_AGE": 0, "pool": None},
+    "persistent": {"CONN_MAX_AGE": 60, "pool": None},
+    "pool": {"CONN_MAX_AGE": 0, "pool": {"min_size": 1, "max_size": 4}},
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    setup()
+
+    from django.core import signals
+    from django.db import connection
+
+    from therapy_connect.core.db import close_pools
+
+    def request():
+        signals.request_started.send(sender=None)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        signals.request_finished.send(sender=None)
+
+    with test_database():
+        results = {}
+        for name, config in CONFIGS.items():
+            connection.close()
+            close_pools()
+            options = dict(connection.settings_dict["OPTIONS"])
+            options.pop("pool", None)
+            if config["pool"]:
+                options["pool"] = config["pool"]
+            connection.settings_dict["OPTIONS"] = options
+            connection.settings_dict["CONN_MAX_AGE"] = config["CONN_MAX_AGE"]
+
+            results[name] = summarize(measure(request, args.iterations))
+
+        connection.close()
+        close_pools()
+
+    report("Request cycle with one query", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Microbenchmarks of the booking validators, the availability filter and the
+list serializers against a seeded test database.
+
+    python -m benchmarks.hot_paths [--iterations N] [--output results.json] \\
+        [--save-baseline benchmarks/baselines/hot_paths.json] \\
+        [--baseline benchmarks/baselines/hot_paths.json] [--tolerance 0.2]
+
+Validators are timed on data that passes, so every check runs. With
+`--baseline`, the p50 of each benchmark is compared with the stored one and
+the run exits with status 1 if any is more than `--tolerance` slower.
+Baselines depend on the machine and database: save one on the machine that
+runs the comparison, e.g. from the main branch before a change.
+"""
+
+import argparse
+import json
+from datetime import timedelta
+from pathlib import Path
+
+from benchmarks import measure, regressions, report, setup, summarize, test_database
+
+THERAPISTS = 20
+PATIENTS_PER_THERAPIST = 10
+APPOINTMENTS_PER_PANEL = 10
+DAYS = 60
+
+
+def seed():
+    """Therapists with a slot a day, each with panels full of appointments."""
+    from django.utils import timezone
+
+    from therapy_connect.core.testing import create_user
+    from therapy_connect.profiles.models import (
+        PatientProfile,
+        PsychologicalIssue,
+        TherapistProfile,
+    )
+    from therapy_connect.therapy.models import Appointment, Availability, TherapyPanel
+
+    issue = PsychologicalIssue.objects.create(name="Anxiety")
+    today = timezone.localdate()
+
+    for t in range(THERAPISTS):
+        create_user("therapist", t)
+    therapists = list(TherapistProfile.objects.select_related("user"))
+    Availability.objects.bulk_create(
+        Availability(
+            therapist=therapist,
+            date=today + timedelta(days=day),
+            start_time="08:00",
+            end_time="20:00",
+        )
+        for therapist in therapists
+        for day in range(1, DAYS + 1)
+    )
+
+    for p in range(THERAPISTS * PATIENTS_PER_THERAPIST):
+        create_user("patient", p)
+    patients = list(PatientProfile.objects.all())
+    panels = TherapyPanel.objects.bulk_create(
+        TherapyPanel(
+            patient=patient,
+            issue=issue,
+            therapist=therapists[i % THERAPISTS],
+            assigned_at=timezone.now(),
+        )
+        for i, patient in enumerate(patients)
+    )
+
+    # Appointments fill the afternoons, leaving the mornings bookable
+    first = timezone.now().replace(hour=14, minute=0, second=0, microsecond=0)
+    Appointment.objects.bulk_create(
+        Appointment(
+            panel=panel,
+            scheduled_time=first
+            + timedelta(days=2 + n * DAYS // (APPOINTMENTS_PER_PANEL + 1), hours=i % 5),
+            meeting_link=f"https://zoom.com/meeting/{panel.pk}-{n}",
+        )
+        for i, panel in enumerate(panels)
+        for n in range(APPOINTMENTS_PER_PANEL)
+    )
+    return panels[0]
+
+
+def benchmarks(panel):
+    """{name: function} of the code paths to time."""
+    from django.utils import timezone
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+
+    from therapy_connect.accounts.roles import RoleContext
+    from therapy_connect.therapy.models import Appointment, Availability, TherapyPanel
+    from therapy_connect.therapy.serializers import (
+        AppointmentSerializer,
+        AvailabilitySerializer,
+        RescheduleAppointmentSerializer,
+        TherapyPanelPatientRetrieveSerializer,
+        TherapyPanelTherapistRetrieveSerializer,
+    )
+    from therapy_connect.therapy.services import filter_availability
+
+    def request(role, profile_id):
+        request = Request(APIRequestFactory().get("/"))
+        # What get_role_context() reads from the access token
+        request._role_context = RoleContext(role, profile_id)
+        return request
+
+    patient_request = request("patient", panel.patient_id)
+    therapist_request = request("therapist", panel.therapist_id)
+    morning = timezone.now().replace(hour=9, minute=0, second=0, microsecond=0)
+    booking = {
+        "panel": panel.pk,
+        "scheduled_time": (morning + timedelta(days=3)).isoformat(),
+        "duration": 60,
+    }
+    reschedule = {"new_scheduled_time": (morning + timedelta(days=4)).isoformat()}
+    # Past the seeded slots, so it doesn't overlap
+    slot = {
+        "date": (morning + timedelta(days=DAYS + 5)).date().isoformat(),
+        "start_time": "09:00",
+        "end_time": "10:00",
+    }
+    filters = {
+        "therapist_id": panel.therapist_id,
+        "day_of_week": "Monday",
+        "start_time_after": "07:00",
+        "end_time_before": "21:00",
+    }
+
+    def validate_appointment():
+        serializer = AppointmentSerializer(
+            data=booking, context={"request": patient_request}
+        )
+        assert serializer.is_valid(), serializer.errors
+
+    def validate_reschedule():
+        appointment = (
+            Appointment.objects.select_related("panel")
+            .filter(panel=panel, status="scheduled")
+            .latest("scheduled_time")
+        )
+        serializer = RescheduleAppointmentSerializer(
+            appointment, data=reschedule, context={"request": patient_request}
+        )
+        assert serializer.is_valid(), serializer.errors
+
+    def validate_availability():
+        serializer = AvailabilitySerializer(
+            data=slot, context={"request": therapist_request}
+        )
+        assert serializer.is_valid(), serializer.errors
+
+    def filter_slots():
+        return list(filter_availability(Availability.objects.all(), filters))
+
+    def list_availability():
+        queryset = filter_availability(
+            Availability.objects.all(), {"therapist_id": panel.therapist_id}
+        )
+        return AvailabilitySerializer(queryset, many=True).data
+
+    def list_patient_appointments():
+        queryset = Appointment.objects.filter(
+            panel__patient_id=panel.patient_id, status="scheduled"
+        ).order_by("scheduled_time")
+        return AppointmentSerializer(queryset, many=True).data
+
+    def list_therapist_appointments():
+        queryset = Appointment.objects.filter(panel__therapist_id=panel.therapist_id)
+        return AppointmentSerializer(queryset, many=True).data
+
+    def list_patient_panels():
+        queryset = TherapyPanel.objects.filter(patient_id=panel.patient_id)
+        return TherapyPanelPatientRetrieveSerializer(queryset, many=True).data
+
+    def list_therapist_panels():
+        queryset = TherapyPanel.objects.filter(therapist_id=panel.therapist_id)
+        return TherapyPanelTherapistRetrieveSerializer(queryset, many=True).data
+
+    return {
+        "validate_appointment": validate_appointment,
+        "validate_reschedule": validate_reschedule,
+        "validate_availability": validate_availability,
+        "filter_availability": filter_slots,
+        "list_availability": list_availability,
+        "list_patient_appointments": list_patient_appointments,
+        "list_therapist_appointments": list_therapist_appointments,
+        "list_patient_panels": list_patient_panels,
+        "list_therapist_panels": list_therapist_panels,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--output")
+    parser.add_argument("--save-baseline", help="Write the results as the baseline.")
+    parser.add_argument("--baseline", help="Fail if slower than this baseline.")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Allowed slowdown over the baseline p50 (0.2 = 20%%).",
+    )
+    args = parser.parse_args()
+
+    setup()
+
+    with test_database():
+        panel = seed()
+        results = {
+            name: summarize(measure(func, args.iterations))
+            for name, func in benchmarks(panel).items()
+        }
+
+    report("Hot paths", results, args.output)
+    if args.save_baseline:
+        path = Path(args.save_baseline)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(results, indent=2, sort_keys=True))
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        slower = regressions(results, baseline, args.tolerance)
+        for name, (before, after) in slower.items():
+            print(
+                f"  REGRESSION {name}: p50 {before:.3f} ms -> {after:.3f} ms "
+                f"({(after / before - 1) * 100:+.0f}%)"
+            )
+        if slower:
+            raise SystemExit(1)
+        print(f"No regression beyond {args.tolerance:.0%} of {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,430 @@
+"""
+Load test of the patient and therapist journeys against a running server.
+
+    python -m benchmarks.load --url http://localhost:8000 [--seed] \\
+        [--mix patient=8,therapist=2,register=1] [--concurrency 16] \\
+        [--duration 60] [--output out.json]
+
+Each virtual user repeatedly picks a journey, weighted by `--mix`:
+
+- patient: log in, create a therapy panel, pick a suggested therapist, list
+  their availability, book an appointment, reschedule it, cancel it and
+  pause the panel (so the issue can be picked again);
+- therapist: log in, list their appointments, add an availability slot and
+  list the availability of that day;
+- register: register a new user.
+
+A journey stops at the first request that fails. Throughput and p50/p95/p99
+latency are reported per step, with the 4xx (rejected, e.g. a slot that was
+just taken) and the 5xx or connection errors counted separately; write them
+with `--output` to compare commits.
+
+`--seed` first creates the users, issues and availability in the database
+of the configured settings (run it where the server's database is
+reachable). Seeding again reuses what exists.
+"""
+
+import argparse
+import queue
+import random
+import subprocess
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+import requests
+
+from benchmarks import ROOT_DIR, report, setup, summarize
+
+PASSWORD = "load-password"
+PATIENT_EMAIL = "load-patient-{}@example.com"
+THERAPIST_EMAIL = "load-therapist-{}@example.com"
+# Seeded availability starts two days out, clear of the 6 hour booking notice
+FIRST_DAY = 2
+DAY_START = 8
+DAY_END = 20
+
+REGISTER_PATH = "/api/accounts/users/register/"
+LOGIN_PATH = "/api/accounts/users/login/"
+PANELS_PATH = "/api/therapy/v1/therapy-panels/"
+AVAILABILITIES_PATH = "/api/therapy/v1/availabilities/"
+APPOINTMENTS_PATH = "/api/therapy/v1/appointments/"
+THERAPIST_PROFILE_PATH = "/api/profiles/v1/therapist/me/"
+
+
+def seed(patients, therapists, issues, days):
+    setup()
+
+    from django.contrib.auth import get_user_model
+    from django.db import transaction
+
+    from therapy_connect.profiles.models import PsychologicalIssue, TherapistProfile
+    from therapy_connect.therapy.models import Availability
+
+    User = get_user_model()
+
+    def get_user(email, mobile_number, role):
+        user = User.objects.filter(email=email).first()
+        if user is None:
+            # The role must be set on creation for the profile to be created
+            user = User(
+                email=email,
+                mobile_number=mobile_number,
+                first_name="Load",
+                last_name=role.title(),
+                role=role,
+                is_active=True,
+            )
+            user.set_password(PASSWORD)
+            user.save()
+        return user
+
+    with transaction.atomic():
+        issue_objects = [
+            PsychologicalIssue.objects.get_or_create(name=f"Load issue {i}")[0]
+            for i in range(issues)
+        ]
+        for i in range(patients):
+            get_user(PATIENT_EMAIL.format(i), f"2{i:09d}", "patient")
+
+        today = date.today()
+        for i in range(therapists):
+            user = get_user(THERAPIST_EMAIL.format(i), f"3{i:09d}", "therapist")
+            profile = TherapistProfile.objects.get(user=user)
+            # Every issue has a few therapists
+            profile.specialties.add(
+                issue_objects[i % issues], issue_objects[(i + 1) % issues]
+            )
+            existing = set(
+                profile.availabilities.values_list("date", flat=True).filter(
+                    start_time=f"{DAY_START:02d}:00"
+                )
+            )
+            Availability.objects.bulk_create(
+                Availability(
+                    therapist=profile,
+                    date=day,
+                    start_time=f"{DAY_START:02d}:00",
+                    end_time=f"{DAY_END:02d}:00",
+                )
+                for day in (
+                    today + timedelta(days=offset)
+                    for offset in range(FIRST_DAY, FIRST_DAY + days)
+                )
+                if day not in existing
+            )
+    print(
+        f"Seeded {patients} patients, {therapists} therapists, {issues} issues "
+        f"and {days} days of availability"
+    )
+
+
+class StepFailed(Exception):
+    pass
+
+
+class Recorder:
+    """Latency samples and failures per step, shared by the virtual users."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.rejected = defaultdict(int)
+        self.errors = defaultdict(int)
+
+    def request(self, session, step, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, timeout=30, **kwargs)
+        except requests.RequestException as exc:
+            with self.lock:
+                self.errors[step] += 1
+            raise StepFailed(step) from exc
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            if response.status_code >= 500:
+                self.errors[step] += 1
+            elif response.status_code >= 400:
+                self.rejected[step] += 1
+            else:
+                self.samples[step].append(elapsed)
+        if response.status_code >= 400:
+            raise StepFailed(step)
+        return response.json() if response.content else None
+
+    def results(self, wall_time):
+        results = {}
+        for step in sorted(
+            self.samples.keys() | self.rejected.keys() | self.errors.keys()
+        ):
+            row = summarize(self.samples[step])
+            # Requests overlap, so throughput comes from wall-clock time
+            row["per_second"] = len(self.samples[step]) / wall_time
+            row["rejected"] = self.rejected[step]
+            row["errors"] = self.errors[step]
+            results[step] = row
+        return results
+
+
+class VirtualUser:
+    def __init__(self, base_url, recorder, patients, therapists, issues):
+        self.base_url = base_url.rstrip("/")
+        self.recorder = recorder
+        self.patients = patients
+        self.therapists = therapists
+        self.issues = issues
+        self.session = requests.Session()
+
+    def request(self, step, method, path, token=None, **kwargs):
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        return self.recorder.request(
+            self.session, step, method, self.base_url + path, headers=headers, **kwargs
+        )
+
+    def login(self, email):
+        payload = {"email": email, "password": PASSWORD}
+        return self.request("login", "POST", LOGIN_PATH, json=payload)["access"]
+
+    def register(self):
+        suffix = uuid.uuid4().hex[:12]
+        payload = {
+            "first_name": "Load",
+            "last_name": "Registration",
+            "email": f"load-register-{suffix}@example.com",
+            "mobile_number": str(int(suffix, 16))[-12:],
+            "password": PASSWORD,
+        }
+        self.request("register", "POST", REGISTER_PATH, json=payload)
+
+    def patient(self):
+        # A patient runs one journey at a time: they may have one active
+        # panel per issue
+        email = self.patients.get()
+        try:
+            self.patient_journey(email)
+        finally:
+            self.patients.put(email)
+
+    def patient_journey(self, email):
+        token = self.login(email)
+        panel = self.request(
+            "create_panel",
+            "POST",
+            PANELS_PATH + "create/",
+            token,
+            json={"issue": random.choice(self.issues)},
+        )
+        if not panel["suggested_therapists"]:
+            raise StepFailed("create_panel")
+        therapist = random.choice(panel["suggested_therapists"])["id"]
+        panel_path = f"{PANELS_PATH}{panel['id']}/"
+        self.request(
+            "pick_therapist", "PUT", panel_path, token, json={"therapist": therapist}
+        )
+        try:
+            slots = self.request(
+                "list_availability",
+                "GET",
+                AVAILABILITIES_PATH,
+                token,
+                params={"therapist": therapist},
+            )
+            appointment = self.book(token, panel["id"], slots)
+            rescheduled = self.request(
+                "reschedule",
+                "PATCH",
+                f"{APPOINTMENTS_PATH}{appointment['id']}/update/",
+                token,
+                json={
+                    "action": "reschedule",
+                    "new_scheduled_time": pick_time(slots).isoformat(),
+                },
+            )["appointment"]
+            self.request(
+                "cancel",
+                "PATCH",
+                f"{APPOINTMENTS_PATH}{rescheduled['id']}/update/",
+                token,
+                json={"action": "cancel", "cancellation_reason": "Load test"},
+            )
+        finally:
+            self.request(
+                "pause_panel", "PUT", panel_path, token, json={"status": "paused"}
+            )
+
+    def book(self, token, panel_id, slots, attempts=3):
+        """Book one of `slots`, trying another time if one was taken."""
+        for attempt in range(attempts):
+            try:
+                return self.request(
+                    "book",
+                    "POST",
+                    APPOINTMENTS_PATH,
+                    token,
+                    json={
+                        "panel_id": panel_id,
+                        "scheduled_time": pick_time(slots).isoformat(),
+                        "duration": 60,
+                    },
+                )
+            except StepFailed:
+                if attempt == attempts - 1:
+                    raise
+
+    def therapist(self):
+        email = random.choice(self.therapists)
+        token = self.login(email)
+        self.request(
+            "therapist_appointments", "GET", APPOINTMENTS_PATH + "therapist/", token
+        )
+        # Far enough out not to overlap the seeded slots
+        day = date.today() + timedelta(days=random.randint(400, 4000))
+        hour = random.randint(DAY_START, DAY_END - 1)
+        self.request(
+            "create_availability",
+            "POST",
+            AVAILABILITIES_PATH + "create/",
+            token,
+            json={
+                "date": day.isoformat(),
+                "start_time": f"{hour:02d}:00",
+                "end_time": f"{hour + 1:02d}:00",
+            },
+        )
+        self.request(
+            "day_availability",
+            "GET",
+            AVAILABILITIES_PATH,
+            token,
+            params={"date": day.isoformat()},
+        )
+
+    def run(self, journeys, weights, deadline):
+        while time.monotonic() < deadline:
+            journey = random.choices(journeys, weights)[0]
+            try:
+                getattr(self, journey)()
+            except StepFailed:
+                pass
+
+
+def pick_time(slots):
+    """A random hour inside one of the future availability `slots`."""
+    earliest = date.today() + timedelta(days=FIRST_DAY)
+    slots = [slot for slot in slots if date.fromisoformat(slot["date"]) >= earliest]
+    if not slots:
+        raise StepFailed("list_availability")
+    slot = random.choice(slots)
+    start = datetime.fromisoformat(f"{slot['date']}T{slot['start_time']}")
+    end = datetime.fromisoformat(f"{slot['date']}T{slot['end_time']}")
+    hours = int((end - start).total_seconds() // 3600)
+    if hours < 1:
+        return start
+    # Times are in UTC (TIME_ZONE)
+    return start + timedelta(hours=random.randrange(hours))
+
+
+def seeded_issues(url, therapists):
+    """The ids of the issues the seeded therapists treat."""
+    user = VirtualUser(url, Recorder(), None, therapists, [])
+    issues = set()
+    for email in therapists:
+        try:
+            token = user.login(email)
+            profile = user.request("profile", "GET", THERAPIST_PROFILE_PATH, token)
+        except StepFailed:
+            raise SystemExit(f"Couldn't log in as {email}; seed with --seed first.")
+        issues.update(profile["specialties"])
+    return sorted(issues)
+
+
+def parse_mix(value):
+    """ "patient=8,therapist=2" -> {"patient": 8.0, "therapist": 2.0}."""
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ("patient", "therapist", "register"):
+            raise argparse.ArgumentTypeError(f"Unknown journey {name!r}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument(
+        "--mix", type=parse_mix, default="patient=8,therapist=2,register=1"
+    )
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=60.0)
+    parser.add_argument("--patients", type=int, default=200)
+    parser.add_argument("--therapists", type=int, default=20)
+    parser.add_argument("--issues", type=int, default=10)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument(
+        "--seed",
+        action="store_true",
+        help="Create the users, issues and availability in the configured "
+        "database first.",
+    )
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    if args.seed:
+        seed(args.patients, args.therapists, args.issues, args.days)
+
+    recorder = Recorder()
+    patients = queue.Queue()
+    for i in range(args.patients):
+        patients.put(PATIENT_EMAIL.format(i))
+    therapists = [THERAPIST_EMAIL.format(i) for i in range(args.therapists)]
+    issues = seeded_issues(args.url, therapists)
+    users = [
+        VirtualUser(args.url, recorder, patients, therapists, issues)
+        for _ in range(args.concurrency)
+    ]
+
+    journeys, weights = zip(*args.mix.items())
+    deadline = time.monotonic() + args.duration
+    threads = [
+        threading.Thread(target=user.run, args=(journeys, weights, deadline))
+        for user in users
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - started
+
+    results = recorder.results(wall_time)
+    requests_made = sum(row["count"] for row in results.values())
+    results["all"] = {
+        "count": requests_made,
+        "per_second": requests_made / wall_time,
+        "rejected": sum(recorder.rejected.values()),
+        "errors": sum(recorder.errors.values()),
+    }
+    results["run"] = {
+        "commit": git_commit(),
+        "mix": ",".join(f"{name}={weight:g}" for name, weight in args.mix.items()),
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+    }
+    title = f"Load test at concurrency {args.concurrency} ({args.url})"
+    report(title, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Login throughput against a running server at fixed concurrency.
+
+    python -m benchmarks.login --url http://localhost:8000 \\
+        --email bench@example.com --password bench-password \\
+        [--concurrency 16] [--requests 500] [--create-user] [--output out.json]
+
+Run it once against the WSGI deployment and once with ASYNC_VIEWS enabled
+under ASGI to compare p50/p99 latency.
+"""
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks import report, setup, summarize
+
+LOGIN_PATH = "/api/accounts/users/login/"
+
+
+def create_user(email, password):
+    setup()
+
+    from django.contrib.auth import get_user_model
+
+    User = get_user_model()
+    if not User.objects.filter(email=email).exists():
+        user = User.objects.create_user(
+            email=email,
+            mobile_number="100000001",
+            first_name="Bench",
+            last_name="Login",
+            password=password,
+        )
+        user.is_active = True
+        user.save()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--email", default="bench@example.com")
+    parser.add_argument("--password", default="bench-password")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument(
+        "--create-user",
+        action="store_true",
+        help="Create the login user in the configured database first.",
+    )
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    if args.create_user:
+        create_user(args.email, args.password)
+
+    url = args.url.rstrip("/") + LOGIN_PATH
+    payload = {"email": args.email, "password": args.password}
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    def login(_):
+        started = time.perf_counter()
+        response = session.post(url, json=payload)
+        elapsed = time.perf_counter() - started
+        response.raise_for_status()
+        return elapsed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        samples = list(pool.map(login, range(args.requests)))
+    wall_time = time.perf_counter() - started
+
+    summary = summarize(samples)
+    # Requests overlap, so throughput comes from wall-clock time
+    summary["per_second"] = len(samples) / wall_time
+    summary["concurrency"] = args.concurrency
+    title = f"Login at concurrency {args.concurrency} ({url})"
+    report(title, {"login": summary}, args.output)
+
+
+if __name__ == "__main__":
+    main()
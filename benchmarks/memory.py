@@ -0,0 +1,96 @@
+"""
+Resident memory of each gunicorn worker before and after a burst of
+requests.
+
+    python -m benchmarks.memory --pid MASTER_PID --url http://localhost:8000 \\
+        [--path /api/therapy/v1/availabilities/] [--token ACCESS_TOKEN] \\
+        [--requests 2000] [--concurrency 8] [--label preload] \\
+        [--output out.json]
+
+Reads RSS, PSS and the private/shared split of the master and its workers
+from /proc (Linux only). Run it against gunicorn.conf.py once as is and
+once with GUNICORN_PRELOAD=false: with the app preloaded and the heap
+frozen, most of each worker's RSS is shared with the master, so its PSS and
+private memory are much lower. Workers recycled by max_requests during the
+run show up without a "before".
+"""
+
+import argparse
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from benchmarks import report, summarize
+from therapy_connect.core.memory import resident_memory
+
+
+def worker_pids(master_pid):
+    pids = []
+    for stat in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            # The command name may contain spaces; the ppid follows it
+            fields = stat.read_text().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == master_pid:
+            pids.append(int(stat.parent.name))
+    return sorted(pids)
+
+
+def snapshot(master_pid):
+    pids = [master_pid, *worker_pids(master_pid)]
+    return {pid: resident_memory(pid) for pid in pids}
+
+
+def send_requests(url, token, count, concurrency):
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+
+    def send(_):
+        started = time.perf_counter()
+        request = urllib.request.Request(url, headers=headers)
+        with urllib.request.urlopen(request) as response:
+            response.read()
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        return list(executor.map(send, range(count)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pid", type=int, required=True, help="gunicorn master pid")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--path", default="/api/therapy/v1/availabilities/")
+    parser.add_argument("--token")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--label", default="", help='e.g. "preload" or "no preload"')
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    before = snapshot(args.pid)
+    samples = send_requests(
+        args.url + args.path, args.token, args.requests, args.concurrency
+    )
+    after = snapshot(args.pid)
+
+    results = {"requests": summarize(samples)}
+    for pid in sorted(before.keys() | after.keys()):
+        name = "master" if pid == args.pid else f"worker {pid}"
+        row = {}
+        for label, memory in (("before", before.get(pid)), ("after", after.get(pid))):
+            for key in ("rss", "pss", "private", "shared"):
+                row[f"{label}_{key}_kb"] = memory.get(key) if memory else None
+        results[name] = row
+
+    report(
+        f"Resident memory of gunicorn {args.pid} {args.label} around "
+        f"{args.requests} requests to {args.path}",
+        results,
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    main()
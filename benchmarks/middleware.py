@@ -0,0 +1,85 @@
+"""
+Cost of the full middleware stack versus the lean API stack from
+settings/api.py, with the time each middleware adds to an API request.
+
+    python -m benchmarks.middleware [--iterations N] [--output results.json]
+"""
+
+import argparse
+from collections import defaultdict
+
+from benchmarks import measure, report, setup, summarize, test_database
+
+LEAN_API_MIDDLEWARE = [
+    "therapy_connect.core.middleware.TracingMiddleware",
+    "therapy_connect.core.middleware.RequestTimingMiddleware",
+    "therapy_connect.core.middleware.MetricsMiddleware",
+    "therapy_connect.core.middleware.QueryInspectionMiddleware",
+    "therapy_connect.core.middleware.ProfilingMiddleware",
+    "django.middleware.security.SecurityMiddleware",
+    "therapy_connect.core.middleware.CompressionMiddleware",
+    "therapy_connect.core.middleware.ReplicaPinningMiddleware",
+    "django.middleware.common.CommonMiddleware",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    setup()
+
+    from django.contrib.auth import get_user_model
+    from django.test import Client, override_settings
+    from django.urls import reverse
+
+    from therapy_connect.accounts.tokens import RoleRefreshToken
+    from therapy_connect.settings import base
+
+    stacks = {
+        "full": {"": base.MIDDLEWARE},
+        "api": {"/api/": LEAN_API_MIDDLEWARE, "": base.MIDDLEWARE},
+    }
+
+    with test_database():
+        user = get_user_model().objects.create_user(
+            email="bench@example.com",
+            mobile_number="100000000",
+            first_name="Bench",
+            last_name="Patient",
+            password="bench-password",
+        )
+        user.is_active = True
+        user.save()
+        access = str(RoleRefreshToken.for_user(user).access_token)
+        url = reverse("therapy:list-patient-appointments")
+
+        results = {}
+        for name, routes in stacks.items():
+            with override_settings(
+                MIDDLEWARE=["therapy_connect.core.middleware.RoutedMiddleware"],
+                ROUTED_MIDDLEWARE=routes,
+                MIDDLEWARE_TIMING=True,
+            ):
+                client = Client(HTTP_AUTHORIZATION=f"Bearer {access}")
+                timings = defaultdict(float)
+
+                def request():
+                    response = client.get(url)
+                    assert response.status_code == 200, response.status_code
+                    request_timings = response.wsgi_request.middleware_timings
+                    for key, value in request_timings.items():
+                        timings[key] += value
+
+                row = summarize(measure(request, args.iterations, warmup=0))
+                for key, value in timings.items():
+                    row[f"{key}_ms"] = value / args.iterations * 1000
+                results[name] = row
+
+    report(f"Middleware cost per request ({url})", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Worker boot time up to the first /schema/ response, and /schema/ latency,
+with the schema generated per request (SpectacularAPIView) versus served
+from the file written by `manage.py build_schema`.
+
+    python -m benchmarks.schema [--boots N] [--iterations N] \\
+        [--output results.json]
+
+Each boot is a fresh interpreter that sets Django up, loads the URLconf
+(importing every view and its extend_schema decorators) and requests the
+schema once, as a newly started worker does.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks import ROOT_DIR, measure, report, setup, summarize
+
+BOOT_SCRIPT = """
+from benchmarks import setup
+setup()
+from django.test import Client
+response = Client().get("/schema/", HTTP_ACCEPT_ENCODING="br, gzip")
+assert response.status_code == 200, response.status_code
+"""
+
+
+def boot(stored):
+    env = {**os.environ, "SERVE_STORED_SCHEMA": "true" if stored else "false"}
+    started = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-c", BOOT_SCRIPT], cwd=ROOT_DIR, env=env, check=True
+    )
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--boots", type=int, default=10)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    setup()
+
+    from django.test import RequestFactory
+    from drf_spectacular.views import SpectacularAPIView
+
+    from therapy_connect.core.views import StoredSchemaView
+
+    results = {}
+    for name, stored in (("generated", False), ("stored", True)):
+        results[f"{name} boot"] = summarize([boot(stored) for _ in range(args.boots)])
+
+    factory = RequestFactory()
+    views = {
+        "generated": SpectacularAPIView.as_view(),
+        "stored": StoredSchemaView.as_view(),
+    }
+    for name, view in views.items():
+
+        def request():
+            response = view(factory.get("/schema/", HTTP_ACCEPT_ENCODING="br, gzip"))
+            assert response.status_code == 200, response.status_code
+            if hasattr(response, "render"):
+                response.render()
+
+        results[f"{name} request"] = summarize(measure(request, args.iterations))
+
+    report("OpenAPI schema: worker boot and /schema/ requests", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Render time and bytes on the wire for 1,000-row appointment and availability
+lists with DRF's JSONRenderer, the orjson renderer and MessagePack, raw and
+compressed the way CompressionMiddleware does.
+
+    python -m benchmarks.serialization [--rows N] [--iterations N] \\
+        [--output results.json]
+"""
+
+import argparse
+import gzip
+from datetime import date, datetime, time, timedelta, timezone
+
+from benchmarks import measure, report, setup, summarize
+
+
+def build_rows(rows):
+    from therapy_connect.therapy.models import Appointment, Availability
+    from therapy_connect.therapy.serializers import (
+        AppointmentSerializer,
+        AvailabilitySerializer,
+    )
+
+    start = datetime(2025, 1, 6, 9, tzinfo=timezone.utc)
+    appointments = [
+        Appointment(
+            id=i,
+            panel_id=i % 50 + 1,
+            scheduled_time=start + timedelta(hours=i),
+            duration=60,
+            meeting_platform="zoom",
+            meeting_link=f"https://zoom.us/j/{9000000000 + i}",
+            status="scheduled",
+            payment_status="paid",
+            created_at=start - timedelta(days=7, seconds=i),
+        )
+        for i in range(1, rows + 1)
+    ]
+    availabilities = [
+        Availability(
+            id=i,
+            therapist_id=i % 20 + 1,
+            date=date(2025, 1, 6) + timedelta(days=i // 8),
+            start_time=time(9 + i % 8),
+            end_time=time(10 + i % 8),
+        )
+        for i in range(1, rows + 1)
+    ]
+    return {
+        "appointments": AppointmentSerializer(appointments, many=True).data,
+        "availabilities": AvailabilitySerializer(availabilities, many=True).data,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    setup()
+
+    import brotli
+    from django.conf import settings
+    from rest_framework.renderers import JSONRenderer
+
+    from therapy_connect.core.renderers import MessagePackRenderer, ORJSONRenderer
+
+    renderers = {
+        "drf_json": JSONRenderer(),
+        "orjson": ORJSONRenderer(),
+        "msgpack": MessagePackRenderer(),
+    }
+
+    results = {}
+    for payload_name, data in build_rows(args.rows).items():
+        for renderer_name, renderer in renderers.items():
+
+            def render():
+                return renderer.render(data, renderer.media_type)
+
+            row = summarize(measure(render, args.iterations))
+            content = render()
+            row["bytes"] = len(content)
+            row["gzip_bytes"] = len(gzip.compress(content, compresslevel=6))
+            row["brotli_bytes"] = len(
+                brotli.compress(content, quality=settings.COMPRESSION_BROTLI_QUALITY)
+            )
+            results[f"{payload_name} {renderer_name}"] = row
+
+    report(f"Rendering {args.rows} rows", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
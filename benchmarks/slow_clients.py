@@ -0,0 +1,128 @@
+"""
+Latency of normal requests while slow clients hold connections open.
+
+    python -m benchmarks.slow_clients --url http://localhost:8000 \\
+        [--path /api/therapy/v1/availabilities/] [--token ACCESS_TOKEN] \\
+        [--slow-clients 0 8 32 128] [--slow-seconds 10] [--duration 10] \\
+        [--output out.json]
+
+For each number of slow clients, that many connections trickle their
+request headers over `--slow-seconds` (and then start over) while probe
+requests are sent one after another for `--duration` seconds. Run it once
+against gunicorn with sync workers serving therapy_connect.wsgi and once
+with the uvicorn workers from gunicorn.conf.py serving therapy_connect.asgi
+(ASYNC_VIEWS=true) to compare how many slow clients each can absorb.
+"""
+
+import argparse
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+from benchmarks import report, summarize
+
+CHUNK_SIZE = 8
+
+
+def build_request(host, path, token):
+    lines = [f"GET {path} HTTP/1.1", f"Host: {host}", "Connection: close"]
+    if token:
+        lines.append(f"Authorization: Bearer {token}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+
+async def send_request(host, port, request, send_seconds=0.0):
+    """Send `request`, spread over `send_seconds`, and return the status code."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        bounds = range(0, len(request) + CHUNK_SIZE, CHUNK_SIZE)
+        chunks = [request[start:end] for start, end in zip(bounds, bounds[1:])]
+        for chunk in chunks:
+            writer.write(chunk)
+            await writer.drain()
+            if send_seconds:
+                await asyncio.sleep(send_seconds / len(chunks))
+        status_line = await reader.readline()
+        await reader.read()
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+
+async def slow_client(host, port, request, send_seconds, stop):
+    while not stop.is_set():
+        try:
+            await send_request(host, port, request, send_seconds)
+        except (OSError, ValueError, IndexError):
+            await asyncio.sleep(0.1)
+
+
+async def run_level(args, host, port, request, slow_clients):
+    stop = asyncio.Event()
+    tasks = [
+        asyncio.create_task(slow_client(host, port, request, args.slow_seconds, stop))
+        for _ in range(slow_clients)
+    ]
+    # Let the slow clients occupy their connections first
+    await asyncio.sleep(min(1.0, args.slow_seconds / 2))
+
+    samples = []
+    errors = 0
+    deadline = time.monotonic() + args.duration
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            status = await asyncio.wait_for(
+                send_request(host, port, request), args.timeout
+            )
+        except (OSError, ValueError, IndexError, asyncio.TimeoutError):
+            errors += 1
+            continue
+        if status >= 400:
+            errors += 1
+            continue
+        samples.append(time.perf_counter() - started)
+
+    stop.set()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    row = summarize(samples)
+    # Probes run back to back, so throughput comes from wall-clock time
+    row["per_second"] = len(samples) / args.duration
+    row["errors"] = errors
+    return row
+
+
+async def run(args):
+    url = urlsplit(args.url)
+    host = url.hostname
+    port = url.port or 80
+    request = build_request(url.netloc, args.path, args.token)
+    results = {}
+    for slow_clients in args.slow_clients:
+        row = await run_level(args, host, port, request, slow_clients)
+        results[f"{slow_clients} slow clients"] = row
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--path", default="/api/therapy/v1/availabilities/")
+    parser.add_argument("--token", help="Access token sent with every request.")
+    parser.add_argument("--slow-clients", type=int, nargs="+", default=[0, 8, 32, 128])
+    parser.add_argument("--slow-seconds", type=float, default=10.0)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--timeout", type=float, default=5.0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    title = f"Probe latency with slow clients ({args.url}{args.path})"
+    report(title, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,62 @@
+import gc
+import glob
+import multiprocessing
+import os
+
+# Run the ASGI application in uvicorn workers; each worker serves many
+# concurrent (e.g. slow) clients from its event loop
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "uvicorn_worker.UvicornWorker")
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count()))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+keepalive = 5
+
+# Recycle each worker after a number of requests, staggered by the jitter so
+# they don't all restart at once; bounds slow growth (fragmentation, caches)
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 2000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 200))
+
+# Load Django once in the master; workers share its memory copy-on-write
+# (see pre_fork and post_fork below)
+preload_app = os.environ.get("GUNICORN_PRELOAD", "true").lower() == "true"
+
 loglevel = "info"
 accesslog = "-"  # '-' means log to stdout
 errorlog = "-"  # '-' means log to stderr
+
+
+# Workers write their Prometheus samples to PROMETHEUS_MULTIPROC_DIR (see
+# therapy_connect/core/metrics.py); start each run from an empty directory
+def on_starting(server):
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        os.makedirs(path, exist_ok=True)
+        for file in glob.glob(os.path.join(path, "*.db")):
+            os.remove(file)
+
+
+def pre_fork(server, worker):
+    # Move everything allocated so far out of the collector's reach, so
+    # collections in the workers don't touch (and copy) the shared pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        from therapy_connect.core.db import discard_inherited_pools
+
+        discard_inherited_pools()
+
+
+def post_worker_init(worker):
+    # After the worker has set up its signal handlers, as tracing adds one
+    from therapy_connect.core.memory import start_tracing
+
+    start_tracing()
+
+
+def child_exit(server, worker):
+    # Recycled workers would each leave their Prometheus files behind
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from therapy_connect.core.metrics import archive_dead_process
+
+        archive_dead_process(worker.pid)
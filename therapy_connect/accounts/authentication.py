@@ -0,0 +1,144 @@
+import logging
+
+import redis
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+User = get_user_model()
+
+logger = logging.getLogger(__name__)
+
+USER_STATE_FIELDS = ("is_active", "is_staff", "is_superuser")
+
+
+def user_state_cache_key(user_id):
+    return f"accounts:user-state:{user_id}"
+
+
+def get_user_state(user_id):
+    """
+    Return the user's `is_active`/`is_staff`/`is_superuser` flags.
+
+    The flags are cached for `AUTH_USER_STATE_CACHE_TIMEOUT` seconds, in
+    process memory too, so authenticated requests usually need neither a
+    User query nor a Redis round trip. While Redis is unreachable they are
+    read from the database. Returns None if the user doesn't exist.
+    """
+    cache = caches["tiered"]
+    key = user_state_cache_key(user_id)
+    try:
+        state = cache.get(key)
+    except redis.RedisError:
+        logger.warning("User state cache unavailable", exc_info=True)
+        return query_user_state(user_id)
+    if state is None:
+        state = query_user_state(user_id)
+        if state is None:
+            return None
+        try:
+            cache.set(key, state, settings.AUTH_USER_STATE_CACHE_TIMEOUT)
+        except redis.RedisError:
+            logger.warning("User state cache unavailable", exc_info=True)
+    return state
+
+
+def query_user_state(user_id):
+    return User.objects.filter(pk=user_id).values(*USER_STATE_FIELDS).first()
+
+
+def invalidate_user_state(user_id):
+    caches["tiered"].delete(user_state_cache_key(user_id))
+
+
+class ClaimsUser(TokenUser):
+    """
+    A lightweight user built from the access token claims.
+
+    Role and permission flags come from the token and the cached user
+    state. Any other attribute (name, email, ...) loads the full User
+    model on first access; views that modify the user should work on
+    `load_user(request.user)` instead.
+    """
+
+    def __init__(self, token, state):
+        super().__init__(token)
+        self.state = state
+
+    @cached_property
+    def id(self):
+        return User._meta.pk.to_python(self.token[api_settings.USER_ID_CLAIM])
+
+    @cached_property
+    def pk(self):
+        return self.id
+
+    @cached_property
+    def is_active(self):
+        return self.state["is_active"]
+
+    @cached_property
+    def is_staff(self):
+        return self.state["is_staff"]
+
+    @cached_property
+    def is_superuser(self):
+        return self.state["is_superuser"]
+
+    @cached_property
+    def role(self):
+        if "role" in self.token:
+            return self.token["role"]
+        return self.instance.role
+
+    @cached_property
+    def instance(self):
+        return User.objects.get(pk=self.pk)
+
+    def __getattr__(self, name):
+        if name.startswith("_") or name in ("token", "state", "instance"):
+            raise AttributeError(name)
+        return getattr(self.instance, name)
+
+    def __eq__(self, other):
+        if isinstance(other, (TokenUser, User)):
+            return self.pk == other.pk
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.pk)
+
+
+def load_user(user):
+    """Return the full User model instance for `request.user`."""
+    if isinstance(user, ClaimsUser):
+        return user.instance
+    return user
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that doesn't load the User row on every request.
+
+    The user is built from the token claims, and `is_active` is checked
+    against a short-lived cache that is cleared whenever the user is saved.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+
+        state = get_user_state(user_id)
+        if state is None:
+            raise AuthenticationFailed("User not found", code="user_not_found")
+        if not state["is_active"]:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+
+        return ClaimsUser(validated_token, state)
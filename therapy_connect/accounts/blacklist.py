@@ -0,0 +1,213 @@
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+from functools import lru_cache
+
+import redis
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter.
+
+    Membership tests can return false positives (at roughly `error_rate`)
+    but never false negatives, so a miss means "definitely not added".
+    """
+
+    def __init__(self, capacity=100_000, error_rate=0.001):
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "big")
+        second = int.from_bytes(digest[8:], "big")
+        for i in range(self.hash_count):
+            yield (first + i * second) % self.size
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, item):
+        return all(
+            self.bits[position // 8] & (1 << (position % 8))
+            for position in self._positions(item)
+        )
+
+
+class LocalBlacklist:
+    """
+    In-process blacklist for tests and local development.
+    """
+
+    def __init__(self, **options):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def add(self, jti, expires_at):
+        if expires_at <= time.time():
+            return
+        with self._lock:
+            self._entries[jti] = expires_at
+
+    def contains(self, jti):
+        with self._lock:
+            expires_at = self._entries.get(jti)
+            if expires_at is None:
+                return False
+            if expires_at <= time.time():
+                del self._entries[jti]
+                return False
+            return True
+
+
+class RedisBlacklist:
+    """
+    Blacklist of token ids stored in Redis.
+
+    Each entry expires with the token it revokes, so the store only ever
+    holds tokens that would still be accepted otherwise.
+
+    With `BLOOM_FILTER` enabled, lookups first consult an in-process Bloom
+    filter, so most tokens are found "not revoked" without a round trip.
+    A revocation is stored and published on `CHANNEL` in one transaction,
+    and a daemon thread in every process adds it to the local filter.
+    Until that thread has subscribed and loaded the existing entries, or
+    after it loses the subscription, every lookup goes to Redis. The thread
+    rebuilds the filter every `BLOOM_REFRESH` seconds to forget expired
+    entries, off the request path.
+    """
+
+    def __init__(
+        self,
+        location,
+        key_prefix="token-blacklist:",
+        channel=None,
+        bloom_filter=False,
+        bloom_refresh=3600,
+        bloom_capacity=100_000,
+        **options,
+    ):
+        # The health checks notice a dead subscription between messages
+        self.client = redis.Redis.from_url(
+            location, health_check_interval=30, socket_keepalive=True
+        )
+        self.key_prefix = key_prefix
+        self.channel = channel or f"{key_prefix}revoked"
+        self.use_bloom = bloom_filter
+        self.bloom_refresh = bloom_refresh
+        self.bloom_capacity = bloom_capacity
+        # Only set while complete and kept up to date; None means "ask Redis"
+        self.bloom = None
+        self.pid = None
+        self._lock = threading.Lock()
+
+    def key(self, jti):
+        return f"{self.key_prefix}{jti}"
+
+    def add(self, jti, expires_at):
+        ttl = math.ceil(expires_at - time.time())
+        if ttl <= 0:
+            return
+        if not self.use_bloom:
+            self.client.set(self.key(jti), 1, ex=ttl)
+            return
+
+        self.ensure_listening()
+        # Stored and announced together, or not at all
+        with self.client.pipeline(transaction=True) as pipe:
+            pipe.set(self.key(jti), 1, ex=ttl)
+            pipe.publish(self.channel, jti)
+            pipe.execute()
+        # Don't wait for our own message
+        bloom = self.bloom
+        if bloom is not None:
+            bloom.add(jti)
+
+    def contains(self, jti):
+        if self.use_bloom:
+            self.ensure_listening()
+            bloom = self.bloom
+            if bloom is not None and jti not in bloom:
+                return False
+        return bool(self.client.exists(self.key(jti)))
+
+    def ensure_listening(self):
+        if self.pid == os.getpid():
+            return
+        with self._lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            # A forked child has no listener and may have missed revocations
+            self.bloom = None
+            self.client.connection_pool.reset()
+            thread = threading.Thread(
+                target=self.listen, name="token-blacklist", daemon=True
+            )
+            thread.start()
+
+    def listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub()
+                pubsub.subscribe(self.channel)
+                self.wait_for_subscription(pubsub)
+                while True:
+                    self.rebuild(pubsub)
+                    rebuild_at = time.monotonic() + self.bloom_refresh
+                    while time.monotonic() < rebuild_at:
+                        self.receive(pubsub, timeout=1.0)
+            except redis.RedisError:
+                self.bloom = None
+                logger.warning("Token blacklist listener disconnected")
+                time.sleep(1)
+
+    def wait_for_subscription(self, pubsub):
+        """Block until subscribed, so nothing published after the scan is missed."""
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            message = pubsub.get_message(timeout=1.0)
+            if message and message["type"] == "subscribe":
+                return
+        raise redis.TimeoutError("Subscription to the token blacklist timed out")
+
+    def rebuild(self, pubsub):
+        """Load the stored entries into a new filter and swap it in."""
+        bloom = BloomFilter(self.bloom_capacity)
+        prefix_length = len(self.key_prefix)
+        for key in self.client.scan_iter(match=f"{self.key_prefix}*", count=1000):
+            bloom.add(key[prefix_length:].decode())
+        # Revocations published during the scan waited in the subscription
+        while self.receive(pubsub, timeout=0, extra=bloom):
+            pass
+        self.bloom = bloom
+
+    def receive(self, pubsub, timeout, extra=None):
+        """Add the next published revocation, if any, to the filters."""
+        message = pubsub.get_message(timeout=timeout)
+        if message is None:
+            return False
+        if message["type"] == "message":
+            jti = message["data"].decode()
+            for bloom in (self.bloom, extra):
+                if bloom is not None:
+                    bloom.add(jti)
+        return True
+
+
+@lru_cache(maxsize=None)
+def get_blacklist():
+    """Return the blacklist configured by the TOKEN_BLACKLIST setting."""
+    options = {key.lower(): value for key, value in settings.TOKEN_BLACKLIST.items()}
+    backend = import_string(options.pop("backend"))
+    return backend(**options)
@@ -0,0 +1,83 @@
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from .tasks import update_last_logins
+
+# Bounded pool for the password hash check done by AsyncLoginView
+login_executor = ThreadPoolExecutor(
+    max_workers=settings.LOGIN_THREAD_POOL_SIZE, thread_name_prefix="login"
+)
+
+
+def _run_and_release_connection(func, *args):
+    try:
+        return func(*args)
+    finally:
+        # Pool threads live outside the request cycle, so apply the same
+        # connection cleanup Django does when a request finishes.
+        close_old_connections()
+
+
+async def run_in_login_pool(func, *args):
+    """Run a blocking call (e.g. password hashing) in the login thread pool."""
+    return await sync_to_async(
+        _run_and_release_connection, thread_sensitive=False, executor=login_executor
+    )(func, *args)
+
+
+class LastLoginBuffer:
+    """
+    Collects `last_login` timestamps and writes them in batches.
+
+    A batch is handed to the `update_last_logins` task once it holds
+    `max_size` users or, from a timer thread, `max_age` seconds after its
+    first entry. Whatever is left is flushed at exit. The login request
+    itself never writes to the User table.
+    """
+
+    def __init__(self, max_size, max_age):
+        self.max_size = max_size
+        self.max_age = max_age
+        self._pending = {}
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def add(self, user_id, timestamp):
+        with self._lock:
+            if not self._pending:
+                self._timer = threading.Timer(self.max_age, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+            self._pending[user_id] = timestamp.isoformat()
+            if len(self._pending) < self.max_size:
+                return
+            batch = self._take()
+        self._send(batch)
+
+    def flush(self):
+        with self._lock:
+            batch = self._take()
+        if batch:
+            self._send(batch)
+
+    def _take(self):
+        batch, self._pending = self._pending, {}
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _send(self, batch):
+        update_last_logins.delay(batch)
+
+
+last_login_buffer = LastLoginBuffer(
+    max_size=settings.LAST_LOGIN_BUFFER_SIZE,
+    max_age=settings.LAST_LOGIN_BUFFER_SECONDS,
+)
+atexit.register(last_login_buffer.flush)
@@ -0,0 +1,186 @@
+import csv
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+
+import django
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+
+from therapy_connect.profiles.models import PatientProfile, TherapistProfile
+
+User = get_user_model()
+
+REQUIRED_COLUMNS = ("email", "mobile_number", "first_name", "last_name")
+ROLES = [role for role, _ in User.ROLE_CHOICES]
+
+
+def read_rows(stream, file_format):
+    """Yield one dict per input row without loading the whole file."""
+    if file_format == "csv":
+        yield from csv.DictReader(stream)
+    else:
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk import users (and their patient/therapist profiles) from a CSV or "
+        "NDJSON file. Rows are inserted with bulk_create, so the post_save "
+        "profile signal is not fired per row."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Input file, or '-' to read from stdin.")
+        parser.add_argument(
+            "--format",
+            choices=["csv", "ndjson"],
+            help="Input format. Guessed from the file extension when omitted.",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Processes used to hash passwords (default: CPU count).",
+        )
+        parser.add_argument(
+            "--active",
+            action="store_true",
+            help="Mark imported users as active (skip email verification).",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"]
+        if file_format is None:
+            if path == "-":
+                raise CommandError("--format is required when reading from stdin.")
+            file_format = "csv" if Path(path).suffix.lower() == ".csv" else "ndjson"
+
+        stream = sys.stdin if path == "-" else open(path, newline="")
+        created = skipped = 0
+        started = time.perf_counter()
+
+        try:
+            with ProcessPoolExecutor(
+                max_workers=options["workers"], initializer=django.setup
+            ) as pool:
+                rows = read_rows(stream, file_format)
+                offset = 0
+                for batch in batched(rows, options["batch_size"]):
+                    batch_created, batch_skipped = self.import_batch(
+                        batch, pool, options["active"], offset
+                    )
+                    offset += len(batch)
+                    created += batch_created
+                    skipped += batch_skipped
+                    if options["verbosity"] > 1:
+                        self.stdout.write(f"{created} users imported so far...")
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        elapsed = time.perf_counter() - started
+        rate = (created + skipped) / elapsed if elapsed else 0
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {created} users, skipped {skipped} "
+                f"in {elapsed:.2f}s ({rate:.0f} rows/s)."
+            )
+        )
+
+    def import_batch(self, batch, pool, active, offset=0):
+        """
+        Import a batch of rows; `offset` is the number of rows before it, so
+        errors name the row of the file (counted from 1, without a header).
+        """
+        for index, row in enumerate(batch, offset + 1):
+            missing = [column for column in REQUIRED_COLUMNS if not row.get(column)]
+            if missing:
+                raise CommandError(f"Row {index} is missing {', '.join(missing)}.")
+            # Without a profile, the user couldn't use the API
+            row["role"] = row.get("role") or "patient"
+            if row["role"] not in ROLES:
+                raise CommandError(
+                    f"Row {index} has an invalid role {row['role']!r}, "
+                    f"expected one of {', '.join(ROLES)}."
+                )
+            row["email"] = User.objects.normalize_email(row["email"])
+
+        # Skip rows that clash with existing users or with earlier rows.
+        # Emails are unique whatever their case (accounts_user_email_ci_unique).
+        existing = (
+            User.objects.annotate(email_lower=Lower("email"))
+            .filter(
+                Q(email_lower__in=[row["email"].lower() for row in batch])
+                | Q(mobile_number__in=[row["mobile_number"] for row in batch])
+            )
+            .values_list("email_lower", "mobile_number")
+        )
+        taken_emails = {email for email, _ in existing}
+        taken_numbers = {mobile_number for _, mobile_number in existing}
+        rows = []
+        for row in batch:
+            email = row["email"].lower()
+            if email in taken_emails or row["mobile_number"] in taken_numbers:
+                continue
+            taken_emails.add(email)
+            taken_numbers.add(row["mobile_number"])
+            rows.append(row)
+        if not rows:
+            return 0, len(batch)
+
+        passwords = pool.map(
+            make_password,
+            [row.get("password") or None for row in rows],
+            chunksize=max(1, len(rows) // 16),
+        )
+        users = [
+            User(
+                email=row["email"],
+                username=row["email"],
+                mobile_number=row["mobile_number"],
+                first_name=row["first_name"],
+                last_name=row["last_name"],
+                role=row["role"],
+                password=password,
+                is_active=active,
+            )
+            for row, password in zip(rows, passwords)
+        ]
+
+        with transaction.atomic():
+            User.objects.bulk_create(users)
+            PatientProfile.objects.bulk_create(
+                [PatientProfile(user=user) for user in users if user.role == "patient"]
+            )
+            TherapistProfile.objects.bulk_create(
+                [
+                    TherapistProfile(
+                        user=user,
+                        qualifications=row.get("qualifications") or "",
+                        time_zone=row.get("time_zone") or "UTC",
+                    )
+                    for user, row in zip(users, rows)
+                    if user.role == "therapist"
+                ]
+            )
+
+        return len(users), len(batch) - len(users)
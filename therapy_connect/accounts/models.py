@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser, PermissionsMixin
 from django.db import models
+from django.db.models.functions import Lower
 
 from .managers import UserManager
 
@@ -27,6 +28,14 @@ class User(AbstractUser, PermissionsMixin):
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = ["first_name", "last_name", "mobile_number"]
 
+    class Meta(AbstractUser.Meta):
+        constraints = [
+            # Registration relies on this instead of checking the email first
+            models.UniqueConstraint(
+                Lower("email"), name="accounts_user_email_ci_unique"
+            ),
+        ]
+
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
@@ -0,0 +1,82 @@
+from django.http import Http404
+
+from therapy_connect.profiles.models import PatientProfile, TherapistProfile
+
+PROFILE_MODELS = {
+    "patient": PatientProfile,
+    "therapist": TherapistProfile,
+}
+
+
+def get_profile_id(user):
+    """
+    Return the id of the profile matching the user's role, or None.
+    """
+    model = PROFILE_MODELS.get(user.role)
+    if model is None:
+        return None
+    return model.objects.filter(user_id=user.pk).values_list("id", flat=True).first()
+
+
+class RoleContext:
+    """
+    The role and profile id of the user making a request.
+
+    Views and serializers use the ids to filter by `patient_id` or
+    `therapist_id` directly instead of loading the profile objects.
+    """
+
+    def __init__(self, role=None, profile_id=None):
+        self.role = role if profile_id is not None else None
+        self.profile_id = profile_id
+
+    @property
+    def is_patient(self):
+        return self.role == "patient"
+
+    @property
+    def is_therapist(self):
+        return self.role == "therapist"
+
+    @property
+    def patient_id(self):
+        return self.profile_id if self.is_patient else None
+
+    @property
+    def therapist_id(self):
+        return self.profile_id if self.is_therapist else None
+
+    def patient_id_or_404(self):
+        if not self.is_patient:
+            raise Http404("No PatientProfile matches the given query.")
+        return self.profile_id
+
+    def therapist_id_or_404(self):
+        if not self.is_therapist:
+            raise Http404("No TherapistProfile matches the given query.")
+        return self.profile_id
+
+
+def get_role_context(request):
+    """
+    Resolve the role context once per request.
+
+    The role and profile id are read from the access token claims set at
+    login. Requests authenticated another way (e.g. session) or with a
+    token issued before the claims existed fall back to a single query.
+    """
+    context = getattr(request, "_role_context", None)
+    if context is not None:
+        return context
+
+    token = getattr(request, "auth", None)
+    user = request.user
+    if token is not None and "role" in token and "profile_id" in token:
+        context = RoleContext(token["role"], token["profile_id"])
+    elif user.is_authenticated:
+        context = RoleContext(user.role, get_profile_id(user))
+    else:
+        context = RoleContext()
+
+    request._role_context = context
+    return context
@@ -1,3 +1,4 @@
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
 from drf_spectacular.utils import (
     OpenApiExample,
     OpenApiParameter,
@@ -598,3 +599,9 @@ get_refresh_token = extend_schema(
         ),
     ],
 )
+
+
+class StatelessJWTScheme(SimpleJWTScheme):
+    """Document StatelessJWTAuthentication as the same bearer scheme."""
+
+    target_class = "therapy_connect.accounts.authentication.StatelessJWTAuthentication"
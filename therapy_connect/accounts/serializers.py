@@ -1,6 +1,16 @@
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
+from django.db.models.functions import Lower
+from django.utils import timezone
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import (
+    TokenObtainPairSerializer,
+    TokenRefreshSerializer,
+)
+
+from .login import last_login_buffer
+from .tokens import RoleRefreshToken
+from .utils import unique_user_fields
 
 User = get_user_model()
 
@@ -11,10 +21,16 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ["first_name", "last_name", "email", "mobile_number", "password"]
+        # Uniqueness is enforced by the database; see create()
+        extra_kwargs = {
+            "email": {"validators": []},
+            "mobile_number": {"validators": []},
+        }
 
     def create(self, validated_data):
         # Create the user using the UserManager
-        user = User.objects.create_user(**validated_data)
+        with unique_user_fields():
+            user = User.objects.create_user(**validated_data)
         return user
 
 
@@ -31,6 +47,8 @@ class UserProfileUpdateSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ["first_name", "last_name", "mobile_number", "email", "password"]
+        # Uniqueness is enforced by the database when the change is saved
+        extra_kwargs = {"mobile_number": {"validators": []}}
 
     def validate(self, data):
         # Ensure at least one field is provided
@@ -48,32 +66,30 @@ class UserProfileUpdateSerializer(serializers.ModelSerializer):
         return data
 
     def validate_email(self, value):
-        """
-        Validate that the email is unique and not already in use by another user.
-        """
-        user = self.context["request"].user  # Get the current user
-        if User.objects.filter(email=value).exclude(pk=user.pk).exists():
-            raise ValidationError("This email is already in use.")
-        return value
-
-    def validate_mobile_number(self, value):
-        """
-        Validate that the mobile number is unique and not already in use by another user.
-        """
-        user = self.context["request"].user  # Get the current user
-        if User.objects.filter(mobile_number=value).exclude(pk=user.pk).exists():
-            raise ValidationError("This mobile number is already in use.")
+        # A new email is only saved once its link is followed, so turn down
+        # a taken one now rather than mail the link to its owner
+        taken = (
+            User.objects.alias(email_lower=Lower("email"))
+            .filter(email_lower=value.lower())
+            .exclude(pk=self.instance.pk)
+        )
+        if taken.exists():
+            raise serializers.ValidationError("This email is already in use.")
         return value
 
 
 class PasswordResetRequestSerializer(serializers.Serializer):
     email = serializers.EmailField()
 
-    def validate_email(self, value):
-        # Check if the email exists in the database
-        if not User.objects.filter(email=value).exists():
-            raise serializers.ValidationError("User with this email does not exist.")
-        return value
+    def validate(self, data):
+        # Look the user up once; the view reuses it from validated_data
+        user = User.objects.filter(email=data["email"]).first()
+        if user is None:
+            raise serializers.ValidationError(
+                {"email": "User with this email does not exist."}
+            )
+        data["user"] = user
+        return data
 
 
 class PasswordResetConfirmSerializer(serializers.Serializer):
@@ -86,3 +102,26 @@ class PasswordResetConfirmSerializer(serializers.Serializer):
                 "Password must be at least 8 characters long."
             )
         return value
+
+
+class RoleTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """
+    Issue tokens that embed the user's role and profile id as claims.
+
+    `last_login` is buffered and written in batches off the request path.
+    """
+
+    token_class = RoleRefreshToken
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        last_login_buffer.add(self.user.pk, timezone.now())
+        return data
+
+
+class RoleTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Refresh (and rotate) tokens against the token blacklist store.
+    """
+
+    token_class = RoleRefreshToken
@@ -0,0 +1,16 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import invalidate_user_state
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def clear_cached_user_state(sender, instance, **kwargs):
+    """
+    Drop the cached auth state so deactivation takes effect immediately.
+    """
+    invalidate_user_state(instance.pk)
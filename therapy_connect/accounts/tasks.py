@@ -0,0 +1,221 @@
+import json
+import logging
+import time
+from datetime import datetime
+from functools import lru_cache
+from smtplib import SMTPException, SMTPServerDisconnected
+
+import redis
+from celery import shared_task
+from celery.signals import worker_process_shutdown
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken,
+)
+
+from therapy_connect.core.metrics import TASK_ROWS
+
+from .blacklist import get_blacklist
+
+User = get_user_model()
+
+logger = logging.getLogger(__name__)
+
+# One SMTP connection per worker process, reused by every email task
+_email_connection = None
+
+OUTBOX_KEY = "accounts:email-outbox"
+# The batches being sent, by task id, scored by when they were taken
+OUTBOX_BATCHES_KEY = f"{OUTBOX_KEY}:batches"
+
+
+def get_email_connection():
+    global _email_connection
+    if _email_connection is None:
+        _email_connection = get_connection(fail_silently=False)
+        _email_connection.open()
+    return _email_connection
+
+
+@worker_process_shutdown.connect
+def close_email_connection(**kwargs):
+    global _email_connection
+    if _email_connection is not None:
+        connection, _email_connection = _email_connection, None
+        try:
+            connection.close()
+        except (SMTPException, OSError):
+            # It's being dropped anyway
+            pass
+
+
+def deliver(subject, message, recipient_list, dedupe_key):
+    """
+    Send an email over the worker's SMTP connection, once per dedupe key.
+
+    The dedupe key is claimed before sending and released if sending
+    fails, so retries go through but duplicates of a sent message don't.
+    A connection the server closed while idle is reopened once.
+    """
+    cache_key = f"accounts:email-sent:{dedupe_key}"
+    if not cache.add(cache_key, True, settings.EMAIL_DEDUPE_TIMEOUT):
+        logger.info("Skipping duplicate email %s", dedupe_key)
+        return "duplicate"
+
+    email = EmailMessage(subject, message, settings.EMAIL_HOST_USER, recipient_list)
+    try:
+        try:
+            get_email_connection().send_messages([email])
+        except SMTPServerDisconnected:
+            close_email_connection()
+            get_email_connection().send_messages([email])
+    except Exception:
+        cache.delete(cache_key)
+        # Drop the connection so the retry reconnects
+        close_email_connection()
+        raise
+    return "sent"
+
+
+@lru_cache(maxsize=None)
+def get_outbox():
+    return redis.Redis.from_url(settings.EMAIL_OUTBOX_URL)
+
+
+def add_to_outbox(subject, message, recipient_list, dedupe_key):
+    """Queue an email for the next send_outbox batch, and make sure one runs."""
+    get_outbox().rpush(
+        OUTBOX_KEY, json.dumps([subject, message, recipient_list, dedupe_key])
+    )
+    send_outbox.delay()
+
+
+@shared_task(
+    bind=True,
+    autoretry_for=(SMTPException, OSError),
+    retry_backoff=True,
+    retry_backoff_max=600,
+    retry_jitter=True,
+    max_retries=5,
+)
+def send_email(self, subject, message, recipient_list, dedupe_key):
+    """
+    Send a transactional email over the worker's persistent SMTP connection.
+    """
+    return deliver(subject, message, recipient_list, dedupe_key)
+
+
+def batch_key(task_id):
+    return f"{OUTBOX_KEY}:batch:{task_id}"
+
+
+def requeue_abandoned_batches(outbox):
+    """
+    Put the unsent emails of batches whose task died back in the outbox.
+
+    A batch older than the task time limit belongs to a task that was
+    killed or whose worker crashed.
+    """
+    cutoff = time.time() - settings.CELERY_TASK_TIME_LIMIT
+    for task_id in outbox.zrangebyscore(OUTBOX_BATCHES_KEY, "-inf", cutoff):
+        key = batch_key(task_id.decode())
+        # Taken from the end and pushed to the front, so they keep their order
+        while outbox.lmove(key, OUTBOX_KEY, "RIGHT", "LEFT") is not None:
+            pass
+        outbox.zrem(OUTBOX_BATCHES_KEY, task_id)
+
+
+@shared_task(bind=True)
+def send_outbox(self):
+    """
+    Send up to EMAIL_BATCH_SIZE emails from the outbox over one connection.
+
+    Each queued email also queues this task, so under load the first run
+    sends a batch and the later ones find less, or nothing, left. When an
+    email fails, it and the rest of the batch are handed to send_email,
+    which retries each with backoff.
+
+    The batch is moved to a list of this task's own and each email is
+    removed from it once sent, so emails a crashed task took are put back
+    by a later run (see requeue_abandoned_batches) instead of being lost.
+    """
+    if not settings.EMAIL_OUTBOX_URL:
+        return "No outbox"
+    outbox = get_outbox()
+    requeue_abandoned_batches(outbox)
+
+    task_id = self.request.id
+    key = batch_key(task_id)
+    with outbox.pipeline(transaction=True) as pipe:
+        pipe.zadd(OUTBOX_BATCHES_KEY, {task_id: time.time()})
+        for _ in range(settings.EMAIL_BATCH_SIZE):
+            pipe.lmove(OUTBOX_KEY, key, "LEFT", "RIGHT")
+        batch = [item for item in pipe.execute()[1:] if item is not None]
+
+    emails = [json.loads(item) for item in batch]
+    sent = 0
+    for index, email in enumerate(emails):
+        try:
+            if deliver(*email) == "sent":
+                sent += 1
+        except (SMTPException, OSError):
+            logger.warning("Retrying %d emails one by one", len(emails) - index)
+            for email in emails[index:]:
+                send_email.delay(*email)
+            break
+        outbox.lpop(key)
+
+    with outbox.pipeline(transaction=True) as pipe:
+        pipe.delete(key)
+        pipe.zrem(OUTBOX_BATCHES_KEY, task_id)
+        pipe.execute()
+    return f"Sent {sent} of {len(emails)} emails"
+
+
+@shared_task
+def purge_expired_tokens(batch_size=1000):
+    """
+    Trim expired rows from the SimpleJWT token blacklist tables.
+
+    Tokens still blacklisted in the database (from before the blacklist
+    store was introduced) are first copied to the store so they stay
+    revoked. Expired outstanding tokens are then deleted in batches, which
+    also removes their BlacklistedToken rows.
+    """
+    now = timezone.now()
+    blacklist = get_blacklist()
+    still_valid = BlacklistedToken.objects.filter(
+        token__expires_at__gt=now
+    ).values_list("token__jti", "token__expires_at")
+    for jti, expires_at in still_valid.iterator(chunk_size=batch_size):
+        blacklist.add(jti, expires_at.timestamp())
+
+    deleted = 0
+    expired = OutstandingToken.objects.filter(expires_at__lte=now)
+    while True:
+        ids = list(expired.values_list("id", flat=True)[:batch_size])
+        if not ids:
+            break
+        OutstandingToken.objects.filter(id__in=ids).delete()
+        deleted += len(ids)
+    TASK_ROWS.labels(purge_expired_tokens.name).inc(deleted)
+    return f"Purged {deleted} expired tokens"
+
+
+@shared_task
+def update_last_logins(batch):
+    """
+    Write buffered `last_login` timestamps ({user_id: isoformat}) in one go.
+    """
+    users = [
+        User(pk=user_id, last_login=datetime.fromisoformat(timestamp))
+        for user_id, timestamp in batch.items()
+    ]
+    User.objects.bulk_update(users, ["last_login"], batch_size=500)
+    TASK_ROWS.labels(update_last_logins.name).inc(len(users))
+    return f"Updated last_login for {len(users)} users"
@@ -0,0 +1,796 @@
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from smtplib import SMTPException, SMTPServerDisconnected
+from types import SimpleNamespace
+from unittest import mock
+
+import msgpack
+import redis
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.signing import TimestampSigner
+from django.db import IntegrityError, connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.test.client import encode_multipart
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.http import (
+    urlencode,
+    urlsafe_base64_decode,
+    urlsafe_base64_encode,
+)
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken,
+)
+from rest_framework_simplejwt.tokens import AccessToken
+
+from therapy_connect.core.testing import PASSWORD, QueryBudgetTestCase, create_user
+from therapy_connect.profiles.models import PatientProfile, TherapistProfile
+
+from .blacklist import BloomFilter, LocalBlacklist, RedisBlacklist
+from .login import LastLoginBuffer
+from .roles import get_role_context
+from .tasks import (
+    close_email_connection,
+    deliver,
+    purge_expired_tokens,
+    requeue_abandoned_batches,
+    send_outbox,
+)
+from .tokens import RoleRefreshToken
+from .utils import unique_field_errors
+from .views import AsyncLoginView
+
+User = get_user_model()
+
+# Queries each endpoint may make, whatever the number of other users
+QUERY_BUDGETS = {
+    "register": 7,
+    "verify-email": 2,
+    "login": 2,
+    "token-refresh": 1,
+    "profile": 2,
+    "profile-update": 5,
+    "verify-email-password": 4,
+    "logout": 1,
+    "deactivate": 3,
+    "password-reset": 1,
+    "password-reset-confirm": 2,
+}
+
+
+class AccountsQueryBudgetTests(QueryBudgetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user("patient", 1)
+
+    def add_users(self, count):
+        """Other users, half of them therapists."""
+        return [
+            create_user("therapist" if i % 2 else "patient", 100 + i)
+            for i in range(count)
+        ]
+
+    def test_register(self):
+        def prepare(count):
+            self.add_users(count)
+            url = reverse("accounts:user-register")
+            data = {
+                "first_name": "New",
+                "last_name": "Patient",
+                "email": "new@example.com",
+                "mobile_number": "3000000001",
+                "password": PASSWORD,
+            }
+            return lambda: self.client.post(url, data)
+
+        self.assertQueryBudget(QUERY_BUDGETS["register"], prepare, status=201)
+
+    def test_verify_email(self):
+        def prepare(count):
+            self.add_users(count)
+            url = reverse("accounts:user-verify-email")
+            token = TimestampSigner().sign(str(self.user.pk))
+            return lambda: self.client.get(url, {"token": token})
+
+        self.assertQueryBudget(QUERY_BUDGETS["verify-email"], prepare)
+
+    def test_login(self):
+        def prepare(count):
+            self.add_users(count)
+            url = reverse("accounts:user-login")
+            data = {"email": self.user.email, "password": PASSWORD}
+            return lambda: self.client.post(url, data)
+
+        self.assertQueryBudget(QUERY_BUDGETS["login"], prepare)
+
+    def test_token_refresh(self):
+        def prepare(count):
+            self.add_users(count)
+            url = reverse("accounts:user-token-refresh")
+            refresh = str(RoleRefreshToken.for_user(self.user))
+            return lambda: self.client.post(url, {"refresh": refresh})
+
+        self.assertQueryBudget(QUERY_BUDGETS["token-refresh"], prepare)
+
+    def test_profile(self):
+        self.authenticate(self.user)
+
+        def prepare(count):
+            self.add_users(count)
+            url = reverse("accounts:user-profile")
+            return lambda: self.client.get(url)
+
+        self.assertQueryBudget(QUERY_BUDGETS["profile"], prepare)
+
+    def test_profile_update(self):
+        self.authenticate(self.user)
+
+        def prepare(count):
+            self.add_users(count)
+            url = reverse("accounts:user-profile-update")
+            return lambda: self.client.patch(url, {"first_name": "Renamed"})
+
+        self.assertQueryBudget(QUERY_BUDGETS["profile-update"], prepare)
+
+    def test_verify_email_password(self):
+        def prepare(count):
+            self.add_users(count)
+            url = reverse("accounts:user-verify-email-password")
+            # As built by send_verification_email for a profile update
+            token_data = {
+                "user_id": self.user.pk,
+                "email": "renamed@example.com",
+                "password_hash": None,
+            }
+            token = TimestampSigner().sign(
+                urlsafe_base64_encode(force_bytes(str(token_data)))
+            )
+            return lambda: self.client.get(url, {"token": token})
+
+        self.assertQueryBudget(QUERY_BUDGETS["verify-email-password"], prepare)
+
+    def test_logout(self):
+        self.authenticate(self.user)
+
+        def prepare(count):
+            self.add_users(count)
+            url = reverse("accounts:logout")
+            refresh = str(RoleRefreshToken.for_user(self.user))
+            return lambda: self.client.post(url, {"refresh_token": refresh})
+
+        self.assertQueryBudget(QUERY_BUDGETS["logout"], prepare, status=205)
+
+    def test_deactivate(self):
+        self.authenticate(self.user)
+
+        def prepare(count):
+            self.add_users(count)
+            url = reverse("accounts:user-deactivate")
+            return lambda: self.client.delete(url)
+
+        self.assertQueryBudget(QUERY_BUDGETS["deactivate"], prepare, status=204)
+
+    def test_password_reset(self):
+        def prepare(count):
+            self.add_users(count)
+            url = reverse("accounts:user-password-reset")
+            return lambda: self.client.post(url, {"email": self.user.email})
+
+        self.assertQueryBudget(QUERY_BUDGETS["password-reset"], prepare)
+
+    def test_password_reset_confirm(self):
+        def prepare(count):
+            self.add_users(count)
+            token = TimestampSigner().sign(str(self.user.pk))
+            url = reverse("accounts:user-password-reset-confirm", args=[token])
+            return lambda: self.client.post(url, {"password": "new-password"})
+
+        self.assertQueryBudget(QUERY_BUDGETS["password-reset-confirm"], prepare)
+
+
+class ImportUsersTests(TestCase):
+    header = "email,mobile_number,first_name,last_name,role\n"
+
+    def import_users(self, *lines, batch_size=2):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv") as file:
+            file.write(self.header + "".join(f"{line}\n" for line in lines))
+            file.flush()
+            call_command(
+                "import_users",
+                file.name,
+                batch_size=batch_size,
+                workers=1,
+                stdout=StringIO(),
+            )
+
+    def test_creates_users_and_profiles(self):
+        self.import_users(
+            "a@example.com,1000000001,Ann,A,patient",
+            "b@example.com,1000000002,Ben,B,therapist",
+            "c@example.com,1000000003,Cy,C,",
+        )
+
+        self.assertEqual(User.objects.count(), 3)
+        self.assertEqual(PatientProfile.objects.count(), 2)
+        self.assertEqual(TherapistProfile.objects.get().user.email, "b@example.com")
+
+    def test_error_names_the_row_of_the_file(self):
+        with self.assertRaisesMessage(CommandError, "Row 4 is missing first_name"):
+            self.import_users(
+                "a@example.com,1000000001,Ann,A,patient",
+                "b@example.com,1000000002,Ben,B,patient",
+                "c@example.com,1000000003,Cy,C,patient",
+                "d@example.com,1000000004,,D,patient",
+            )
+
+    def test_rejects_unknown_roles(self):
+        for role in ("Therapist", "admin"):
+            with self.subTest(role=role):
+                with self.assertRaisesMessage(CommandError, "invalid role"):
+                    self.import_users(f"a@example.com,1000000001,Ann,A,{role}")
+                self.assertFalse(User.objects.exists())
+
+    def test_skips_emails_differing_only_by_case(self):
+        User.objects.create(
+            email="taken@example.com",
+            username="taken@example.com",
+            mobile_number="1000000001",
+        )
+
+        self.import_users(
+            "TAKEN@example.com,1000000002,Ann,A,patient",
+            "new@example.com,1000000003,Ben,B,patient",
+            "NEW@example.com,1000000004,Cy,C,patient",
+            batch_size=10,
+        )
+
+        self.assertEqual(
+            sorted(User.objects.values_list("email", flat=True)),
+            ["new@example.com", "taken@example.com"],
+        )
+
+
+# The query of roles.get_profile_id()
+PROFILE_LOOKUP = re.compile(
+    r'SELECT "(profiles_\w+profile)"\."id" FROM "\1" WHERE "\1"\."user_id" ='
+)
+
+
+class RoleContextTests(QueryBudgetTestCase):
+    """The role and profile id come from the token, not a profile query."""
+
+    # (role, url name) of endpoints that resolve the role context
+    endpoints = [
+        ("patient", "profiles:patient-profile"),
+        ("patient", "therapy:list-therapy-panels"),
+        ("patient", "therapy:list-patient-appointments"),
+        ("therapist", "profiles:therapist-profile"),
+        ("therapist", "therapy:list-therapy-panels"),
+        ("therapist", "therapy:list-therapist-appointments"),
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = {
+            "patient": create_user("patient", 1),
+            "therapist": create_user("therapist", 1),
+        }
+
+    def profile_lookups(self, url, token):
+        """The profile-by-user queries of a GET made with the token."""
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [
+            query["sql"]
+            for query in queries.captured_queries
+            if PROFILE_LOOKUP.match(query["sql"])
+        ]
+
+    def test_claims_replace_the_profile_lookup(self):
+        for role, name in self.endpoints:
+            with self.subTest(role=role, endpoint=name):
+                token = RoleRefreshToken.for_user(self.users[role]).access_token
+                self.assertEqual(self.profile_lookups(reverse(name), token), [])
+
+    def test_tokens_without_claims_look_the_profile_up_once(self):
+        for role, name in self.endpoints:
+            with self.subTest(role=role, endpoint=name):
+                token = AccessToken.for_user(self.users[role])
+                self.assertEqual(len(self.profile_lookups(reverse(name), token)), 1)
+
+    def test_context_is_resolved_once_per_request(self):
+        user = self.users["therapist"]
+        request = APIRequestFactory().get("/")
+        request.user = user
+        request.auth = AccessToken.for_user(user)
+
+        with self.assertNumQueries(1):
+            context = get_role_context(request)
+        with self.assertNumQueries(0):
+            self.assertIs(get_role_context(request), context)
+        self.assertEqual(context.therapist_id, user.therapist_profile.pk)
+
+    def test_context_from_claims_makes_no_query(self):
+        user = self.users["patient"]
+        request = APIRequestFactory().get("/")
+        request.user = user
+        request.auth = RoleRefreshToken.for_user(user).access_token
+
+        with self.assertNumQueries(0):
+            context = get_role_context(request)
+        self.assertEqual(context.patient_id, user.patient_profile.pk)
+
+
+class EmailTaskTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        close_email_connection()
+        self.addCleanup(close_email_connection)
+
+    def test_sends_each_dedupe_key_once(self):
+        self.assertEqual(deliver("Hi", "Body", ["a@example.com"], "key"), "sent")
+        self.assertEqual(deliver("Hi", "Body", ["a@example.com"], "key"), "duplicate")
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_reconnects_once_when_the_server_dropped_the_connection(self):
+        stale, fresh = mock.Mock(), mock.Mock()
+        stale.send_messages.side_effect = SMTPServerDisconnected()
+        with mock.patch(
+            "therapy_connect.accounts.tasks.get_connection", side_effect=[stale, fresh]
+        ):
+            self.assertEqual(deliver("Hi", "Body", ["a@example.com"], "key"), "sent")
+        fresh.send_messages.assert_called_once()
+
+
+@override_settings(EMAIL_OUTBOX_URL="redis://redis:6379/3")
+class EmailOutboxTests(TestCase):
+    emails = [["Hi", "Body", [f"{i}@example.com"], f"key-{i}"] for i in range(3)]
+
+    def setUp(self):
+        self.outbox = mock.MagicMock()
+        self.outbox.zrangebyscore.return_value = []
+        pipe = self.outbox.pipeline.return_value.__enter__.return_value
+        batch = [json.dumps(email) for email in self.emails]
+        pipe.execute.return_value = [1, *batch, None]
+        self.pipe = pipe
+        self.enterContext(
+            mock.patch(
+                "therapy_connect.accounts.tasks.get_outbox", return_value=self.outbox
+            )
+        )
+
+    def send_outbox(self, *results):
+        with mock.patch("therapy_connect.accounts.tasks.deliver", side_effect=results):
+            return send_outbox.apply(task_id="task").get()
+
+    def test_removes_each_email_from_the_batch_once_sent(self):
+        self.assertEqual(
+            self.send_outbox("sent", "duplicate", "sent"), "Sent 2 of 3 emails"
+        )
+        self.assertEqual(self.outbox.lpop.call_count, 3)
+        self.outbox.lpop.assert_called_with("accounts:email-outbox:batch:task")
+        self.pipe.delete.assert_called_once_with("accounts:email-outbox:batch:task")
+
+    def test_hands_the_rest_of_a_failed_batch_to_send_email(self):
+        with mock.patch("therapy_connect.accounts.tasks.send_email.delay") as delay:
+            self.assertEqual(
+                self.send_outbox("sent", SMTPException()), "Sent 1 of 3 emails"
+            )
+        self.assertEqual(
+            [list(call.args) for call in delay.call_args_list], self.emails[1:]
+        )
+        self.pipe.delete.assert_called_once()
+
+    def test_keeps_the_batch_when_the_task_dies(self):
+        with self.assertRaises(RuntimeError):
+            self.send_outbox("sent", RuntimeError())
+        self.outbox.lpop.assert_called_once()
+        self.pipe.delete.assert_not_called()
+
+    def test_puts_back_batches_of_dead_tasks(self):
+        self.outbox.zrangebyscore.return_value = [b"dead"]
+        self.outbox.lmove.side_effect = [b"second", b"first", None]
+        requeue_abandoned_batches(self.outbox)
+
+        self.outbox.lmove.assert_called_with(
+            "accounts:email-outbox:batch:dead", "accounts:email-outbox", "RIGHT", "LEFT"
+        )
+        self.assertEqual(self.outbox.lmove.call_count, 3)
+        self.outbox.zrem.assert_called_once_with(
+            "accounts:email-outbox:batches", b"dead"
+        )
+
+    def test_registration_succeeds_when_the_outbox_is_down(self):
+        self.outbox.rpush.side_effect = redis.ConnectionError()
+        data = {
+            "first_name": "New",
+            "last_name": "Patient",
+            "email": "new@example.com",
+            "mobile_number": "3000000001",
+            "password": PASSWORD,
+        }
+        with (
+            self.assertLogs("therapy_connect.accounts.utils", "ERROR"),
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            response = self.client.post(reverse("accounts:user-register"), data)
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(User.objects.filter(email="new@example.com").exists())
+
+
+class ProfileUpdateVerificationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user("patient", 1)
+
+    def test_link_carries_no_plaintext_password(self):
+        access = RoleRefreshToken.for_user(self.user).access_token
+        with mock.patch("therapy_connect.accounts.utils.queue_email") as queue_email:
+            response = self.client.patch(
+                reverse("accounts:user-profile-update"),
+                {"password": "a-new-password"},
+                headers={"Authorization": f"Bearer {access}"},
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200)
+        [(subject, message, recipients, dedupe_key)] = [
+            call.args for call in queue_email.call_args_list
+        ]
+        token = re.search(r"token=(\S+)", message)[1]
+        payload = urlsafe_base64_decode(TimestampSigner().unsign(token))
+        self.assertNotIn(b"a-new-password", payload)
+
+        response = self.client.get(
+            reverse("accounts:user-verify-email-password"), {"token": token}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password("a-new-password"))
+
+
+class BloomFilterTests(SimpleTestCase):
+    def test_has_no_false_negatives(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        items = [f"jti-{i}" for i in range(1000)]
+        for item in items:
+            bloom.add(item)
+        self.assertTrue(all(item in bloom for item in items))
+        # Roughly error_rate false positives at capacity
+        misses = sum(f"other-{i}" in bloom for i in range(1000))
+        self.assertLess(misses, 50)
+
+
+class LocalBlacklistTests(SimpleTestCase):
+    def test_entries_expire_with_their_token(self):
+        blacklist = LocalBlacklist()
+        now = time.time()
+        blacklist.add("expired", now - 1)
+        blacklist.add("valid", now + 60)
+        self.assertFalse(blacklist.contains("expired"))
+        self.assertTrue(blacklist.contains("valid"))
+
+        with mock.patch("time.time", return_value=now + 61):
+            self.assertFalse(blacklist.contains("valid"))
+
+
+class RedisBlacklistTests(SimpleTestCase):
+    def setUp(self):
+        self.blacklist = RedisBlacklist("redis://redis:6379/1", bloom_filter=True)
+        # Stand in for the listener thread
+        self.blacklist.pid = os.getpid()
+        self.blacklist.client = mock.Mock()
+
+    def test_asks_redis_until_the_filter_is_loaded(self):
+        self.blacklist.client.exists.return_value = 1
+        self.assertTrue(self.blacklist.contains("jti"))
+        self.blacklist.client.exists.assert_called_once_with("token-blacklist:jti")
+
+    def test_filter_answers_for_tokens_never_revoked(self):
+        self.blacklist.bloom = BloomFilter(capacity=100)
+        self.blacklist.bloom.add("revoked")
+        self.blacklist.client.exists.return_value = 1
+
+        self.assertFalse(self.blacklist.contains("jti"))
+        self.blacklist.client.exists.assert_not_called()
+        self.assertTrue(self.blacklist.contains("revoked"))
+
+
+class RevokedRefreshTokenTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user("patient", 1)
+
+    def refresh(self, token):
+        return self.client.post(
+            reverse("accounts:user-token-refresh"), {"refresh": token}
+        )
+
+    def test_rotated_tokens_cant_be_reused(self):
+        refresh = str(RoleRefreshToken.for_user(self.user))
+        response = self.refresh(refresh)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.data["refresh"], refresh)
+
+        self.assertEqual(self.refresh(refresh).status_code, 401)
+        self.assertEqual(self.refresh(response.data["refresh"]).status_code, 200)
+
+    def test_tokens_cant_be_refreshed_after_logout(self):
+        refresh = RoleRefreshToken.for_user(self.user)
+        response = self.client.post(
+            reverse("accounts:logout"),
+            {"refresh_token": str(refresh)},
+            headers={"Authorization": f"Bearer {refresh.access_token}"},
+        )
+        self.assertEqual(response.status_code, 205)
+
+        self.assertEqual(self.refresh(str(refresh)).status_code, 401)
+
+    def test_logout_doesnt_hide_blacklist_errors(self):
+        refresh = RoleRefreshToken.for_user(self.user)
+        self.client.raise_request_exception = True
+        with (
+            mock.patch.object(
+                RoleRefreshToken, "blacklist", side_effect=redis.ConnectionError()
+            ),
+            self.assertRaises(redis.ConnectionError),
+        ):
+            self.client.post(
+                reverse("accounts:logout"),
+                {"refresh_token": str(refresh)},
+                headers={"Authorization": f"Bearer {refresh.access_token}"},
+            )
+
+
+class PurgeExpiredTokensTests(TestCase):
+    def setUp(self):
+        self.user = create_user("patient", 1)
+        self.blacklist = LocalBlacklist()
+        self.enterContext(
+            mock.patch(
+                "therapy_connect.accounts.tasks.get_blacklist",
+                return_value=self.blacklist,
+            )
+        )
+
+    def outstanding(self, jti, expires_in):
+        now = timezone.now()
+        return OutstandingToken.objects.create(
+            user=self.user,
+            jti=jti,
+            token=jti,
+            created_at=now,
+            expires_at=now + timedelta(seconds=expires_in),
+        )
+
+    def test_copies_revocations_and_deletes_expired_tokens_in_batches(self):
+        valid = self.outstanding("valid", 3600)
+        BlacklistedToken.objects.create(token=valid)
+        BlacklistedToken.objects.create(token=self.outstanding("revoked-expired", -1))
+        for i in range(4):
+            self.outstanding(f"expired-{i}", -1)
+
+        with CaptureQueriesContext(connection) as queries:
+            result = purge_expired_tokens(batch_size=2)
+
+        self.assertEqual(result, "Purged 5 expired tokens")
+        self.assertTrue(self.blacklist.contains("valid"))
+        self.assertFalse(self.blacklist.contains("revoked-expired"))
+        self.assertQuerySetEqual(
+            OutstandingToken.objects.values_list("jti", flat=True), ["valid"]
+        )
+        self.assertEqual(BlacklistedToken.objects.get().token, valid)
+        # Three batches were deleted before an empty one ended the loop
+        batches = [q for q in queries.captured_queries if "LIMIT 2" in q["sql"]]
+        self.assertEqual(len(batches), 4)
+
+
+class UserStateCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user("patient", 1)
+
+    def test_authenticates_from_the_database_while_redis_is_down(self):
+        access = RoleRefreshToken.for_user(self.user).access_token
+        tiered = mock.Mock()
+        for failing in ("get", "set"):
+            with (
+                self.subTest(failing=failing),
+                mock.patch(
+                    "therapy_connect.accounts.authentication.caches",
+                    {"tiered": tiered},
+                ),
+                self.assertLogs("therapy_connect.accounts.authentication", "WARNING"),
+            ):
+                tiered.reset_mock(return_value=True, side_effect=True)
+                tiered.get.return_value = None
+                getattr(tiered, failing).side_effect = redis.ConnectionError()
+                response = self.client.get(
+                    reverse("accounts:user-profile"),
+                    headers={"Authorization": f"Bearer {access}"},
+                )
+                self.assertEqual(response.status_code, 200)
+
+
+class LastLoginBufferTests(SimpleTestCase):
+    def buffer(self, max_size=10, max_age=60):
+        buffer = LastLoginBuffer(max_size, max_age)
+        self.addCleanup(buffer.flush)
+        self.sent = []
+        buffer._send = self.sent.append
+        return buffer
+
+    def test_sends_full_batches(self):
+        buffer = self.buffer(max_size=2)
+        now = timezone.now()
+        buffer.add(1, now)
+        buffer.add(2, now)
+        buffer.add(3, now)
+        self.assertEqual(self.sent, [{1: now.isoformat(), 2: now.isoformat()}])
+
+    def test_sends_old_batches_without_waiting_for_a_login(self):
+        buffer = self.buffer(max_age=0.05)
+        sent = threading.Event()
+        buffer._send = lambda batch: sent.set()
+        buffer.add(1, timezone.now())
+        self.assertTrue(sent.wait(timeout=5))
+
+
+async def run_in_test_thread(func, *args):
+    # The login pool's threads have their own connections, which can't see
+    # the test case's transaction
+    return await sync_to_async(func)(*args)
+
+
+@mock.patch("therapy_connect.accounts.views.run_in_login_pool", run_in_test_thread)
+class AsyncLoginViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user("patient", 1)
+
+    def login(self, data, content_type):
+        request = RequestFactory().post("/", data, content_type=content_type)
+        response = async_to_sync(AsyncLoginView.as_view())(request)
+        return response.status_code, json.loads(response.content)
+
+    def test_accepts_the_configured_parsers(self):
+        credentials = {"email": self.user.email, "password": PASSWORD}
+        bodies = {
+            "application/json": json.dumps(credentials),
+            "application/msgpack": msgpack.packb(credentials),
+            "application/x-www-form-urlencoded": urlencode(credentials),
+            "multipart/form-data; boundary=BoUnDaRy": encode_multipart(
+                "BoUnDaRy", credentials
+            ),
+        }
+        for content_type, body in bodies.items():
+            with self.subTest(content_type=content_type):
+                status, data = self.login(body, content_type)
+                self.assertEqual(status, 200, data)
+                self.assertEqual(set(data), {"refresh", "access"})
+
+    def test_rejects_wrong_passwords(self):
+        body = json.dumps({"email": self.user.email, "password": "wrong"})
+        status, _ = self.login(body, "application/json")
+        self.assertEqual(status, 401)
+
+    def test_rejects_bodies_it_cant_parse(self):
+        self.assertEqual(self.login("{", "application/json")[0], 400)
+        self.assertEqual(self.login("email=x", "text/plain")[0], 415)
+
+
+class UniqueFieldTests(QueryBudgetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.taken = create_user("patient", 1)
+        cls.user = create_user("patient", 2)
+
+    def register(self, **data):
+        data = {
+            "first_name": "New",
+            "last_name": "Patient",
+            "email": "new@example.com",
+            "mobile_number": "3000000001",
+            "password": PASSWORD,
+            **data,
+        }
+        return self.client.post(reverse("accounts:user-register"), data)
+
+    def change_email(self, email):
+        # The link send_verification_email sends for a new email
+        token_data = {"user_id": self.user.pk, "email": email, "password_hash": None}
+        token = TimestampSigner().sign(
+            urlsafe_base64_encode(force_bytes(str(token_data)))
+        )
+        url = reverse("accounts:user-verify-email-password")
+        return self.client.get(url, {"token": token})
+
+    def test_register_with_a_taken_email(self):
+        for email in (self.taken.email, self.taken.email.upper()):
+            with self.subTest(email=email):
+                response = self.register(email=email)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(
+                    response.data, {"email": ["user with this email already exists."]}
+                )
+
+    def test_register_with_a_taken_mobile_number(self):
+        response = self.register(mobile_number=self.taken.mobile_number)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.data,
+            {"mobile_number": ["user with this mobile number already exists."]},
+        )
+
+    def test_request_to_change_to_a_taken_email(self):
+        self.authenticate(self.user)
+        url = reverse("accounts:user-profile-update")
+        for email in (self.taken.email, self.taken.email.upper()):
+            with (
+                self.subTest(email=email),
+                mock.patch("therapy_connect.accounts.utils.queue_email") as queue,
+            ):
+                response = self.client.patch(url, {"email": email})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(
+                    response.data, {"email": ["This email is already in use."]}
+                )
+                queue.assert_not_called()
+
+    def test_keeping_the_own_email(self):
+        self.authenticate(self.user)
+        response = self.client.patch(
+            reverse("accounts:user-profile-update"), {"email": self.user.email}
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_update_to_an_email_taken_since_the_link_was_sent(self):
+        for email in (self.taken.email, self.taken.email.upper()):
+            with self.subTest(email=email):
+                response = self.change_email(email)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(
+                    response.data, {"email": ["This email is already in use."]}
+                )
+
+    def test_update_to_a_taken_mobile_number(self):
+        self.authenticate(self.user)
+        response = self.client.patch(
+            reverse("accounts:user-profile-update"),
+            {"mobile_number": self.taken.mobile_number},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.data, {"mobile_number": ["This mobile number is already in use."]}
+        )
+
+    def test_postgres_constraint_names(self):
+        for constraint, fields in [
+            ("accounts_user_username_key", ["email"]),
+            ("accounts_user_email_key", ["email"]),
+            ("accounts_user_email_ci_unique", ["email"]),
+            ("accounts_user_mobile_number_key", ["mobile_number"]),
+            ("accounts_user_pkey", []),
+        ]:
+            with self.subTest(constraint=constraint):
+                # psycopg reports the constraint in the diagnostics of the cause
+                cause = Exception("duplicate key value violates unique constraint")
+                cause.diag = SimpleNamespace(constraint_name=constraint)
+                exc = IntegrityError(*cause.args)
+                exc.__cause__ = cause
+                self.assertEqual(list(unique_field_errors(exc)), fields)
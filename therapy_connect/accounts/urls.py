@@ -1,4 +1,6 @@
+from django.conf import settings
 from django.urls import path
+from django.views.decorators.csrf import csrf_exempt
 from drf_spectacular.utils import extend_schema_view
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
@@ -7,6 +9,7 @@ from rest_framework_simplejwt.views import (
 
 from .schemas import get_refresh_token, user_login
 from .views import (
+    AsyncLoginView,
     LogoutView,
     PasswordResetConfirmView,
     PasswordResetRequestView,
@@ -26,6 +29,10 @@ token_refresh_view = extend_schema_view(post=get_refresh_token)(
     TokenRefreshView.as_view()
 )
 
+# Under ASGI, logins go through the async view (see ASYNC_VIEWS)
+if settings.ASYNC_VIEWS:
+    token_obtain_pair_view = csrf_exempt(AsyncLoginView.as_view())
+
 
 app_name = "accounts"
 urlpatterns = [
@@ -1,9 +1,111 @@
+import hashlib
+import logging
+import re
+from contextlib import contextmanager
+
+import redis
 from django.conf import settings
-from django.core.mail import send_mail
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
 from django.core.signing import TimestampSigner
+from django.db import IntegrityError, transaction
 from django.urls import reverse
 from django.utils.encoding import force_bytes
 from django.utils.http import urlsafe_base64_encode
+from kombu.exceptions import OperationalError
+from rest_framework import serializers
+
+from .tasks import add_to_outbox, send_email
+
+logger = logging.getLogger(__name__)
+
+# The field reported for each unique constraint of the User table. The
+# username is always the email, so a clash on it means the email is taken.
+UNIQUE_USER_CONSTRAINTS = {
+    "accounts_user_username_key": "email",
+    "accounts_user_email_key": "email",
+    "accounts_user_email_ci_unique": "email",
+    "accounts_user_mobile_number_key": "mobile_number",
+}
+
+# SQLite names the index, or the table and column, instead of the constraint
+SQLITE_UNIQUE_ERROR = re.compile(
+    r"UNIQUE constraint failed: (?:index '(\w+)'|(\w+)\.(\w+))"
+)
+
+
+def violated_constraint(exc):
+    """The name of the constraint an IntegrityError reports, if any."""
+    diag = getattr(exc.__cause__, "diag", None)
+    if diag is not None:
+        return diag.constraint_name
+    match = SQLITE_UNIQUE_ERROR.search(str(exc))
+    if match is None:
+        return None
+    index, table, column = match.groups()
+    # Postgres' name for the unique constraint of a column
+    return index or f"{table}_{column}_key"
+
+
+def unique_field_errors(exc, messages=None):
+    """
+    Map an IntegrityError raised while saving a User to field errors.
+
+    The violated constraint is mapped to the field it protects, so the
+    same messages as a pre-check are produced without querying first.
+    `messages` overrides the default message per field.
+    """
+    field_name = UNIQUE_USER_CONSTRAINTS.get(violated_constraint(exc))
+    if field_name is None:
+        return {}
+    User = get_user_model()
+    field = User._meta.get_field(field_name)
+    message = (messages or {}).get(
+        field_name,
+        f"{User._meta.verbose_name} with this {field.verbose_name} already exists.",
+    )
+    return {field_name: [message]}
+
+
+@contextmanager
+def unique_user_fields(messages=None):
+    """
+    Save a User in a savepoint, turning unique violations into a 400.
+
+    Other integrity errors are re-raised unchanged.
+    """
+    try:
+        with transaction.atomic():
+            yield
+    except IntegrityError as exc:
+        errors = unique_field_errors(exc, messages)
+        if not errors:
+            raise
+        raise serializers.ValidationError(errors)
+
+
+def queue_email(subject, message, recipient_list, dedupe_key):
+    """
+    Send an email from a Celery worker once the current transaction commits.
+
+    With EMAIL_OUTBOX_URL set, the email goes through the outbox so workers
+    send them in batches; otherwise it gets its own task. Messages sharing
+    a `dedupe_key` within `EMAIL_DEDUPE_TIMEOUT` seconds are only sent once.
+    An email that can't be queued is logged and dropped.
+    """
+    if settings.EMAIL_OUTBOX_URL:
+        send = add_to_outbox
+    else:
+        send = send_email.delay
+
+    def send_after_commit():
+        try:
+            send(subject, message, recipient_list, dedupe_key)
+        except (redis.RedisError, OperationalError):
+            # The data is committed by now; failing the request won't undo it
+            logger.exception("Could not queue the %s email", dedupe_key)
+
+    transaction.on_commit(send_after_commit)
 
 
 def send_verification_email(user, email=None, password=None, purpose="registration"):
@@ -23,18 +125,27 @@ def send_verification_email(user, email=None, password=None, purpose="registrati
         reverse_name = "accounts:user-verify-email"
         subject = "Verify Your Email Address"
         message_action = "verify your email"
-        token = signer.sign(user.pk)
+        token_value = str(user.pk)
+        token = signer.sign(token_value)
     elif purpose == "profile_update":
-        token_data = {"user_id": user.pk, "email": email, "password": password}
+        # Only the hash of the new password leaves the request, not the
+        # password itself
+        token_data = {
+            "user_id": user.pk,
+            "email": email,
+            "password_hash": make_password(password) if password else None,
+        }
         reverse_name = "accounts:user-verify-email-password"
         subject = "Verify Your Email/Password Update"
         message_action = "verify your email/password update"
-        token = signer.sign(urlsafe_base64_encode(force_bytes(str(token_data))))
+        token_value = urlsafe_base64_encode(force_bytes(str(token_data)))
+        token = signer.sign(token_value)
     elif purpose == "password_reset":
         reverse_name = "accounts:user-password-reset-confirm"
         subject = "Reset Your Password"
         message_action = "reset your password"
-        token = signer.sign(user.pk)
+        token_value = str(user.pk)
+        token = signer.sign(token_value)
     else:
         raise ValueError(
             "Invalid purpose. Use 'registration', 'profile_update', or 'password_reset'."
@@ -53,5 +164,10 @@ def send_verification_email(user, email=None, password=None, purpose="registrati
     # Compose email message
     message = f"Click the link below to {message_action}:\n\n{verification_url}"
 
+    # Identical requests (e.g. a double submit) share a key; the signed
+    # token itself differs on every call because it is timestamped.
+    digest = hashlib.sha256(f"{user.email}:{token_value}".encode()).hexdigest()
+    dedupe_key = f"{purpose}:{digest}"
+
     # Send email
-    send_mail(subject, message, settings.EMAIL_HOST_USER, [user.email])
+    queue_email(subject, message, [user.email], dedupe_key)
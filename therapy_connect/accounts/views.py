@@ -1,13 +1,19 @@
 from django.contrib.auth import get_user_model
 from django.contrib.auth.hashers import check_password
 from django.core.signing import BadSignature, SignatureExpired, TimestampSigner
+from django.http import JsonResponse
 from django.utils.encoding import force_str
 from django.utils.http import urlsafe_base64_decode
-from rest_framework import generics, permissions, status
+from django.views import View
+from rest_framework import exceptions, generics, permissions, status
+from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.exceptions import TokenError
 
+from .authentication import load_user
+from .login import run_in_login_pool
 from .permissions import IsOwnerOrSuperUser
 from .schemas import (
     logout_schema,
@@ -23,14 +29,21 @@ from .schemas import (
 from .serializers import (
     PasswordResetConfirmSerializer,
     PasswordResetRequestSerializer,
+    RoleTokenObtainPairSerializer,
     UserProfileSerializer,
     UserProfileUpdateSerializer,
     UserRegistrationSerializer,
 )
-from .utils import send_verification_email
+from .tokens import RoleRefreshToken
+from .utils import send_verification_email, unique_user_fields
 
 User = get_user_model()
 
+PROFILE_UNIQUE_MESSAGES = {
+    "email": "This email is already in use.",
+    "mobile_number": "This mobile number is already in use.",
+}
+
 
 @user_registration_schema
 class UserRegistrationView(generics.CreateAPIView):
@@ -102,7 +115,7 @@ class UserProfileView(generics.RetrieveAPIView):
 
     def get_object(self):
         # Return the currently authenticated user
-        return self.request.user
+        return load_user(self.request.user)
 
 
 @logout_schema
@@ -110,29 +123,31 @@ class LogoutView(APIView):
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrSuperUser]
 
     def post(self, request):
-        try:
-            # Get the refresh token from the request data
-            refresh_token = request.data.get("refresh_token")
-            if not refresh_token:
-                return Response(
-                    {"error": "Refresh token is required."},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
-
-            # Blacklist the refresh token
-            token = RefreshToken(refresh_token)
-            token.blacklist()
-
+        # Get the refresh token from the request data
+        refresh_token = request.data.get("refresh_token")
+        if not refresh_token:
             return Response(
-                {"message": "Successfully logged out."},
-                status=status.HTTP_205_RESET_CONTENT,
+                {"error": "Refresh token is required."},
+                status=status.HTTP_400_BAD_REQUEST,
             )
-        except Exception:
+
+        try:
+            token = RoleRefreshToken(refresh_token)
+        except TokenError:
             return Response(
                 {"error": "Invalid token or token already blacklisted."},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
+        # Blacklist the refresh token; a blacklist store that can't be
+        # reached is a server error, not a bad token
+        token.blacklist()
+
+        return Response(
+            {"message": "Successfully logged out."},
+            status=status.HTTP_205_RESET_CONTENT,
+        )
+
 
 @user_delete_schema
 class UserDeactivateView(APIView):
@@ -141,7 +156,7 @@ class UserDeactivateView(APIView):
     ]  # Only authenticated users can deactivate their account
 
     def delete(self, request):
-        user = request.user  # Get the currently authenticated user
+        user = load_user(request.user)  # Get the currently authenticated user
 
         # Deactivate the user account
         user.is_active = False
@@ -159,7 +174,7 @@ class UserProfileUpdateView(generics.RetrieveUpdateAPIView):
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrSuperUser]
 
     def get_object(self):
-        return self.request.user
+        return load_user(self.request.user)
 
     def update(self, request, *args, **kwargs):
         user = self.get_object()
@@ -214,7 +229,8 @@ class UserProfileUpdateView(generics.RetrieveUpdateAPIView):
         for field in fields:
             if field in validated_data:
                 setattr(user, field, validated_data[field])
-        user.save()
+        with unique_user_fields(PROFILE_UNIQUE_MESSAGES):
+            user.save()
 
     def handle_sensitive_fields(self, user, sensitive_data):
         """Trigger email verification for sensitive fields."""
@@ -240,7 +256,7 @@ class VerifyEmailPasswordUpdateView(APIView):
             token_data = eval(token_data)
             user_id = token_data["user_id"]
             new_email = token_data.get("email")
-            new_password = token_data.get("password")
+            new_password_hash = token_data.get("password_hash")
 
             user = User.objects.get(pk=user_id)
 
@@ -250,10 +266,12 @@ class VerifyEmailPasswordUpdateView(APIView):
                 user.username = new_email  # Update username as well
 
             # Update password if provided
-            if new_password:
-                user.set_password(new_password)
+            if new_password_hash:
+                user.password = new_password_hash
 
-            user.save()
+            # The email may have been taken since the link was sent
+            with unique_user_fields(PROFILE_UNIQUE_MESSAGES):
+                user.save()
 
             return Response(
                 {"message": "Email/Password updated successfully"},
@@ -277,8 +295,7 @@ class PasswordResetRequestView(APIView):
         serializer = PasswordResetRequestSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        email = serializer.validated_data["email"]
-        user = User.objects.get(email=email)
+        user = serializer.validated_data["user"]
 
         # Send password reset email
         send_verification_email(user, purpose="password_reset")
@@ -328,3 +345,36 @@ class PasswordResetConfirmView(APIView):
                 {"error": "User not found."},
                 status=status.HTTP_404_NOT_FOUND,
             )
+
+
+class AsyncLoginView(View):
+    """
+    Async variant of TokenObtainPairView for ASGI deployments.
+
+    The credential check (user lookup and password hashing) runs in a
+    bounded thread pool, so a burst of logins can't tie up the thread that
+    Django uses for sync views. The body is parsed with the configured DRF
+    parsers (JSON, MessagePack, form and multipart); responses are JSON and
+    otherwise match TokenObtainPairView.
+    """
+
+    async def post(self, request):
+        parsers = [parser() for parser in api_settings.DEFAULT_PARSER_CLASSES]
+        try:
+            data = Request(request, parsers=parsers).data
+        except exceptions.APIException as exc:
+            return JsonResponse({"detail": exc.detail}, status=exc.status_code)
+
+        serializer = RoleTokenObtainPairSerializer(
+            data=data, context={"request": request}
+        )
+        try:
+            is_valid = await run_in_login_pool(serializer.is_valid)
+        except exceptions.AuthenticationFailed as exc:
+            return JsonResponse(
+                {"detail": exc.detail}, status=status.HTTP_401_UNAUTHORIZED
+            )
+
+        if not is_valid:
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        return JsonResponse(serializer.validated_data, status=status.HTTP_200_OK)
@@ -1,19 +1,118 @@
 import os
+import time
 
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import (
+    after_task_publish,
+    before_task_publish,
+    task_postrun,
+    task_prerun,
+    worker_init,
+    worker_process_init,
+)
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "therapy_connect.settings.local")
 
-celery_app = Celery(
-    "therapy_connect", broker="redis://redis:6379/0"
-)  # Explicitly set Redis
+# The broker, queues and routes come from the CELERY_* Django settings
+celery_app = Celery("therapy_connect")
 celery_app.config_from_object("django.conf:settings", namespace="CELERY")
 celery_app.autodiscover_tasks()
 
+
+@worker_process_init.connect
+def discard_inherited_db_pools(**kwargs):
+    # Prefork children open their own connection pool instead of sharing
+    # the parent's connections
+    from therapy_connect.core.db import discard_inherited_pools
+
+    discard_inherited_pools()
+
+
+@worker_process_init.connect
+def start_memory_tracing(**kwargs):
+    from therapy_connect.core.memory import start_tracing
+
+    start_tracing()
+
+
+@worker_init.connect
+def clear_metrics(**kwargs):
+    # Runs in the main worker process, before the pool children start
+    from therapy_connect.core.metrics import clear_multiprocess_dir
+
+    clear_multiprocess_dir()
+
+
+_task_started = {}
+
+
+@task_prerun.connect
+def start_task_timer(task_id=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def observe_task_duration(task_id=None, task=None, state=None, **kwargs):
+    from therapy_connect.core.metrics import TASK_DURATION
+
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        TASK_DURATION.labels(task.name, state).observe(time.perf_counter() - started)
+
+
+@before_task_publish.connect
+def start_publish_span(headers=None, **kwargs):
+    from django.conf import settings
+
+    if settings.TRACING:
+        from therapy_connect.core.tracing import start_publish_span
+
+        start_publish_span(headers)
+
+
+@after_task_publish.connect
+def finish_publish_span(headers=None, **kwargs):
+    from django.conf import settings
+
+    if settings.TRACING:
+        from therapy_connect.core.tracing import finish_publish_span
+
+        finish_publish_span(headers)
+
+
+@task_prerun.connect
+def start_task_span(task_id=None, task=None, **kwargs):
+    from django.conf import settings
+
+    if settings.TRACING:
+        from therapy_connect.core.tracing import start_task_span
+
+        start_task_span(task_id, task)
+
+
+@task_postrun.connect
+def finish_task_span(task_id=None, state=None, **kwargs):
+    from django.conf import settings
+
+    if settings.TRACING:
+        from therapy_connect.core.tracing import finish_task_span
+
+        finish_task_span(task_id, state)
+
+
 celery_app.conf.beat_schedule = {
     "auto_complete_appointments": {
         "task": "therapy_connect.therapy.tasks.auto_complete_appointments",
         "schedule": crontab(minute="*/10"),
     },
+    # Also puts back the emails of batches whose task died
+    "send_outbox": {
+        "task": "therapy_connect.accounts.tasks.send_outbox",
+        "schedule": crontab(minute="*/5"),
+    },
+    "purge_expired_tokens": {
+        "task": "therapy_connect.accounts.tasks.purge_expired_tokens",
+        "schedule": crontab(minute=0),
+    },
 }
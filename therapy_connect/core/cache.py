@@ -0,0 +1,415 @@
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import redis
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from .metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+# Process-wide state, shared by the per-thread TieredCache instances Django
+# creates, keyed by L1 name
+_local_caches = {}
+_stats = {}
+_buses = {}
+_buses_lock = threading.Lock()
+
+
+class LocalCache:
+    """Thread-safe in-process LRU whose entries also expire."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # Bumped by every invalidation, so a value read from L2 while an
+        # invalidation arrives isn't stored afterwards
+        self.generation = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return MISSING
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self.entries[key]
+                return MISSING
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout, generation=None):
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.entries[key] = (value, time.monotonic() + timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, keys):
+        with self.lock:
+            self.generation += 1
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+
+class InvalidationBus:
+    """
+    Broadcasts keys to drop from L1 over a Redis pub/sub channel.
+
+    Each process subscribes from a daemon thread and removes the keys from
+    the L1 named in the message. The listener is restarted after a fork, and
+    L1 is cleared whenever the subscription is (re)established since
+    messages may have been missed meanwhile.
+    """
+
+    def __init__(self, location, channel):
+        self.client = redis.Redis.from_url(location)
+        self.channel = channel
+        self.node = uuid.uuid4().hex
+        self.pid = None
+
+    def ensure_listening(self):
+        if self.pid == os.getpid():
+            return
+        with _buses_lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            # A forked child gets its own node id, connections and listener
+            self.node = uuid.uuid4().hex
+            self.client.connection_pool.reset()
+            thread = threading.Thread(
+                target=self.listen, name="cache-invalidation", daemon=True
+            )
+            thread.start()
+
+    def publish(self, name, keys=None):
+        """Ask other processes to drop `keys` (or everything) from L1 `name`."""
+        message = json.dumps({"node": self.node, "name": name, "keys": keys})
+        try:
+            self.client.publish(self.channel, message)
+        except redis.RedisError:
+            logger.exception("Couldn't publish cache invalidation for %s", name)
+
+    def listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for local_cache in _local_caches.values():
+                    local_cache.clear()
+                for message in pubsub.listen():
+                    self.handle(message)
+            except redis.RedisError:
+                logger.warning("Cache invalidation listener disconnected")
+                time.sleep(1)
+
+    def handle(self, message):
+        data = json.loads(message["data"])
+        if data["node"] == self.node:
+            return
+        local_cache = _local_caches.get(data["name"])
+        if local_cache is None:
+            return
+        if data["keys"] is None:
+            local_cache.clear()
+        else:
+            local_cache.delete(data["keys"])
+
+
+def get_bus(location, channel):
+    with _buses_lock:
+        if (location, channel) not in _buses:
+            _buses[location, channel] = InvalidationBus(location, channel)
+        return _buses[location, channel]
+
+
+class TieredCache(BaseCache):
+    """
+    An in-process LRU (L1) in front of a shared cache (L2).
+
+    LOCATION is the alias of the L2 cache and, unless OPTIONS["NAME"] is
+    given, also names the L1. Values read from L2 are kept in L1 for at
+    most L1_TIMEOUT seconds, pickled like LocMemCache does so callers never
+    share an instance. Writes go to L2 and are broadcast over Redis pub/sub
+    on BUS_LOCATION so every process drops its L1 copy; without BUS_LOCATION
+    (tests, single process) L1_TIMEOUT alone bounds how stale other
+    processes can be.
+
+    Intended for small, hot and rarely changing data.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self.l2_alias = location
+        self.l1_timeout = options.get("L1_TIMEOUT", 30)
+        self.name = options.get("NAME", location)
+        self.l1 = _local_caches.setdefault(
+            self.name, LocalCache(options.get("L1_MAX_ENTRIES", 1000))
+        )
+        self.counters = _stats.setdefault(
+            self.name, {"l1_hits": 0, "l1_misses": 0, "l2_hits": 0, "l2_misses": 0}
+        )
+        # "l1_hits" is counted as tier="l1", result="hits"
+        self.metrics = {
+            name: CACHE_REQUESTS.labels(self.name, *name.split("_"))
+            for name in self.counters
+        }
+        bus_location = options.get("BUS_LOCATION")
+        self.bus = None
+        if bus_location:
+            channel = options.get("CHANNEL", "cache-invalidation")
+            self.bus = get_bus(bus_location, channel)
+
+    @property
+    def l2(self):
+        return caches[self.l2_alias]
+
+    def _count(self, name, amount=1):
+        # Not locked: the ratios only need to be approximately right
+        self.counters[name] += amount
+        if amount:
+            self.metrics[name].inc(amount)
+
+    def _invalidate(self, keys):
+        self.l1.delete(keys)
+        if self.bus is not None:
+            self.bus.publish(self.name, keys)
+
+    def _listen(self):
+        if self.bus is not None:
+            self.bus.ensure_listening()
+
+    def get(self, key, default=None, version=None):
+        self._listen()
+        local_key = self.make_and_validate_key(key, version=version)
+        pickled = self.l1.get(local_key)
+        if pickled is not MISSING:
+            self._count("l1_hits")
+            return pickle.loads(pickled)
+        self._count("l1_misses")
+
+        generation = self.l1.generation
+        value = self.l2.get(key, MISSING, version=version)
+        if value is MISSING:
+            self._count("l2_misses")
+            return default
+        self._count("l2_hits")
+        self.l1.set(local_key, pickle.dumps(value), self.l1_timeout, generation)
+        return value
+
+    def get_many(self, keys, version=None):
+        self._listen()
+        found = {}
+        missing = []
+        for key in keys:
+            pickled = self.l1.get(self.make_and_validate_key(key, version=version))
+            if pickled is MISSING:
+                missing.append(key)
+            else:
+                found[key] = pickle.loads(pickled)
+        self._count("l1_hits", len(found))
+        self._count("l1_misses", len(missing))
+        if not missing:
+            return found
+
+        generation = self.l1.generation
+        fetched = self.l2.get_many(missing, version=version)
+        self._count("l2_hits", len(fetched))
+        self._count("l2_misses", len(missing) - len(fetched))
+        for key, value in fetched.items():
+            local_key = self.make_and_validate_key(key, version=version)
+            self.l1.set(local_key, pickle.dumps(value), self.l1_timeout, generation)
+        found.update(fetched)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._listen()
+        local_key = self.make_and_validate_key(key, version=version)
+        self.l2.set(key, value, self.get_timeout(timeout), version=version)
+        self._invalidate([local_key])
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        self._listen()
+        failed = self.l2.set_many(data, self.get_timeout(timeout), version=version)
+        self._invalidate(
+            [self.make_and_validate_key(key, version=version) for key in data]
+        )
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._listen()
+        local_key = self.make_and_validate_key(key, version=version)
+        added = self.l2.add(key, value, self.get_timeout(timeout), version=version)
+        if added:
+            self._invalidate([local_key])
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.l2.touch(key, self.get_timeout(timeout), version=version)
+
+    def delete(self, key, version=None):
+        self._listen()
+        local_key = self.make_and_validate_key(key, version=version)
+        deleted = self.l2.delete(key, version=version)
+        self._invalidate([local_key])
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        self._listen()
+        keys = list(keys)
+        self.l2.delete_many(keys, version=version)
+        self._invalidate(
+            [self.make_and_validate_key(key, version=version) for key in keys]
+        )
+
+    def has_key(self, key, version=None):
+        return self.get(key, MISSING, version=version) is not MISSING
+
+    def incr(self, key, delta=1, version=None):
+        self._listen()
+        value = self.l2.incr(key, delta, version=version)
+        self._invalidate([self.make_and_validate_key(key, version=version)])
+        return value
+
+    def clear(self):
+        self._listen()
+        self.l2.clear()
+        self.l1.clear()
+        if self.bus is not None:
+            self.bus.publish(self.name)
+
+    def get_timeout(self, timeout):
+        # L2 takes the timeout as given, so resolve DEFAULT_TIMEOUT here
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def stats(self):
+        """Hit counts and ratios of both tiers in this process."""
+        counters = dict(self.counters)
+        l1_total = counters["l1_hits"] + counters["l1_misses"]
+        l2_total = counters["l2_hits"] + counters["l2_misses"]
+        return {
+            **counters,
+            "l1_entries": len(self.l1.entries),
+            "l1_hit_ratio": counters["l1_hits"] / l1_total if l1_total else None,
+            "l2_hit_ratio": counters["l2_hits"] / l2_total if l2_total else None,
+        }
+
+
+def cache_stats():
+    """stats() of every TieredCache in CACHES, by alias."""
+    return {
+        alias: caches[alias].stats()
+        for alias, config in settings.CACHES.items()
+        if config["BACKEND"] == f"{TieredCache.__module__}.TieredCache"
+    }
+
+
+class ModelCache:
+    """
+    Instances of `model` cached by primary key in a TieredCache.
+
+    `queryset` decides what is cached (e.g. with select_related); connect
+    `invalidate` to the signals of every model it depends on. `all()` caches
+    the whole queryset, for small catalogs only.
+
+    Each instance is cached under a version that `invalidate` replaces, so
+    a row read from the database just before a change is stored under a
+    key nobody reads any more rather than served until it expires.
+    """
+
+    def __init__(self, model, queryset=None, timeout=DEFAULT_TIMEOUT, alias="tiered"):
+        self.model = model
+        self.queryset = queryset
+        self.timeout = timeout
+        self.alias = alias
+        self.prefix = f"model:{model._meta.label_lower}"
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get_queryset(self):
+        if self.queryset is None:
+            return self.model._default_manager.all()
+        return self.queryset.all()
+
+    def key(self, pk, version):
+        return f"{self.prefix}:{pk}:{version}"
+
+    def version_key(self, pk):
+        return f"{self.prefix}:{pk}:version"
+
+    def versions(self, pks):
+        """The current version of each of `pks` ("all" for `all()`), by pk."""
+        keys = {self.version_key(pk): pk for pk in pks}
+        versions = {
+            keys[key]: version for key, version in self.cache.get_many(keys).items()
+        }
+        for key, pk in keys.items():
+            if pk not in versions:
+                # Random, so a lost version key can't bring old entries back
+                version = uuid.uuid4().hex
+                if not self.cache.add(key, version, self.timeout):
+                    # Started by another process meanwhile
+                    version = self.cache.get(key, version)
+                versions[pk] = version
+        return versions
+
+    def get(self, pk):
+        """Return the instance, raising model.DoesNotExist if there's none."""
+        key = self.key(pk, self.versions([pk])[pk])
+        instance = self.cache.get(key)
+        if instance is None:
+            instance = self.get_queryset().get(pk=pk)
+            self.cache.set(key, instance, self.timeout)
+        return instance
+
+    def get_many(self, pks):
+        """Return a dict of the existing instances among `pks`, by pk."""
+        keys = {self.key(pk, version): pk for pk, version in self.versions(pks).items()}
+        cached = self.cache.get_many(keys)
+        instances = {keys[key]: instance for key, instance in cached.items()}
+        missing = {pk: key for key, pk in keys.items() if pk not in instances}
+        if missing:
+            fetched = self.get_queryset().in_bulk(missing)
+            self.cache.set_many(
+                {missing[pk]: instance for pk, instance in fetched.items()},
+                self.timeout,
+            )
+            instances.update(fetched)
+        return instances
+
+    def all(self):
+        key = self.key("all", self.versions(["all"])["all"])
+        instances = self.cache.get(key)
+        if instances is None:
+            instances = list(self.get_queryset())
+            self.cache.set(key, instances, self.timeout)
+        return instances
+
+    def invalidate(self, pk=None):
+        """Replace the versions of the cached instance `pk` (if given) and `all()`."""
+        pks = ["all"] if pk is None else ["all", pk]
+        self.cache.set_many(
+            {self.version_key(pk): uuid.uuid4().hex for pk in pks}, self.timeout
+        )
@@ -0,0 +1,34 @@
+from django.db import connections
+
+
+def pool_stats():
+    """
+    Return the psycopg pool statistics of this process, by database alias.
+
+    Only pools that have been opened are included; see
+    https://www.psycopg.org/psycopg3/docs/advanced/pool.html#pool-stats
+    """
+    stats = {}
+    for connection in connections.all(initialized_only=True):
+        pool = getattr(connection, "_connection_pools", {}).get(connection.alias)
+        if pool is not None:
+            stats[connection.alias] = pool.get_stats()
+    return stats
+
+
+def close_pools():
+    """Close the pools opened by this process."""
+    for connection in connections.all(initialized_only=True):
+        if connection.alias in getattr(connection, "_connection_pools", {}):
+            connection.close_pool()
+
+
+def discard_inherited_pools():
+    """
+    Forget the pools inherited from the parent process after a fork.
+
+    Closing them would terminate connections the parent still uses; the
+    child opens its own pool on first use.
+    """
+    for connection in connections.all():
+        getattr(connection, "_connection_pools", {}).pop(connection.alias, None)
@@ -0,0 +1,53 @@
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from therapy_connect.core.schema import schema_files, write_schema
+
+# The spectacular command's name for each format
+SPECTACULAR_FORMATS = {"json": "openapi-json", "yaml": "openapi"}
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate the OpenAPI schema served at /schema/ and write it, with "
+        "brotli and gzip copies, to OPENAPI_SCHEMA_FILE as JSON and next to "
+        "it as YAML. Run at build time, after the code is in place."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--file",
+            default=str(settings.OPENAPI_SCHEMA_FILE),
+            help="Where to write the JSON schema (default: OPENAPI_SCHEMA_FILE).",
+        )
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Fail if a stored schema is out of date instead of writing it.",
+        )
+
+    def handle(self, *args, **options):
+        for format, path in schema_files(options["file"]).items():
+            with tempfile.TemporaryDirectory() as directory:
+                generated = Path(directory) / path.name
+                call_command(
+                    "spectacular",
+                    format=SPECTACULAR_FORMATS[format],
+                    file=str(generated),
+                )
+                content = generated.read_bytes()
+
+            if options["check"]:
+                if not path.exists() or path.read_bytes() != content:
+                    raise CommandError(
+                        f"{path} is out of date, run `manage.py build_schema`."
+                    )
+                self.stdout.write(f"{path} is up to date.")
+                continue
+
+            write_schema(path, content)
+            self.stdout.write(f"Wrote {path} ({len(content)} bytes).")
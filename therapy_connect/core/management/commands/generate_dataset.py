@@ -0,0 +1,590 @@
+import random
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from datetime import time as clock
+from itertools import count
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from therapy_connect.profiles.models import (
+    PatientProfile,
+    PsychologicalIssue,
+    TherapistProfile,
+)
+from therapy_connect.therapy.models import Appointment, Availability, TherapyPanel
+
+User = get_user_model()
+
+# make_password("dataset-password") with a fixed salt, so loading doesn't hash
+PASSWORD_HASH = (
+    "pbkdf2_sha256$870000$therapyconnectdataset$"
+    "0zIMNBLhbXE+XJgpH5omlxZnD76qwOsj03KI8EXh74g="
+)
+
+# Issue name and how common it is among panels
+ISSUES = {
+    "Anxiety": 20,
+    "Depression": 18,
+    "Stress": 12,
+    "Relationship problems": 10,
+    "Grief": 6,
+    "Trauma": 6,
+    "Insomnia": 5,
+    "Self-esteem": 5,
+    "Addiction": 4,
+    "OCD": 3,
+    "Eating disorders": 3,
+    "Anger management": 3,
+    "ADHD": 3,
+    "Bipolar disorder": 2,
+}
+
+FIRST_NAMES = (
+    "Ali Amir Anna Arash Ava Carlos Chen Daniel David Elena Emma Farah Hana "
+    "Ivan James Julia Karim Lara Leila Liam Lucas Maria Mina Mohammad Nadia "
+    "Noah Olivia Omid Parisa Reza Sara Sofia Taha Yara Yuki Zahra"
+).split()
+LAST_NAMES = (
+    "Ahmadi Brown Garcia Hosseini Ivanova Jones Karimi Kim Lee Martin Moradi "
+    "Muller Nguyen Novak Rahimi Rossi Sato Silva Smith Tanaka Wang Wilson"
+).split()
+TIME_ZONES = (
+    "Asia/Tehran",
+    "Europe/London",
+    "Europe/Berlin",
+    "America/New_York",
+    "America/Toronto",
+    "Asia/Dubai",
+)
+QUALIFICATIONS = (
+    "MSc Clinical Psychology",
+    "PhD Clinical Psychology",
+    "PsyD",
+    "MA Counseling",
+    "MSW, Licensed Clinical Social Worker",
+)
+CANCELLATION_REASONS = (
+    "Feeling unwell",
+    "Work commitment",
+    "Travelling",
+    "Family emergency",
+    "Schedule conflict",
+)
+
+# Weighted choices, as (values, weights)
+PANEL_STATUSES = (("active", "completed", "paused"), (60, 25, 15))
+PAST_STATUSES = (("completed", "canceled"), (92, 8))
+FUTURE_STATUSES = (("scheduled", "canceled"), (95, 5))
+PLATFORMS = (("zoom", "google_meet", "skype", "other"), (70, 20, 5, 5))
+PAYMENTS = {
+    "completed": (("paid", "pending"), (95, 5)),
+    "canceled": (("refunded", "pending"), (60, 40)),
+    "scheduled": (("paid", "pending", "failed"), (60, 38, 2)),
+}
+MEETING_URLS = {
+    "zoom": "https://zoom.us/j/{}",
+    "google_meet": "https://meet.google.com/tc-{}",
+    "skype": "https://join.skype.com/tc{}",
+    "other": "https://meet.example.com/{}",
+}
+
+# Columns loaded per model, in the order of the generated tuples
+USER_FIELDS = (
+    "id",
+    "password",
+    "is_superuser",
+    "username",
+    "first_name",
+    "last_name",
+    "email",
+    "is_staff",
+    "is_active",
+    "date_joined",
+    "mobile_number",
+    "is_admin",
+    "role",
+)
+PATIENT_FIELDS = ("id", "user", "created_at", "updated_at")
+THERAPIST_FIELDS = (
+    "id",
+    "user",
+    "qualifications",
+    "time_zone",
+    "is_verified",
+    "created_at",
+    "updated_at",
+)
+SPECIALTY_FIELDS = ("id", "therapistprofile", "psychologicalissue")
+AVAILABILITY_FIELDS = (
+    "id",
+    "therapist",
+    "date",
+    "start_time",
+    "end_time",
+    "created_at",
+)
+PANEL_FIELDS = (
+    "id",
+    "patient",
+    "issue",
+    "therapist",
+    "status",
+    "assigned_at",
+    "last_session_date",
+    "created_at",
+    "last_updated",
+)
+APPOINTMENT_FIELDS = (
+    "id",
+    "panel",
+    "scheduled_time",
+    "duration",
+    "status",
+    "meeting_platform",
+    "meeting_link",
+    "is_deleted",
+    "rescheduled_from",
+    "payment_status",
+    "cancellation_reason",
+    "canceled_by",
+    "created_at",
+)
+
+RESCHEDULE_RATE = 0.06
+# The booking rules allow two reschedules per panel
+MAX_RESCHEDULES = 2
+
+
+def pick(rng, choices):
+    values, weights = choices
+    return rng.choices(values, weights)[0]
+
+
+def copy_rows(model, fields, rows):
+    """COPY the rows, tuples in the order of `fields`, into the model's table."""
+    quote = connection.ops.quote_name
+    columns = ", ".join(quote(model._meta.get_field(name).column) for name in fields)
+    copied = 0
+    with connection.cursor() as cursor:
+        with cursor.copy(
+            f"COPY {quote(model._meta.db_table)} ({columns}) FROM STDIN"
+        ) as copy:
+            for row in rows:
+                copy.write_row(row)
+                copied += 1
+    return copied
+
+
+def next_id(model):
+    return (model.objects.aggregate(last=Max("pk"))["last"] or 0) + 1
+
+
+class Dataset:
+    """
+    Rows of a synthetic dataset, generated deterministically from a seed.
+
+    Each patient, therapist and panel draws from its own random generator,
+    so a therapist's availability can be regenerated when placing their
+    appointments instead of being kept in memory. The ids continue from
+    `ids` (model -> first id), as the rows reference each other.
+    """
+
+    def __init__(self, seed, patients, therapists, today, days_back, days_ahead, ids):
+        self.seed = seed
+        self.patients = patients
+        self.therapists = therapists
+        self.today = today
+        self.first_day = today - timedelta(days=days_back)
+        self.last_day = today + timedelta(days=days_ahead)
+        self.ids = ids
+        self.tz = timezone.get_current_timezone()
+        # Filled in by panels(), read by appointments()
+        self.therapist_panels = defaultdict(list)
+
+    def rng(self, kind, index):
+        return random.Random(f"{self.seed}:{kind}:{index}")
+
+    def at(self, day, hour=0, minute=0):
+        return datetime.combine(day, clock(hour, minute), tzinfo=self.tz)
+
+    def patient_user_id(self, index):
+        return self.ids[User] + index
+
+    def therapist_user_id(self, index):
+        return self.ids[User] + self.patients + index
+
+    def verified(self, patient):
+        """3% of patients never verified their email."""
+        return self.rng("verified", patient).random() > 0.03
+
+    def users(self):
+        """Patients, then therapists."""
+        people = [("patient", i) for i in range(self.patients)]
+        people += [("therapist", i) for i in range(self.therapists)]
+        for user_id, (role, index) in enumerate(people, self.ids[User]):
+            rng = self.rng(role, index)
+            email = f"{role}{index}@seed{self.seed}.example.com"
+            joined = self.first_day - timedelta(days=rng.randint(0, 365))
+            yield (
+                user_id,
+                PASSWORD_HASH,
+                False,
+                email,
+                rng.choice(FIRST_NAMES),
+                rng.choice(LAST_NAMES),
+                email,
+                False,
+                role == "therapist" or self.verified(index),
+                self.at(joined, rng.randint(0, 23), rng.randint(0, 59)),
+                f"{7 if role == 'patient' else 8}{self.seed % 1000:03d}{index:08d}",
+                False,
+                role,
+            )
+
+    def patient_profiles(self):
+        for index in range(self.patients):
+            created = self.at(self.first_day)
+            yield (
+                self.ids[PatientProfile] + index,
+                self.patient_user_id(index),
+                created,
+                created,
+            )
+
+    def therapist_profiles(self):
+        for index in range(self.therapists):
+            rng = self.rng("therapist-profile", index)
+            created = self.at(self.first_day)
+            yield (
+                self.ids[TherapistProfile] + index,
+                self.therapist_user_id(index),
+                rng.choice(QUALIFICATIONS),
+                rng.choice(TIME_ZONES),
+                rng.random() < 0.9,
+                created,
+                created,
+            )
+
+    def specialties(self, issues):
+        """Two to five issues per therapist, the common ones more often."""
+        self.issue_therapists = defaultdict(list)
+        ids = count(self.ids[TherapistProfile.specialties.through])
+        names = list(issues)
+        weights = [ISSUES.get(name, 1) for name in names]
+        for index in range(self.therapists):
+            rng = self.rng("specialties", index)
+            chosen = set()
+            for _ in range(rng.randint(2, 5)):
+                chosen.add(rng.choices(names, weights)[0])
+            for name in sorted(chosen):
+                self.issue_therapists[name].append(index)
+                yield (next(ids), self.ids[TherapistProfile] + index, issues[name])
+
+    def schedule(self, index):
+        """
+        {day: [(start hour, end hour)]} of a therapist's working days: three
+        to six weekdays, as one long block or a morning and an afternoon.
+        """
+        rng = self.rng("schedule", index)
+        weekdays = set(rng.sample(range(6), rng.randint(3, 6)))
+        if rng.random() < 0.5:
+            start = rng.randint(8, 10)
+            blocks = [(start, start + rng.randint(6, 9))]
+        else:
+            blocks = [
+                (rng.randint(8, 9), 12),
+                (rng.randint(13, 14), rng.randint(17, 20)),
+            ]
+        # A day off now and then
+        days = {}
+        day = self.first_day
+        while day <= self.last_day:
+            if day.weekday() in weekdays and rng.random() > 0.05:
+                days[day] = blocks
+            day += timedelta(days=1)
+        return days
+
+    def availabilities(self):
+        ids = count(self.ids[Availability])
+        for index in range(self.therapists):
+            therapist_id = self.ids[TherapistProfile] + index
+            for day, blocks in self.schedule(index).items():
+                created = self.at(day - timedelta(days=14))
+                for start, end in blocks:
+                    yield (
+                        next(ids),
+                        therapist_id,
+                        day,
+                        clock(start),
+                        clock(end),
+                        created,
+                    )
+
+    def panels(self, issues):
+        """
+        One to three panels per verified patient, for different issues. A
+        tenth of the active panels are still waiting for a therapist.
+        """
+        ids = count(self.ids[TherapyPanel])
+        names = list(issues)
+        weights = [ISSUES.get(name, 1) for name in names]
+        span = (self.today - self.first_day).days
+        for patient in range(self.patients):
+            if not self.verified(patient):
+                continue
+            rng = self.rng("panels", patient)
+            wanted = rng.choices((1, 2, 3), (70, 22, 8))[0]
+            chosen = set()
+            while len(chosen) < wanted:
+                chosen.add(rng.choices(names, weights)[0])
+            for name in sorted(chosen):
+                panel_id = next(ids)
+                status = pick(rng, PANEL_STATUSES)
+                # Finished panels ran for a few weeks at least
+                latest = span if status == "active" else max(span - 28, 0)
+                start = self.first_day + timedelta(days=rng.randint(0, latest))
+                created = self.at(start, rng.randint(8, 20))
+                therapists = self.issue_therapists.get(name)
+                if not therapists or (status == "active" and rng.random() < 0.1):
+                    therapist_id = assigned = finished = None
+                    status = "active"
+                else:
+                    therapist = rng.choice(therapists)
+                    therapist_id = self.ids[TherapistProfile] + therapist
+                    assigned = created
+                    cadence = rng.choices((7, 14), (70, 30))[0]
+                    if status == "active":
+                        end = self.today + timedelta(days=rng.randint(7, 35))
+                    else:
+                        end = start + timedelta(days=rng.randint(4, 20) * cadence)
+                        end = min(end, self.today - timedelta(days=1))
+                    end = min(end, self.last_day)
+                    finished = self.at(end, 18) if status == "completed" else None
+                    self.therapist_panels[therapist].append(
+                        (panel_id, patient, start, end, cadence)
+                    )
+                yield (
+                    panel_id,
+                    self.ids[PatientProfile] + patient,
+                    issues[name],
+                    therapist_id,
+                    status,
+                    assigned,
+                    finished,
+                    created,
+                    finished or created,
+                )
+
+    def book(self, schedule, free, first, last, rng):
+        """Take a free hour on the first working day from `first` to `last`."""
+        day = first
+        while day <= last:
+            if day in schedule:
+                hours = free.get(day)
+                if hours is None:
+                    hours = free[day] = [
+                        hour
+                        for start, end in schedule[day]
+                        for hour in range(start, end)
+                    ]
+                if hours:
+                    return day, hours.pop(rng.randrange(len(hours)))
+            day += timedelta(days=1)
+        return None
+
+    def appointments(self):
+        """
+        A session every week or two in the therapist's availability, up to
+        the panel's end. Some are rescheduled, up to twice per panel: the
+        original is canceled and the new one points to it.
+        """
+        ids = count(self.ids[Appointment])
+        for therapist, panels in sorted(self.therapist_panels.items()):
+            schedule = self.schedule(therapist)
+            free = {}
+            therapist_user_id = self.therapist_user_id(therapist)
+            for panel_id, patient, start, end, cadence in panels:
+                rng = self.rng("appointments", panel_id)
+                patient_user_id = self.patient_user_id(patient)
+                platform = pick(rng, PLATFORMS)
+                link = MEETING_URLS[platform].format(f"{panel_id:x}")
+                duration = 45 if rng.random() < 0.15 else 60
+                reschedules = 0
+                day = start
+                while day <= end:
+                    slot = self.book(schedule, free, day, end, rng)
+                    if slot is None:
+                        break
+                    booked, hour = slot
+                    created = self.at(
+                        min(booked - timedelta(days=rng.randint(1, 14)), self.today),
+                        rng.randint(7, 22),
+                    )
+                    payment = pick(rng, PAYMENTS["scheduled"])
+                    previous = None
+                    while (
+                        reschedules < MAX_RESCHEDULES and rng.random() < RESCHEDULE_RATE
+                    ):
+                        moved = self.book(
+                            schedule,
+                            free,
+                            booked + timedelta(days=1),
+                            min(booked + timedelta(days=7), end),
+                            rng,
+                        )
+                        if moved is None:
+                            break
+                        appointment_id = next(ids)
+                        yield (
+                            appointment_id,
+                            panel_id,
+                            self.at(booked, hour),
+                            duration,
+                            "canceled",
+                            platform,
+                            link,
+                            False,
+                            previous,
+                            payment,
+                            None,
+                            None,
+                            created,
+                        )
+                        previous = appointment_id
+                        booked, hour = moved
+                        reschedules += 1
+
+                    if booked < self.today:
+                        status = pick(rng, PAST_STATUSES)
+                    else:
+                        status = pick(rng, FUTURE_STATUSES)
+                    if status == "canceled":
+                        reason = rng.choice(CANCELLATION_REASONS)
+                        canceled_by = rng.choice((patient_user_id, therapist_user_id))
+                    else:
+                        reason = canceled_by = None
+                    if previous is None or status != "scheduled":
+                        payment = pick(rng, PAYMENTS[status])
+                    yield (
+                        next(ids),
+                        panel_id,
+                        self.at(booked, hour),
+                        duration,
+                        status,
+                        platform,
+                        link,
+                        False,
+                        previous,
+                        payment,
+                        reason,
+                        canceled_by,
+                        created,
+                    )
+                    day = booked + timedelta(days=cadence)
+
+
+class Command(BaseCommand):
+    help = (
+        "Load a synthetic, production-sized dataset (users, profiles, "
+        "availability, panels and appointments) with PostgreSQL COPY. The "
+        "data only depends on --seed and --date; ids continue from the "
+        "existing rows. Profile signals don't run and every user's password "
+        "is 'dataset-password'."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--patients", type=int, default=100_000)
+        parser.add_argument("--therapists", type=int, default=5_000)
+        parser.add_argument(
+            "--date",
+            type=date.fromisoformat,
+            help="The dataset's today, YYYY-MM-DD (default: today).",
+        )
+        parser.add_argument(
+            "--days-back", type=int, default=365, help="Days of history."
+        )
+        parser.add_argument(
+            "--days-ahead",
+            type=int,
+            default=90,
+            help="Days of availability and bookings ahead of --date.",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError(
+                f"COPY needs PostgreSQL, the default database is {connection.vendor}."
+            )
+
+        started = time.perf_counter()
+        total = 0
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                # The load can be rerun, so the commit needn't wait for the WAL
+                cursor.execute("SET LOCAL synchronous_commit TO OFF")
+
+            issues = self.create_issues()
+            through = TherapistProfile.specialties.through
+            models = [
+                User,
+                PatientProfile,
+                TherapistProfile,
+                through,
+                Availability,
+                TherapyPanel,
+                Appointment,
+            ]
+            dataset = Dataset(
+                seed=options["seed"],
+                patients=options["patients"],
+                therapists=options["therapists"],
+                today=options["date"] or timezone.localdate(),
+                days_back=options["days_back"],
+                days_ahead=options["days_ahead"],
+                ids={model: next_id(model) for model in models},
+            )
+
+            # In this order: specialties() and panels() index what the
+            # later steps read
+            steps = [
+                (User, USER_FIELDS, dataset.users()),
+                (PatientProfile, PATIENT_FIELDS, dataset.patient_profiles()),
+                (TherapistProfile, THERAPIST_FIELDS, dataset.therapist_profiles()),
+                (through, SPECIALTY_FIELDS, dataset.specialties(issues)),
+                (Availability, AVAILABILITY_FIELDS, dataset.availabilities()),
+                (TherapyPanel, PANEL_FIELDS, dataset.panels(issues)),
+                (Appointment, APPOINTMENT_FIELDS, dataset.appointments()),
+            ]
+            for model, fields, rows in steps:
+                step_started = time.perf_counter()
+                copied = copy_rows(model, fields, rows)
+                total += copied
+                if options["verbosity"] > 0:
+                    self.stdout.write(
+                        f"{model._meta.db_table}: {copied} rows "
+                        f"in {time.perf_counter() - step_started:.1f}s"
+                    )
+
+            # COPY set the ids, so move the sequences past them
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                    cursor.execute(sql)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"Loaded {total} rows in {elapsed:.0f}s."))
+
+    def create_issues(self):
+        """{name: id} of ISSUES, creating the missing ones."""
+        PsychologicalIssue.objects.bulk_create(
+            [PsychologicalIssue(name=name) for name in ISSUES], ignore_conflicts=True
+        )
+        return dict(
+            PsychologicalIssue.objects.filter(name__in=ISSUES).values_list("name", "pk")
+        )
@@ -0,0 +1,69 @@
+import io
+import os
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from therapy_connect.core import profiling
+
+
+class Command(BaseCommand):
+    help = (
+        "List, show or diff the request profiles stored by ProfilingMiddleware "
+        "in PROFILE_DIR."
+    )
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest="action", required=True)
+
+        subparsers.add_parser("list", help="List the stored profiles, newest first.")
+
+        show = subparsers.add_parser("show", help="Print the stats of a profile.")
+        show.add_argument("name")
+        show.add_argument(
+            "--sort",
+            default="cumulative",
+            help="pstats sort key, e.g. cumulative, tottime, ncalls.",
+        )
+        show.add_argument("--limit", type=int, default=30)
+
+        diff = subparsers.add_parser(
+            "diff",
+            help="Functions whose cumulative time changed most between profiles.",
+        )
+        diff.add_argument("before")
+        diff.add_argument("after")
+        diff.add_argument("--limit", type=int, default=30)
+
+    def handle(self, *args, action, **options):
+        try:
+            getattr(self, f"handle_{action}")(**options)
+        except FileNotFoundError as exc:
+            raise CommandError(exc)
+
+    def handle_list(self, **options):
+        paths = profiling.list_profiles()
+        if not paths:
+            self.stdout.write(f"No profiles in {profiling.profile_dir()}.")
+        for path in paths:
+            stored = datetime.fromtimestamp(os.path.getmtime(path))
+            self.stdout.write(f"{stored:%Y-%m-%d %H:%M:%S}  {path.stem}")
+
+    def handle_show(self, name, sort, limit, **options):
+        stats = profiling.load(name)
+        stats.stream = io.StringIO()
+        stats.sort_stats(sort).print_stats(limit)
+        self.stdout.write(stats.stream.getvalue())
+
+    def handle_diff(self, before, after, limit, **options):
+        rows = profiling.diff(profiling.load(before), profiling.load(after), limit)
+        self.stdout.write(
+            f"{'before (s)':>11} {'after (s)':>11} {'change':>9} "
+            f"{'calls':>15}  function"
+        )
+        for func, before_s, after_s, calls_before, calls_after in rows:
+            calls = f"{calls_before}->{calls_after}"
+            self.stdout.write(
+                f"{before_s:11.4f} {after_s:11.4f} {after_s - before_s:+9.4f} "
+                f"{calls:>15}  {func}"
+            )
@@ -0,0 +1,168 @@
+"""
+Memory instrumentation of a worker process.
+
+resident_memory() reads the process's RSS and its shared/private split from
+/proc. With MEMORY_TRACING on, tracemalloc runs in every worker and
+snapshots can be taken through MemoryView or by sending SIGUSR2 to a
+worker, which logs the top allocators and the growth since the previous
+snapshot.
+"""
+
+import linecache
+import logging
+import os
+import queue
+import signal
+import threading
+import tracemalloc
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Frames inside these don't tell where the memory went
+IGNORED_FILES = (
+    tracemalloc.__file__,
+    linecache.__file__,
+    "<frozen importlib._bootstrap>",
+)
+
+_snapshots = []
+_lock = threading.Lock()
+
+# SIGUSR2 only queues a request for the snapshot thread: the handler runs
+# in the main thread between any two bytecodes, possibly while it holds
+# _lock. SimpleQueue.put is reentrant, so it's safe to call there.
+_snapshot_requests = queue.SimpleQueue()
+
+
+def resident_memory(pid="self"):
+    """
+    Resident memory of a process in kB, from /proc/<pid>/smaps_rollup:
+    rss, pss (shared pages divided among the processes sharing them),
+    private (pages only this process uses) and shared.
+
+    Empty on systems without /proc.
+    """
+    fields = {
+        "Rss": "rss",
+        "Pss": "pss",
+        "Private_Clean": "private",
+        "Private_Dirty": "private",
+        "Shared_Clean": "shared",
+        "Shared_Dirty": "shared",
+    }
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as file:
+            for line in file:
+                name, _, value = line.partition(":")
+                if name in fields:
+                    key = fields[name]
+                    memory[key] = memory.get(key, 0) + int(value.split()[0])
+    except OSError:
+        return {}
+    return memory
+
+
+def start_tracing():
+    """Start tracemalloc if MEMORY_TRACING is on; call once per process."""
+    if not settings.MEMORY_TRACING or tracemalloc.is_tracing():
+        return
+    tracemalloc.start(settings.MEMORY_TRACING_FRAMES)
+    threading.Thread(
+        target=log_requested_snapshots, name="memory-snapshots", daemon=True
+    ).start()
+    signal.signal(signal.SIGUSR2, request_snapshot)
+
+
+def take_snapshot():
+    """
+    Take a snapshot, keeping the last MEMORY_TRACING_SNAPSHOTS; return it
+    with the previous one (or None).
+    """
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc isn't tracing; set MEMORY_TRACING.")
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(False, filename) for filename in IGNORED_FILES]
+    )
+    with _lock:
+        previous = _snapshots[-1] if _snapshots else None
+        _snapshots.append(snapshot)
+        del _snapshots[: -settings.MEMORY_TRACING_SNAPSHOTS]
+    return snapshot, previous
+
+
+def top_allocators(snapshot, limit=20, group_by="lineno"):
+    return [
+        {
+            "location": format_traceback(stat.traceback),
+            "size_kb": round(stat.size / 1024, 1),
+            "count": stat.count,
+        }
+        for stat in snapshot.statistics(group_by)[:limit]
+    ]
+
+
+def growth(previous, snapshot, limit=20, group_by="lineno"):
+    """The allocators that grew (or shrank) most between two snapshots."""
+    return [
+        {
+            "location": format_traceback(stat.traceback),
+            "size_kb": round(stat.size / 1024, 1),
+            "size_diff_kb": round(stat.size_diff / 1024, 1),
+            "count_diff": stat.count_diff,
+        }
+        for stat in snapshot.compare_to(previous, group_by)[:limit]
+    ]
+
+
+def format_traceback(traceback):
+    frame = traceback[0]
+    # Grouped by filename, the line number is 0
+    return f"{frame.filename}:{frame.lineno}" if frame.lineno else frame.filename
+
+
+def memory_report(limit=20, group_by="lineno"):
+    """
+    This process's resident memory and, with tracing on, the top allocators
+    of a new snapshot and the growth since the previous one.
+    """
+    report = {
+        "pid": os.getpid(),
+        "memory_kb": resident_memory(),
+        "tracing": tracemalloc.is_tracing(),
+    }
+    if report["tracing"]:
+        snapshot, previous = take_snapshot()
+        traced, peak = tracemalloc.get_traced_memory()
+        report["traced_kb"] = round(traced / 1024, 1)
+        report["traced_peak_kb"] = round(peak / 1024, 1)
+        report["top"] = top_allocators(snapshot, limit, group_by)
+        if previous is not None:
+            report["growth"] = growth(previous, snapshot, limit, group_by)
+    return report
+
+
+def request_snapshot(signum, frame):
+    _snapshot_requests.put(None)
+
+
+def log_requested_snapshots():
+    while True:
+        _snapshot_requests.get()
+        try:
+            log_snapshot()
+        except Exception:
+            logger.exception("Couldn't take a memory snapshot")
+
+
+def log_snapshot():
+    report = memory_report()
+    logger.warning("Memory of worker %s: %s", report["pid"], report["memory_kb"])
+    for stat in report["top"]:
+        logger.warning("  %(size_kb)s kB in %(count)s blocks: %(location)s", stat)
+    for stat in report.get("growth", []):
+        logger.warning(
+            "  %(size_diff_kb)+.1f kB (%(count_diff)+d blocks): %(location)s", stat
+        )
@@ -0,0 +1,181 @@
+"""
+Prometheus metrics of the API, database, caches and Celery tasks.
+
+In a process started with PROMETHEUS_MULTIPROC_DIR set (gunicorn and
+Celery workers), prometheus_client writes every sample to files in that
+directory. /metrics merges the files found under METRICS_DIR, which holds
+one such directory per service (pids only identify a process within a
+container), so a single scrape covers every worker. Without METRICS_DIR,
+/metrics reports the process serving it.
+
+Cache hit ratios are computed from cache_requests_total in queries, e.g.
+`sum by (cache) (rate(therapy_connect_cache_requests_total{tier="l1",
+result="hits"}[5m])) / sum by (cache) (rate(...{tier="l1"}[5m]))`.
+"""
+
+import ipaddress
+import os
+from glob import glob
+
+from django.conf import settings
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Histogram
+from prometheus_client.mmap_dict import MmapedDict
+from prometheus_client.multiprocess import MultiProcessCollector, mark_process_dead
+
+NAMESPACE = "therapy_connect"
+
+if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    # Samples are written there from the first labels() call on
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Time to handle a request, by URL name.",
+    ["method", "view"],
+    namespace=NAMESPACE,
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+RESPONSES = Counter(
+    "http_responses",
+    "Responses by URL name and status code.",
+    ["method", "view", "status"],
+    namespace=NAMESPACE,
+)
+REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries",
+    "Database queries made by a request, by URL name.",
+    ["view"],
+    namespace=NAMESPACE,
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200),
+)
+REQUEST_DB_DURATION = Histogram(
+    "http_request_db_duration_seconds",
+    "Time a request spent in database queries, by URL name.",
+    ["view"],
+    namespace=NAMESPACE,
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+CACHE_REQUESTS = Counter(
+    "cache_requests",
+    "Lookups in the tiered caches, by cache, tier and result.",
+    ["cache", "tier", "result"],
+    namespace=NAMESPACE,
+)
+BOOKING_CONFLICTS = Counter(
+    "booking_conflicts",
+    "Bookings rejected because the slot isn't free.",
+    ["operation", "reason"],
+    namespace=NAMESPACE,
+)
+TASK_DURATION = Histogram(
+    "celery_task_duration_seconds",
+    "Time to run a Celery task, by task and final state.",
+    ["task", "state"],
+    namespace=NAMESPACE,
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300),
+)
+TASK_ROWS = Counter(
+    "celery_task_rows",
+    "Rows written by Celery tasks.",
+    ["task"],
+    namespace=NAMESPACE,
+)
+
+UNRESOLVED = "<unresolved>"
+
+
+def view_label(request):
+    # Unmatched URLs share one label so 404 scans don't add series
+    match = getattr(request, "resolver_match", None)
+    return match.view_name if match else UNRESOLVED
+
+
+def observe_request(request, response, duration, timings):
+    """Record a finished request; `timings` are its core.timing timings."""
+    view = view_label(request)
+    queries, db_seconds = timings.metrics.get("db", (0, 0.0))
+    REQUEST_DURATION.labels(request.method, view).observe(duration)
+    RESPONSES.labels(request.method, view, response.status_code).inc()
+    REQUEST_DB_QUERIES.labels(view).observe(queries)
+    REQUEST_DB_DURATION.labels(view).observe(db_seconds)
+
+
+class SharedDirectoryCollector:
+    """
+    Merges the multiprocess files of every directory under `path`, as
+    MultiProcessCollector does for a single one.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def collect(self):
+        files = glob(os.path.join(self.path, "**", "*.db"), recursive=True)
+        return MultiProcessCollector.merge(files, accumulate=True)
+
+
+def get_registry():
+    if settings.METRICS_DIR:
+        registry = CollectorRegistry()
+        registry.register(SharedDirectoryCollector(settings.METRICS_DIR))
+        return registry
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def clear_multiprocess_dir():
+    """
+    Remove the files left in PROMETHEUS_MULTIPROC_DIR by a previous run.
+
+    Called by the process that starts the workers, before they record
+    anything.
+    """
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if not path:
+        return
+    os.makedirs(path, exist_ok=True)
+    for file in glob(os.path.join(path, "*.db")):
+        os.remove(file)
+
+
+def archive_dead_process(pid):
+    """
+    Fold the counter and histogram files of a worker that exited into one
+    archive file per type in PROMETHEUS_MULTIPROC_DIR.
+
+    Their totals have to outlive the worker for the counters to keep
+    growing, but with workers recycled every max_requests a file per dead
+    pid would pile up and slow every scrape down. Called by the gunicorn
+    master, the only process writing the archive files.
+    """
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if not path:
+        return
+    mark_process_dead(pid, path)
+    for kind in ("counter", "histogram"):
+        dead = os.path.join(path, f"{kind}_{pid}.db")
+        if not os.path.exists(dead):
+            continue
+        archive = MmapedDict(os.path.join(path, f"{kind}_archive.db"))
+        try:
+            for key, value, timestamp, _ in MmapedDict.read_all_values_from_file(dead):
+                total, _ = archive.read_value(key)
+                archive.write_value(key, total + value, timestamp)
+        finally:
+            archive.close()
+        os.remove(dead)
+
+
+def is_allowed(address):
+    """Whether `address` may read /metrics (METRICS_ALLOWED_NETWORKS)."""
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(
+        address in ipaddress.ip_network(network)
+        for network in settings.METRICS_ALLOWED_NETWORKS
+    )
@@ -0,0 +1,713 @@
+import cProfile
+import logging
+import secrets
+import threading
+import time
+from collections import defaultdict
+
+import brotli
+import jwt
+from asgiref.sync import (
+    async_to_sync,
+    iscoroutinefunction,
+    markcoroutinefunction,
+    sync_to_async,
+)
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.handlers.exception import convert_exception_to_response
+from django.http import JsonResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.module_loading import import_string
+from django.utils.regex_helper import _lazy_re_compile
+from django.utils.text import compress_string
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.settings import api_settings
+
+from . import metrics, profiling, queries, timing, tracing
+from .routers import ReplicaState, replica_state
+
+logger = logging.getLogger(__name__)
+
+re_accepts_brotli = _lazy_re_compile(r"\bbr\b")
+re_accepts_gzip = _lazy_re_compile(r"\bgzip\b")
+
+
+def compress_brotli(data, quality, max_random_bytes):
+    """
+    Brotli-compress `data` with 1 to `max_random_bytes` random bytes of
+    padding against BREACH, as compress_string does for gzip.
+
+    The padding is a metadata meta-block (RFC 7932, section 9.2), which
+    decoders skip. It goes after a flush, which leaves the stream at a byte
+    boundary, so its header is two whole bytes: ISLAST=0, MNIBBLES=0 (coded
+    as 3), a reserved 0 bit, MSKIPBYTES=1 and MSKIPLEN-1.
+    """
+    compressor = brotli.Compressor(quality=quality)
+    padding = secrets.token_bytes(secrets.randbelow(max_random_bytes) + 1)
+    metadata = 0b010110 | (len(padding) - 1) << 6
+    return b"".join(
+        [
+            compressor.process(data),
+            compressor.flush(),
+            metadata.to_bytes(2, "little"),
+            padding,
+            compressor.finish(),
+        ]
+    )
+
+
+def adapt_handler(handler, handler_is_async, is_async):
+    """Wrap `handler` so it can be called in the given sync/async mode."""
+    if handler_is_async == is_async:
+        return handler
+    if is_async:
+        return sync_to_async(handler, thread_sensitive=True)
+    return async_to_sync(handler)
+
+
+def timed_handler(name, handler, is_async, sign):
+    """
+    Add (sign=1) or subtract (sign=-1) the time spent in `handler` to
+    `request.middleware_timings[name]`.
+
+    Wrapping both a middleware and the handler it calls leaves only the
+    time the middleware itself adds.
+    """
+    if is_async:
+
+        async def timed(request):
+            started = time.perf_counter()
+            try:
+                return await handler(request)
+            finally:
+                elapsed = time.perf_counter() - started
+                request.middleware_timings[name] += sign * elapsed
+
+    else:
+
+        def timed(request):
+            started = time.perf_counter()
+            try:
+                return handler(request)
+            finally:
+                elapsed = time.perf_counter() - started
+                request.middleware_timings[name] += sign * elapsed
+
+    return timed
+
+
+class MiddlewareStack:
+    """
+    A chain of middleware, built the way Django builds MIDDLEWARE.
+
+    The process_view/process_template_response/process_exception hooks of
+    the middleware are collected so RoutedMiddleware can run them for the
+    requests this stack handles; they must be synchronous.
+    """
+
+    def __init__(self, paths, get_response, is_async, timed=False):
+        self.timed = timed
+        self.view_hooks = []
+        self.template_response_hooks = []
+        self.exception_hooks = []
+
+        handler = get_response
+        handler_is_async = is_async
+        for path in reversed(paths):
+            middleware = import_string(path)
+            name = path.rsplit(".", 1)[-1]
+            can_sync = getattr(middleware, "sync_capable", True)
+            can_async = getattr(middleware, "async_capable", False)
+            if not can_sync and not can_async:
+                raise ImproperlyConfigured(
+                    f"Middleware {path} must have at least one of "
+                    "sync_capable/async_capable set to True."
+                )
+            middleware_is_async = can_async and (handler_is_async or not can_sync)
+
+            inner = adapt_handler(handler, handler_is_async, middleware_is_async)
+            if timed:
+                inner = timed_handler(name, inner, middleware_is_async, -1)
+            try:
+                instance = middleware(inner)
+            except MiddlewareNotUsed:
+                continue
+
+            self._add_hooks(path, name, instance)
+            handler = convert_exception_to_response(instance)
+            if timed:
+                handler = timed_handler(name, handler, middleware_is_async, 1)
+            handler_is_async = middleware_is_async
+
+        self.handler = adapt_handler(handler, handler_is_async, is_async)
+
+    def _add_hooks(self, path, name, instance):
+        for attr, hooks, prepend in (
+            ("process_view", self.view_hooks, True),
+            ("process_template_response", self.template_response_hooks, False),
+            ("process_exception", self.exception_hooks, False),
+        ):
+            hook = getattr(instance, attr, None)
+            if hook is None:
+                continue
+            if iscoroutinefunction(hook):
+                raise ImproperlyConfigured(
+                    f"{path}.{attr} must be synchronous to be routed."
+                )
+            # Same order as Django: view hooks run top-down, the others
+            # bottom-up
+            if prepend:
+                hooks.insert(0, (name, hook))
+            else:
+                hooks.append((name, hook))
+
+    def _call_hook(self, request, name, hook, *args):
+        if not self.timed:
+            return hook(request, *args)
+        started = time.perf_counter()
+        try:
+            return hook(request, *args)
+        finally:
+            request.middleware_timings[name] += time.perf_counter() - started
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        for name, hook in self.view_hooks:
+            response = self._call_hook(
+                request, name, hook, view_func, view_args, view_kwargs
+            )
+            if response is not None:
+                return response
+        return None
+
+    def process_template_response(self, request, response):
+        for name, hook in self.template_response_hooks:
+            response = self._call_hook(request, name, hook, response)
+        return response
+
+    def process_exception(self, request, exception):
+        for name, hook in self.exception_hooks:
+            response = self._call_hook(request, name, hook, exception)
+            if response is not None:
+                return response
+        return None
+
+
+class RoutedMiddleware:
+    """
+    Runs a different middleware stack depending on the request path.
+
+    `ROUTED_MIDDLEWARE` maps path prefixes to lists of middleware; the
+    longest prefix the path starts with picks the stack, and a "" entry is
+    required as the catch-all.
+
+    With `MIDDLEWARE_TIMING` enabled, the time each middleware adds to a
+    request is sent back in a Server-Timing header and logged.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if "" not in settings.ROUTED_MIDDLEWARE:
+            raise ImproperlyConfigured('ROUTED_MIDDLEWARE needs a "" entry.')
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        self.timed = settings.MIDDLEWARE_TIMING
+        self.routes = [
+            (prefix, MiddlewareStack(paths, get_response, self.is_async, self.timed))
+            for prefix, paths in sorted(
+                settings.ROUTED_MIDDLEWARE.items(),
+                key=lambda item: len(item[0]),
+                reverse=True,
+            )
+        ]
+
+    def get_stack(self, request):
+        for prefix, stack in self.routes:
+            if request.path_info.startswith(prefix):
+                return stack
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stack = self.get_stack(request)
+        if not self.timed:
+            return stack.handler(request)
+        request.middleware_timings = defaultdict(float)
+        response = stack.handler(request)
+        self.report(request, response)
+        return response
+
+    async def __acall__(self, request):
+        stack = self.get_stack(request)
+        if not self.timed:
+            return await stack.handler(request)
+        request.middleware_timings = defaultdict(float)
+        response = await stack.handler(request)
+        self.report(request, response)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        return self.get_stack(request).process_view(
+            request, view_func, view_args, view_kwargs
+        )
+
+    def process_template_response(self, request, response):
+        return self.get_stack(request).process_template_response(request, response)
+
+    def process_exception(self, request, exception):
+        return self.get_stack(request).process_exception(request, exception)
+
+    def report(self, request, response):
+        timings = {
+            name: round(seconds * 1000, 3)
+            for name, seconds in request.middleware_timings.items()
+        }
+        metrics = [f"{name};dur={duration}" for name, duration in timings.items()]
+        if response.has_header("Server-Timing"):
+            metrics.insert(0, response["Server-Timing"])
+        response["Server-Timing"] = ", ".join(metrics)
+        logger.info(
+            "Middleware timings for %s %s: %s",
+            request.method,
+            request.path_info,
+            timings,
+            extra={"middleware_timings": timings},
+        )
+
+
+class ReplicaPinningMiddleware:
+    """
+    Keeps clients on the primary database for REPLICA_PIN_SECONDS after
+    they write, so they read their own writes despite replication lag.
+
+    Unsafe requests always use the primary. The pin is kept in a cookie and,
+    for JWT clients that don't keep cookies, in a cache entry for the user
+    id in the token. Not used when DATABASE_REPLICAS is empty.
+    """
+
+    sync_capable = True
+    async_capable = True
+    cookie_name = "pin_primary_db"
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        user_id = self.token_user_id(request)
+        pinned = self.is_pinned(request) or (
+            user_id is not None and bool(cache.get(self.cache_key(user_id)))
+        )
+        state = ReplicaState(pinned)
+        token = replica_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            replica_state.reset(token)
+        if state.wrote:
+            self.set_cookie(response)
+            if user_id is not None:
+                cache.set(self.cache_key(user_id), True, settings.REPLICA_PIN_SECONDS)
+        return response
+
+    async def __acall__(self, request):
+        user_id = self.token_user_id(request)
+        pinned = self.is_pinned(request) or (
+            user_id is not None and bool(await cache.aget(self.cache_key(user_id)))
+        )
+        state = ReplicaState(pinned)
+        token = replica_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            replica_state.reset(token)
+        if state.wrote:
+            self.set_cookie(response)
+            if user_id is not None:
+                await cache.aset(
+                    self.cache_key(user_id), True, settings.REPLICA_PIN_SECONDS
+                )
+        return response
+
+    def is_pinned(self, request):
+        return request.method not in SAFE_METHODS or self.cookie_name in request.COOKIES
+
+    def set_cookie(self, response):
+        response.set_cookie(
+            self.cookie_name,
+            "1",
+            max_age=settings.REPLICA_PIN_SECONDS,
+            httponly=True,
+            samesite="Lax",
+        )
+
+    def cache_key(self, user_id):
+        return f"core:replica-pin:{user_id}"
+
+    def token_user_id(self, request):
+        """
+        Return the user id claim of the request's bearer token, if any.
+
+        The signature isn't verified: the id only decides which database
+        serves the reads, and authentication still happens in the view.
+        """
+        parts = request.META.get("HTTP_AUTHORIZATION", "").split()
+        if len(parts) != 2 or parts[0] not in api_settings.AUTH_HEADER_TYPES:
+            return None
+        try:
+            claims = jwt.decode(parts[1], options={"verify_signature": False})
+        except jwt.InvalidTokenError:
+            return None
+        return claims.get(api_settings.USER_ID_CLAIM)
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compresses responses of at least COMPRESSION_MIN_SIZE bytes with brotli,
+    or gzip for clients that don't accept brotli.
+
+    Like Django's GZipMiddleware, the output is padded with random bytes
+    against BREACH (see compress_brotli) and ETags are made weak. Streaming
+    responses are left alone.
+    """
+
+    max_random_bytes = 100
+
+    def process_response(self, request, response):
+        if response.streaming or response.has_header("Content-Encoding"):
+            return response
+        if len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        accept_encoding = request.META.get("HTTP_ACCEPT_ENCODING", "")
+        if re_accepts_brotli.search(accept_encoding):
+            encoding = "br"
+            content = compress_brotli(
+                response.content,
+                quality=settings.COMPRESSION_BROTLI_QUALITY,
+                max_random_bytes=self.max_random_bytes,
+            )
+        elif re_accepts_gzip.search(accept_encoding):
+            encoding = "gzip"
+            content = compress_string(
+                response.content, max_random_bytes=self.max_random_bytes
+            )
+        else:
+            return response
+
+        # Return the compressed content only if it's actually shorter
+        if len(content) >= len(response.content):
+            return response
+        response.content = content
+        response["Content-Length"] = str(len(content))
+        response["Content-Encoding"] = encoding
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        return response
+
+
+class TracingMiddleware:
+    """
+    Runs each request in a root span (see core/tracing.py), joining the
+    caller's trace if it sends a `traceparent` header, and returns the trace
+    id in the X-Trace-Id header.
+
+    Enabled by TRACING = True.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.TRACING:
+            raise MiddlewareNotUsed
+        tracing.install()
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with self.span(request) as root:
+            response = self.get_response(request)
+            self.finish(root, request, response)
+        return response
+
+    async def __acall__(self, request):
+        with self.span(request) as root:
+            response = await self.get_response(request)
+            self.finish(root, request, response)
+        return response
+
+    def span(self, request):
+        return tracing.span(
+            f"HTTP {request.method}",
+            traceparent=request.META.get("HTTP_TRACEPARENT"),
+            method=request.method,
+            path=request.path,
+        )
+
+    def finish(self, root, request, response):
+        # The view is only known once the URL was resolved
+        root.name = f"{request.method} {metrics.view_label(request)}"
+        root.attributes["status_code"] = response.status_code
+        if response.status_code >= 500:
+            root.status = "error"
+        response.headers["X-Trace-Id"] = root.trace_id
+
+
+class RequestTimingMiddleware:
+    """
+    Reports where a request's time went: database queries (count and
+    time), serializer validation, rendering and the total, in a
+    Server-Timing header and a log line.
+
+    Turned on with REQUEST_TIMING; when off the middleware isn't loaded
+    and nothing is instrumented. Put it first so the total covers the
+    other middleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_TIMING:
+            raise MiddlewareNotUsed
+        timing.install()
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        timings = timing.RequestTimings()
+        token = timing.request_timings.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            timing.request_timings.reset(token)
+        self.report(request, response, timings)
+        return response
+
+    async def __acall__(self, request):
+        timings = timing.RequestTimings()
+        token = timing.request_timings.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            timing.request_timings.reset(token)
+        self.report(request, response, timings)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after every process_template_response
+        # hook has run, and the post-render callbacks right after
+        timings = timing.request_timings.get()
+        if timings is not None:
+            started = time.perf_counter()
+            response.add_post_render_callback(
+                lambda response: timings.add("render", time.perf_counter() - started)
+            )
+        return response
+
+    def report(self, request, response, timings):
+        data = {
+            name: {"count": count, "ms": round(seconds * 1000, 3)}
+            for name, (count, seconds) in timings.metrics.items()
+        }
+        data["total"] = {"count": 1, "ms": round(timings.total() * 1000, 3)}
+
+        metrics = []
+        for name, values in data.items():
+            if name == "db":
+                metrics.append(
+                    f'db;desc="{values["count"]} queries";dur={values["ms"]}'
+                )
+            else:
+                metrics.append(f"{name};dur={values['ms']}")
+        if response.has_header("Server-Timing"):
+            metrics.insert(0, response["Server-Timing"])
+        response["Server-Timing"] = ", ".join(metrics)
+
+        logger.info(
+            "Request timings for %s %s (%s): %s",
+            request.method,
+            request.path_info,
+            response.status_code,
+            data,
+            extra={"request_timings": data, "status_code": response.status_code},
+        )
+
+
+class MetricsMiddleware:
+    """
+    Records each request's latency, status code and database queries,
+    labelled by URL name, in the Prometheus metrics served at /metrics.
+
+    Disabled by METRICS_ENABLED = False.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        timing.install()
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        # Shares the timings of RequestTimingMiddleware when it's enabled
+        timings, token = self.start()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            if token is not None:
+                timing.request_timings.reset(token)
+        duration = time.perf_counter() - started
+        metrics.observe_request(request, response, duration, timings)
+        return response
+
+    async def __acall__(self, request):
+        timings, token = self.start()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            if token is not None:
+                timing.request_timings.reset(token)
+        duration = time.perf_counter() - started
+        metrics.observe_request(request, response, duration, timings)
+        return response
+
+    def start(self):
+        timings = timing.request_timings.get()
+        if timings is not None:
+            return timings, None
+        timings = timing.RequestTimings()
+        return timings, timing.request_timings.set(timings)
+
+
+class QueryInspectionMiddleware:
+    """
+    Reports the N+1 and slow queries of each request (see core/queries.py).
+
+    For development and staging, turned on with QUERY_INSPECTION.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.QUERY_INSPECTION:
+            raise MiddlewareNotUsed
+        queries.install()
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with queries.inspect_queries(f"{request.method} {request.path_info}"):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with queries.inspect_queries(f"{request.method} {request.path_info}"):
+            return await self.get_response(request)
+
+
+class ProfilingMiddleware:
+    """
+    Runs the requests a staff user asks to profile under cProfile and
+    stores their stats (see core/profiling.py). Other requests only pay for
+    a header and query string lookup.
+
+    Under ASGI the profile covers the event loop thread: work handed to
+    sync_to_async threads (sync views, ORM calls) shows up as the time
+    spent awaiting it, and other requests served meanwhile are included.
+    Only one profile can run on the loop at a time, so a second profiled
+    request gets a 409 until the first one is done.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        # Held while a profile runs on the event loop
+        self.loop_profile_lock = threading.Lock()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not (profiling.is_requested(request) and profiling.is_staff(request)):
+            return self.get_response(request)
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        self.save(profiler, request, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if not profiling.is_requested(request):
+            return await self.get_response(request)
+        if not await sync_to_async(profiling.is_staff)(request):
+            return await self.get_response(request)
+        # A second profiler enabled on the same thread would replace the
+        # first one's hook
+        if not self.loop_profile_lock.acquire(blocking=False):
+            return JsonResponse(
+                {"detail": "Another request is being profiled, try again."},
+                status=409,
+            )
+        try:
+            profiler = cProfile.Profile()
+            started = time.perf_counter()
+            profiler.enable()
+            try:
+                response = await self.get_response(request)
+            finally:
+                profiler.disable()
+        finally:
+            self.loop_profile_lock.release()
+        self.save(profiler, request, response, time.perf_counter() - started)
+        return response
+
+    def save(self, profiler, request, response, duration):
+        name = profiling.save(profiler, request, response, duration)
+        response["X-Profile-Id"] = name
+        logger.info("Stored profile %s", name)
@@ -0,0 +1,117 @@
+"""
+On-demand profiles of single requests.
+
+A staff user asks for one with an `X-Profile: 1` header or a `profile=1`
+query parameter; the request then runs under cProfile and its stats are
+written to PROFILE_DIR, keeping the latest PROFILE_MAX_FILES. The file name
+is returned in the X-Profile-Id header. `manage.py profiles` lists, shows
+and diffs the stored profiles.
+"""
+
+import os
+import pstats
+import re
+import uuid
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+from therapy_connect.accounts.authentication import StatelessJWTAuthentication
+
+re_unsafe = re.compile(r"[^\w-]+")
+
+
+def is_requested(request):
+    if request.META.get("HTTP_X_PROFILE") == "1":
+        return True
+    # Only parse the query string if it may hold the flag
+    query_string = request.META.get("QUERY_STRING", "")
+    return "profile=1" in query_string and request.GET.get("profile") == "1"
+
+
+def is_staff(request):
+    """Whether the request's access token belongs to a staff user."""
+    # DRF authenticates in the view, after the middleware ran
+    try:
+        result = StatelessJWTAuthentication().authenticate(request)
+    except (AuthenticationFailed, InvalidToken):
+        return False
+    return result is not None and result[0].is_staff
+
+
+def profile_dir():
+    return Path(settings.PROFILE_DIR)
+
+
+def save(profiler, request, response, duration):
+    """Write the stats of a profiled request; return the profile's name."""
+    match = getattr(request, "resolver_match", None)
+    view = match.view_name if match else request.path_info
+    name = "_".join(
+        [
+            datetime.now().strftime("%Y%m%dT%H%M%S"),
+            request.method,
+            re_unsafe.sub("-", view).strip("-")[:60],
+            str(response.status_code),
+            f"{round(duration * 1000)}ms",
+            uuid.uuid4().hex[:6],
+        ]
+    )
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    profiler.dump_stats(directory / f"{name}.prof")
+    prune()
+    return name
+
+
+def list_profiles():
+    """Paths of the stored profiles, newest first."""
+    directory = profile_dir()
+    if not directory.is_dir():
+        return []
+    return sorted(directory.glob("*.prof"), key=os.path.getmtime, reverse=True)
+
+
+def prune():
+    for path in islice(list_profiles(), settings.PROFILE_MAX_FILES, None):
+        path.unlink(missing_ok=True)
+
+
+def load(name):
+    """pstats.Stats of a stored profile, by name (with or without .prof)."""
+    path = profile_dir() / name
+    if path.suffix != ".prof":
+        path = path.with_name(f"{path.name}.prof")
+    if not path.exists():
+        raise FileNotFoundError(f"No profile named {name} in {profile_dir()}")
+    return pstats.Stats(str(path))
+
+
+def function_times(stats):
+    """{"file:line(function)": (calls, own seconds, cumulative seconds)}."""
+    return {
+        pstats.func_std_string(func): (calls, own, cumulative)
+        for func, (_, calls, own, cumulative, _) in stats.stats.items()
+    }
+
+
+def diff(before, after, limit=20):
+    """
+    The functions whose cumulative time changed most between two profiles,
+    as (function, cumulative before, cumulative after, calls before, calls
+    after) rows.
+    """
+    before = function_times(before)
+    after = function_times(after)
+    rows = []
+    for func in before.keys() | after.keys():
+        calls_before, _, cumulative_before = before.get(func, (0, 0.0, 0.0))
+        calls_after, _, cumulative_after = after.get(func, (0, 0.0, 0.0))
+        rows.append(
+            (func, cumulative_before, cumulative_after, calls_before, calls_after)
+        )
+    rows.sort(key=lambda row: abs(row[2] - row[1]), reverse=True)
+    return rows[:limit]
@@ -0,0 +1,202 @@
+"""
+Query inspection for development and staging.
+
+With QUERY_INSPECTION on, the queries of each request are fingerprinted
+(SQL with literals and placeholder lists collapsed) and attributed to the
+project code that issued them:
+
+- a fingerprint repeated NPLUSONE_THRESHOLD times or more is reported as an
+  N+1, with the line that issued it;
+- a query slower than SLOW_QUERY_MS is logged with its
+  EXPLAIN (ANALYZE, BUFFERS) plan on PostgreSQL.
+
+With QUERY_INSPECTION_RAISE, N+1s raise NPlusOneError, which fails the test
+that made the request. Known N+1s are silenced by listing their
+fingerprints in QUERY_INSPECTION_IGNORE.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import time
+import traceback
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils.regex_helper import _lazy_re_compile
+
+logger = logging.getLogger(__name__)
+
+# The inspector of the request (or block) being inspected, if any
+current_inspector = ContextVar("current_inspector", default=None)
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Frames of the entry points, query wrappers and middleware aren't where a
+# query comes from
+IGNORED_FILES = {
+    os.path.join(PROJECT_DIR, *path)
+    for path in (
+        ("manage.py",),
+        ("asgi.py",),
+        ("wsgi.py",),
+        ("core", "queries.py"),
+        ("core", "timing.py"),
+        ("core", "tracing.py"),
+        ("core", "middleware.py"),
+    )
+}
+
+re_string = _lazy_re_compile(r"'(?:[^']|'')*'")
+re_number = _lazy_re_compile(r"\b\d+(?:\.\d+)?\b")
+re_placeholder_list = _lazy_re_compile(r"\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)")
+# FOR UPDATE, FOR NO KEY UPDATE, FOR SHARE and FOR KEY SHARE
+re_locking_clause = _lazy_re_compile(
+    r"\bFOR\s+(?:NO\s+KEY\s+)?UPDATE\b|\bFOR\s+(?:KEY\s+)?SHARE\b", re.IGNORECASE
+)
+
+_installed = False
+
+
+class NPlusOneError(Exception):
+    pass
+
+
+def fingerprint(sql):
+    """A short id of `sql` that ignores literals and IN list lengths."""
+    normalized = re_string.sub("?", sql)
+    normalized = re_number.sub("?", normalized)
+    normalized = re_placeholder_list.sub("(...)", normalized)
+    return hashlib.sha1(normalized.encode()).hexdigest()[:12]
+
+
+def query_origin():
+    """The innermost project line on the stack, as "path:line in function"."""
+    for frame, lineno in traceback.walk_stack(None):
+        filename = frame.f_code.co_filename
+        if filename.startswith(PROJECT_DIR) and filename not in IGNORED_FILES:
+            path = os.path.relpath(filename, os.path.dirname(PROJECT_DIR))
+            return f"{path}:{lineno} in {frame.f_code.co_name}"
+    return "<unknown>"
+
+
+def explain(connection, sql, params):
+    """
+    The plan of a SELECT, run through EXPLAIN (ANALYZE, BUFFERS).
+
+    The EXPLAIN runs in a savepoint that is always rolled back, so a failure
+    doesn't abort the request's transaction. Locking reads are skipped: run
+    again, they would wait on the locks the request already holds.
+    """
+    if connection.vendor != "postgresql":
+        return None
+    if sql.lstrip()[:6].upper() != "SELECT":
+        # ANALYZE would run the statement a second time
+        return None
+    if re_locking_clause.search(sql):
+        return None
+    try:
+        # The raw connection and cursor bypass the execute wrappers
+        with connection.connection.transaction(force_rollback=True):
+            with connection.connection.cursor() as cursor:
+                cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {sql}", params)
+                return "\n".join(row[0] for row in cursor.fetchall())
+    except connection.Database.Error as exc:
+        return f"Couldn't explain the query: {exc}"
+
+
+class QueryInspector:
+    def __init__(self, label):
+        self.label = label
+        # fingerprint -> [count, sql, origin of the first occurrence]
+        self.queries = {}
+
+    def record(self, connection, sql, params, many, duration):
+        key = fingerprint(sql)
+        query = self.queries.get(key)
+        if query is None:
+            query = self.queries[key] = [0, sql, query_origin()]
+        query[0] += 1
+
+        duration_ms = duration * 1000
+        if duration_ms >= settings.SLOW_QUERY_MS:
+            plan = None if many else explain(connection, sql, params)
+            logger.warning(
+                "Slow query (%.1f ms, %s) in %s from %s: %s%s",
+                duration_ms,
+                key,
+                self.label,
+                query_origin(),
+                sql,
+                f"\n{plan}" if plan else "",
+            )
+
+    def n_plus_one(self):
+        """(fingerprint, count, sql, origin) of the repeated queries."""
+        return [
+            (key, count, sql, origin)
+            for key, (count, sql, origin) in self.queries.items()
+            if count >= settings.NPLUSONE_THRESHOLD
+            and key not in settings.QUERY_INSPECTION_IGNORE
+        ]
+
+    def report(self):
+        repeated = self.n_plus_one()
+        for key, count, sql, origin in repeated:
+            logger.warning(
+                "N+1 query (%s) in %s: %s times from %s: %s",
+                key,
+                self.label,
+                count,
+                origin,
+                sql,
+            )
+        if repeated and settings.QUERY_INSPECTION_RAISE:
+            raise NPlusOneError(
+                f"{len(repeated)} N+1 queries in {self.label}: "
+                + ", ".join(f"{key} from {origin}" for key, _, _, origin in repeated)
+            )
+
+
+@contextmanager
+def inspect_queries(label):
+    """Inspect the queries run in the block, reporting N+1s at the end."""
+    inspector = QueryInspector(label)
+    token = current_inspector.set(inspector)
+    try:
+        yield inspector
+    finally:
+        current_inspector.reset(token)
+    inspector.report()
+
+
+def inspect_query(execute, sql, params, many, context):
+    inspector = current_inspector.get()
+    if inspector is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    result = execute(sql, params, many, context)
+    inspector.record(
+        context["connection"], sql, params, many, time.perf_counter() - started
+    )
+    return result
+
+
+def add_query_inspection(sender, connection, **kwargs):
+    if inspect_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(inspect_query)
+
+
+def install():
+    """Inspect queries on every connection; a no-op outside inspect_queries()."""
+    global _installed
+    if _installed:
+        return
+    _installed = True
+
+    connection_created.connect(add_query_inspection)
+    for connection in connections.all(initialized_only=True):
+        add_query_inspection(None, connection)
@@ -0,0 +1,61 @@
+import decimal
+
+import msgpack
+import orjson
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+_encoder = JSONEncoder()
+
+
+def encode_default(obj):
+    """
+    Encode what orjson and msgpack don't handle natively, the way DRF's
+    JSONEncoder does.
+
+    Decimals are kept exact as strings unless COERCE_DECIMAL_TO_STRING is
+    turned off.
+    """
+    if isinstance(obj, decimal.Decimal) and api_settings.COERCE_DECIMAL_TO_STRING:
+        return str(obj)
+    return _encoder.default(obj)
+
+
+class ORJSONRenderer(BaseRenderer):
+    """
+    Drop-in replacement for DRF's JSONRenderer, backed by orjson.
+
+    Output is compact unless the client asks for `indent` in the Accept
+    header, which gives 2-space indentation.
+    """
+
+    media_type = "application/json"
+    format = "json"
+    charset = None
+    options = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        options = self.options
+        if accepted_media_type and "indent" in accepted_media_type:
+            options |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=encode_default, option=options)
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    MessagePack for clients that send `Accept: application/msgpack` (or
+    `?format=msgpack`); dates and times are ISO 8601 strings as in JSON.
+    """
+
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return msgpack.packb(data, default=encode_default, use_bin_type=True)
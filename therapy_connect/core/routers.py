@@ -0,0 +1,48 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+
+# Set by ReplicaPinningMiddleware for the duration of a request. Reads made
+# outside a request (Celery tasks, management commands) use the primary.
+replica_state = ContextVar("replica_state", default=None)
+
+
+class ReplicaState:
+    def __init__(self, pinned=False):
+        # Read from the primary for the whole request
+        self.pinned = pinned
+        # Set on the first write; later reads go to the primary too
+        self.wrote = False
+
+
+class ReplicaRouter:
+    """
+    Sends the reads of a request to a random alias in DATABASE_REPLICAS.
+
+    Requests pinned to the primary (see ReplicaPinningMiddleware) and reads
+    that follow a write in the same request use "default", as do all writes.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = replica_state.get()
+        if state is None or state.pinned or state.wrote:
+            return None
+        if not settings.DATABASE_REPLICAS:
+            return None
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        state = replica_state.get()
+        if state is not None:
+            state.wrote = True
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
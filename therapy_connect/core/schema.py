@@ -0,0 +1,73 @@
+import gzip
+import hashlib
+from functools import lru_cache
+from pathlib import Path
+
+import brotli
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+
+def compress(content, encoding):
+    """Compress deterministically, so every build gives the same bytes."""
+    if encoding == "br":
+        return brotli.compress(content)
+    return gzip.compress(content, mtime=0)
+
+
+def schema_files(path=None):
+    """
+    Where the schema is stored in each format: JSON at `path` (by default
+    OPENAPI_SCHEMA_FILE) and YAML next to it, with a .yaml suffix.
+    """
+    path = Path(path or settings.OPENAPI_SCHEMA_FILE)
+    return {"json": path, "yaml": path.with_suffix(".yaml")}
+
+
+def write_schema(path, content):
+    """Write the schema and its compressed copies next to it."""
+    path = Path(path)
+    path.write_bytes(content)
+    for encoding, suffix in ENCODINGS.items():
+        Path(f"{path}{suffix}").write_bytes(compress(content, encoding))
+
+
+class StoredSchema:
+    """
+    One format of the OpenAPI schema written by `manage.py build_schema`,
+    with its brotli and gzip encodings.
+
+    Every encoding is deterministic, so each gets a strong ETag that is the
+    same in every worker.
+    """
+
+    def __init__(self, path):
+        path = Path(path)
+        try:
+            content = path.read_bytes()
+        except FileNotFoundError:
+            raise ImproperlyConfigured(
+                f"{path} doesn't exist, run `manage.py build_schema` or turn "
+                "off SERVE_STORED_SCHEMA."
+            )
+        digest = hashlib.sha256(content).hexdigest()[:32]
+        self.variants = {None: (content, f'"{digest}"')}
+        for encoding, suffix in ENCODINGS.items():
+            compressed_path = Path(f"{path}{suffix}")
+            if compressed_path.exists():
+                compressed = compressed_path.read_bytes()
+            else:
+                compressed = compress(content, encoding)
+            self.variants[encoding] = (compressed, f'"{digest}-{encoding}"')
+
+    def get(self, encoding=None):
+        """Return (content, etag) for `encoding` ("br", "gzip" or None)."""
+        return self.variants[encoding]
+
+
+@lru_cache(maxsize=None)
+def get_stored_schema(format="json"):
+    """Load the stored schema in `format` ("json" or "yaml") once per process."""
+    return StoredSchema(schema_files()[format])
@@ -0,0 +1,123 @@
+"""
+Test helpers shared by the apps' test suites.
+"""
+
+import importlib
+from contextlib import contextmanager
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches
+from rest_framework.test import APITestCase
+
+from therapy_connect.accounts.tokens import RoleRefreshToken
+
+PASSWORD = "test-password"
+
+# The URL confs that pick views by ASYNC_VIEWS when imported
+ASYNC_VIEWS_URLCONFS = ["therapy_connect.accounts.urls", "therapy_connect.therapy.urls"]
+
+
+@lru_cache(maxsize=None)
+def password_hash():
+    # Hashing is slow by design; every test user shares one hash
+    return make_password(PASSWORD)
+
+
+def create_user(role, number, **fields):
+    """
+    An active user with the role and PASSWORD; the post_save signal creates
+    the profile. `number` tells apart the users of a role.
+    """
+    return get_user_model().objects.create(
+        email=f"{role}{number}@example.com",
+        mobile_number=f"{1 if role == 'patient' else 2}{number:09d}",
+        first_name=role.title(),
+        last_name=str(number),
+        role=role,
+        is_active=True,
+        password=password_hash(),
+        **fields,
+    )
+
+
+def reload_urlconfs():
+    # The root URL conf's resolvers hold on to the included patterns
+    for name in [*ASYNC_VIEWS_URLCONFS, settings.ROOT_URLCONF]:
+        importlib.reload(importlib.import_module(name))
+    clear_url_caches()
+
+
+@contextmanager
+def serve_async_views(enabled=True):
+    """
+    Route to the async (or, with `enabled=False`, the sync) variants of the
+    views, as ASYNC_VIEWS does. Can be nested.
+    """
+    try:
+        with override_settings(ASYNC_VIEWS=enabled):
+            reload_urlconfs()
+            yield
+    finally:
+        reload_urlconfs()
+
+
+# Reads would go to the replica's own connection, which can't see the data
+# of the test's transaction
+@override_settings(DATABASE_REPLICAS=[])
+class QueryBudgetTestCase(APITestCase):
+    """
+    Checks that an endpoint's query count doesn't grow with the rows it
+    returns or checks, so a new serializer field can't add a query per row.
+    """
+
+    sizes = (1, 10, 100)
+
+    def authenticate(self, user):
+        """Send the user's access token, with the role claims, from now on."""
+        access = RoleRefreshToken.for_user(user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+
+    def assertQueryBudget(self, budget, prepare, status=200):
+        """
+        For each of `sizes`, call `prepare(size)` to create that many related
+        rows and return the request to make; then check that the request
+        returns `status` and makes the same number of queries for every size,
+        and no more than `budget`.
+
+        Each size runs in a transaction that is rolled back, with empty
+        caches, so the counts include the cache misses.
+        """
+        runs = {}
+        for size in self.sizes:
+            with transaction.atomic():
+                request = prepare(size)
+                for cache in caches.all():
+                    cache.clear()
+                with CaptureQueriesContext(connection) as queries:
+                    response = request()
+                transaction.set_rollback(True)
+            self.assertEqual(
+                response.status_code,
+                status,
+                f"With {size} rows: {getattr(response, 'data', response.content)}",
+            )
+            runs[size] = queries.captured_queries
+
+        counts = {size: len(queries) for size, queries in runs.items()}
+        first = self.sizes[0]
+        for size, queries in runs.items():
+            if len(queries) != counts[first] or len(queries) > budget:
+                self.fail(
+                    f"{len(queries)} queries with {size} rows (budget {budget}, "
+                    f"counts by rows {counts}):\n"
+                    + "\n".join(
+                        f"{i}. {query['sql']}" for i, query in enumerate(queries, 1)
+                    )
+                )
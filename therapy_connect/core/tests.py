@@ -0,0 +1,699 @@
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+import time
+from datetime import date, datetime
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+from glob import glob
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+from uuid import UUID
+
+import brotli
+import msgpack
+import orjson
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.db import connections
+from django.http import Http404, HttpResponse
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from prometheus_client.mmap_dict import MmapedDict, mmap_key
+from prometheus_client.multiprocess import MultiProcessCollector
+from rest_framework.exceptions import NotFound
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+from rest_framework.views import APIView
+
+from therapy_connect.accounts.tokens import RoleRefreshToken
+from therapy_connect.core.testing import create_user
+from therapy_connect.profiles.cache import issue_cache, therapist_cache
+from therapy_connect.profiles.models import PsychologicalIssue, TherapistProfile
+
+from .cache import MISSING, InvalidationBus, LocalCache, ModelCache, _local_caches
+from . import tracing
+from .metrics import archive_dead_process
+from .middleware import (
+    CompressionMiddleware,
+    ProfilingMiddleware,
+    ReplicaPinningMiddleware,
+    TracingMiddleware,
+)
+from .renderers import MessagePackRenderer, ORJSONRenderer
+from .routers import ReplicaState, replica_state
+from .schema import get_stored_schema, schema_files, write_schema
+from .views import AsyncDispatchMixin, StoredSchemaView
+
+User = get_user_model()
+
+
+class QueriesByAlias:
+    """Captures the queries made on the primary and on the replica."""
+
+    def __enter__(self):
+        self.contexts = {
+            alias: CaptureQueriesContext(connections[alias])
+            for alias in ("default", "replica")
+        }
+        for context in self.contexts.values():
+            context.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        for context in self.contexts.values():
+            context.__exit__(*exc_info)
+
+    def __getitem__(self, alias):
+        return len(self.contexts[alias])
+
+
+# "replica" mirrors "default" in tests (see settings.local), on a connection
+# of its own; the test data is committed so that connection sees it.
+@override_settings(DATABASE_REPLICAS=["replica"], REPLICA_PIN_SECONDS=1)
+class ReplicaRoutingTests(TransactionTestCase):
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        self.user = create_user("patient", 1)
+
+    def in_request(self, pinned=False):
+        """Route as in a request handled by ReplicaPinningMiddleware."""
+        state = ReplicaState(pinned)
+        self.addCleanup(replica_state.reset, replica_state.set(state))
+        return state
+
+    def test_reads_in_a_request_go_to_the_replica(self):
+        self.in_request()
+        with QueriesByAlias() as queries:
+            self.assertTrue(User.objects.filter(pk=self.user.pk).exists())
+        self.assertEqual((queries["default"], queries["replica"]), (0, 1))
+
+    def test_reads_outside_a_request_use_the_primary(self):
+        self.assertEqual(User.objects.all().db, "default")
+
+    def test_pinned_requests_read_from_the_primary(self):
+        self.in_request(pinned=True)
+        self.assertEqual(User.objects.all().db, "default")
+
+    def test_writes_and_locking_reads_go_to_the_primary(self):
+        state = self.in_request()
+        self.assertEqual(User.objects.select_for_update().db, "default")
+        with QueriesByAlias() as queries:
+            User.objects.filter(pk=self.user.pk).update(first_name="Renamed")
+        self.assertEqual((queries["default"], queries["replica"]), (1, 0))
+        self.assertTrue(state.wrote)
+        # Later reads in the same request see the write
+        self.assertEqual(User.objects.all().db, "default")
+
+
+@override_settings(DATABASE_REPLICAS=["replica"], REPLICA_PIN_SECONDS=1)
+class ReplicaPinningTests(TransactionTestCase):
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        # Pins are kept in the cache by user id
+        cache.clear()
+        self.user = create_user("patient", 1)
+        access = RoleRefreshToken.for_user(self.user).access_token
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+
+    def read_profile(self):
+        """Fetch the profile; return the alias it was read from."""
+        with QueriesByAlias() as queries:
+            response = self.client.get(reverse("accounts:user-profile"))
+        self.assertEqual(response.status_code, 200, response.data)
+        aliases = [alias for alias in ("default", "replica") if queries[alias]]
+        self.assertEqual(len(aliases), 1, "Reads went to both databases")
+        return aliases[0]
+
+    def update_profile(self):
+        response = self.client.patch(
+            reverse("accounts:user-profile-update"), {"first_name": "Renamed"}
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        return response
+
+    def test_reads_use_the_replica_until_the_client_writes(self):
+        self.assertEqual(self.read_profile(), "replica")
+
+        response = self.update_profile()
+
+        cookie = response.cookies[ReplicaPinningMiddleware.cookie_name]
+        self.assertEqual(cookie["max-age"], 1)
+        self.assertEqual(self.read_profile(), "default")
+
+    def test_cache_marker_pins_clients_without_the_cookie(self):
+        self.update_profile()
+        self.client.cookies.clear()
+
+        self.assertEqual(self.read_profile(), "default")
+
+    def test_pin_expires(self):
+        self.update_profile()
+        # The browser drops the cookie after its max-age
+        self.client.cookies.clear()
+        time.sleep(1.1)
+
+        self.assertEqual(self.read_profile(), "replica")
+
+
+class AsyncItemView(AsyncDispatchMixin, APIView):
+    authentication_classes = []
+    permission_classes = []
+
+    async def get(self, request, pk):
+        if pk == 0:
+            raise NotFound()
+        return Response({"pk": pk})
+
+
+class AsyncDispatchMixinTests(SimpleTestCase):
+    async def request(self, method, pk=1, **initkwargs):
+        request = getattr(RequestFactory(), method)(f"/items/{pk}/")
+        return await AsyncItemView.as_view(**initkwargs)(request, pk=pk)
+
+    async def test_awaits_async_handlers(self):
+        response = await self.request("get")
+        self.assertEqual((response.status_code, response.data), (200, {"pk": 1}))
+
+    async def test_calls_sync_handlers(self):
+        # APIView.options isn't async
+        response = await self.request("options")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["name"], "Async Item")
+
+    async def test_handles_exceptions_as_drf_does(self):
+        self.assertEqual((await self.request("get", pk=0)).status_code, 404)
+        self.assertEqual((await self.request("delete")).status_code, 405)
+        response = await self.request("get", permission_classes=[IsAuthenticated])
+        self.assertEqual(response.status_code, 403)
+
+    async def test_responses_are_rendered(self):
+        response = await self.request("get")
+        response.render()
+        self.assertEqual(response.content, b'{"pk":1}')
+
+
+TEST_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "l2": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "l2",
+    },
+    "tiered": {
+        "BACKEND": "therapy_connect.core.cache.TieredCache",
+        "LOCATION": "l2",
+        "OPTIONS": {"NAME": "tiered-tests", "L1_TIMEOUT": 30},
+    },
+}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TieredCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = caches["tiered"]
+        self.l2 = caches["l2"]
+        self.cache.clear()
+
+    def counts(self):
+        return {name: self.cache.counters[name] for name in self.cache.counters}
+
+    def test_l1_hits_misses_and_expiry(self):
+        self.cache.set("key", "value")
+        before = self.counts()
+        self.assertEqual(self.cache.get("key"), "value")
+        self.assertEqual(self.cache.get("key"), "value")
+        after = self.counts()
+        self.assertEqual(after["l1_misses"] - before["l1_misses"], 1)
+        self.assertEqual(after["l1_hits"] - before["l1_hits"], 1)
+        self.assertEqual(after["l2_hits"] - before["l2_hits"], 1)
+
+        # Served from L1 until it expires, even if L2 changed behind its back
+        self.l2.set("key", "changed")
+        self.assertEqual(self.cache.get("key"), "value")
+        later = time.monotonic() + 31
+        with mock.patch("time.monotonic", return_value=later):
+            self.assertEqual(self.cache.get("key"), "changed")
+
+    def test_l1_copies_are_not_shared(self):
+        self.cache.set("key", ["value"])
+        self.cache.get("key").append("mutated")
+        self.assertEqual(self.cache.get("key"), ["value"])
+
+    def test_writes_drop_the_l1_copy(self):
+        self.cache.set("key", "value")
+        self.cache.get("key")
+        self.cache.set("key", "new")
+        self.assertEqual(self.cache.get("key"), "new")
+        self.cache.delete("key")
+        self.assertIsNone(self.cache.get("key"))
+
+    def test_values_read_during_an_invalidation_are_not_kept(self):
+        self.cache.set("key", "old")
+        l2_get = self.l2.get
+
+        def get_then_invalidated(*args, **kwargs):
+            value = l2_get(*args, **kwargs)
+            # Another thread writes, or a message arrives, meanwhile
+            self.l2.set("key", "new")
+            self.cache.l1.delete([self.cache.make_and_validate_key("key")])
+            return value
+
+        with mock.patch.object(self.l2, "get", side_effect=get_then_invalidated):
+            self.assertEqual(self.cache.get("key"), "old")
+        self.assertEqual(self.cache.get("key"), "new")
+
+    def test_invalidations_are_published(self):
+        self.cache.bus = mock.Mock()
+        self.cache.delete_many(["a", "b"])
+        self.cache.bus.publish.assert_called_once_with(
+            "tiered-tests",
+            [self.cache.make_and_validate_key(key) for key in ("a", "b")],
+        )
+        self.cache.clear()
+        self.cache.bus.publish.assert_called_with("tiered-tests")
+
+
+class InvalidationBusTests(SimpleTestCase):
+    def setUp(self):
+        self.bus = InvalidationBus("redis://redis:6379/0", "cache-invalidation")
+        self.l1 = LocalCache(10)
+        self.enterContext(mock.patch.dict(_local_caches, {"bus-tests": self.l1}))
+        self.l1.set("a", "1", 30)
+        self.l1.set("b", "2", 30)
+
+    def receive(self, node, keys):
+        data = json.dumps({"node": node, "name": "bus-tests", "keys": keys})
+        self.bus.handle({"data": data})
+
+    def test_ignores_its_own_messages(self):
+        self.receive(self.bus.node, None)
+        self.assertEqual(self.l1.get("a"), "1")
+
+    def test_drops_the_keys_other_nodes_changed(self):
+        self.receive("other", ["a"])
+        self.assertIs(self.l1.get("a"), MISSING)
+        self.assertEqual(self.l1.get("b"), "2")
+        self.receive("other", None)
+        self.assertIs(self.l1.get("b"), MISSING)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ModelCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.issues = [
+            PsychologicalIssue.objects.create(name=name)
+            for name in ("Anxiety", "Depression", "Insomnia")
+        ]
+
+    def setUp(self):
+        caches["tiered"].clear()
+        self.model_cache = ModelCache(PsychologicalIssue)
+        self.pks = [issue.pk for issue in self.issues]
+
+    def test_get_many_queries_only_the_missing(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                set(self.model_cache.get_many(self.pks[:2])), set(self.pks[:2])
+            )
+        with self.assertNumQueries(1):
+            found = self.model_cache.get_many([*self.pks, 0])
+        self.assertEqual(found, {issue.pk: issue for issue in self.issues})
+        with self.assertNumQueries(0):
+            self.model_cache.get_many(self.pks)
+
+    def test_invalidate_drops_the_instance_and_all(self):
+        issue, other = self.issues[:2]
+        self.model_cache.get_many([issue.pk, other.pk])
+        self.model_cache.all()
+        PsychologicalIssue.objects.filter(pk=issue.pk).update(name="Panic")
+        self.model_cache.invalidate(issue.pk)
+
+        with self.assertNumQueries(2):
+            self.assertEqual(self.model_cache.get(issue.pk).name, "Panic")
+            self.assertIn("Panic", [issue.name for issue in self.model_cache.all()])
+        with self.assertNumQueries(0):
+            self.model_cache.get(other.pk)
+
+    def test_rows_read_before_an_invalidation_are_not_served(self):
+        issue = self.issues[0]
+        # A request read the row and computed its key...
+        stale_key = self.model_cache.key(
+            issue.pk, self.model_cache.versions([issue.pk])[issue.pk]
+        )
+        # ...then the row changed and was invalidated...
+        PsychologicalIssue.objects.filter(pk=issue.pk).update(name="Panic")
+        self.model_cache.invalidate(issue.pk)
+        # ...before the request stored what it read
+        caches["tiered"].set(stale_key, issue)
+
+        self.assertEqual(self.model_cache.get(issue.pk).name, "Panic")
+
+    def test_signals_invalidate_the_profile_caches(self):
+        issue = self.issues[0]
+        self.assertEqual(issue_cache.get(issue.pk).name, "Anxiety")
+        issue.name = "Panic"
+        issue.save()
+        self.assertEqual(issue_cache.get(issue.pk).name, "Panic")
+
+        user = create_user("therapist", 1)
+        therapist = TherapistProfile.objects.get(user=user)
+        self.assertEqual(therapist_cache.get(therapist.pk).user.first_name, "Therapist")
+        user.first_name = "Renamed"
+        user.save(update_fields=["first_name"])
+        self.assertEqual(therapist_cache.get(therapist.pk).user.first_name, "Renamed")
+
+
+class EchoView(APIView):
+    authentication_classes = []
+    permission_classes = []
+
+    def get(self, request):
+        return Response(
+            {
+                "price": Decimal("12.50"),
+                "id": UUID("12345678-1234-5678-1234-567812345678"),
+                "at": datetime(2024, 1, 2, 3, 4, 5, tzinfo=dt_timezone.utc),
+                "on": date(2024, 1, 2),
+            }
+        )
+
+    def post(self, request):
+        return Response(request.data)
+
+
+class RendererParserTests(SimpleTestCase):
+    expected = {
+        "price": "12.50",
+        "id": "12345678-1234-5678-1234-567812345678",
+        "at": "2024-01-02T03:04:05Z",
+        "on": "2024-01-02",
+    }
+
+    def get(self, query="", **headers):
+        request = RequestFactory().get(f"/{query}", headers=headers)
+        response = EchoView.as_view()(request)
+        return response.render()
+
+    def post(self, body, content_type):
+        request = RequestFactory().post("/", body, content_type=content_type)
+        return EchoView.as_view()(request).render()
+
+    def test_renders_json_by_default(self):
+        response = self.get()
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(orjson.loads(response.content), self.expected)
+        self.assertNotIn(b"\n", response.content)
+
+    def test_indents_json_on_request(self):
+        response = self.get(accept="application/json; indent=4")
+        self.assertIn(b'\n  "price": "12.50"', response.content)
+
+    def test_renders_msgpack_when_asked(self):
+        for response in (
+            self.get("?format=msgpack"),
+            self.get(accept="application/msgpack"),
+        ):
+            self.assertEqual(response["Content-Type"], "application/msgpack")
+            self.assertEqual(msgpack.unpackb(response.content), self.expected)
+
+    @override_settings(REST_FRAMEWORK={"COERCE_DECIMAL_TO_STRING": False})
+    def test_decimals_as_numbers(self):
+        data = {"price": Decimal("12.50")}
+        self.assertEqual(ORJSONRenderer().render(data), b'{"price":12.5}')
+        self.assertEqual(
+            msgpack.unpackb(MessagePackRenderer().render(data)), {"price": 12.5}
+        )
+
+    def test_parses_json_and_msgpack(self):
+        data = {"name": "Anxiety", "ids": [1, 2]}
+        for body, content_type in [
+            (orjson.dumps(data), "application/json"),
+            (msgpack.packb(data), "application/msgpack"),
+        ]:
+            with self.subTest(content_type=content_type):
+                response = self.post(body, content_type)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.data, data)
+
+    def test_parse_errors_are_400(self):
+        for body, content_type in [
+            (b'{"name": ', "application/json"),
+            (b"\xc1", "application/msgpack"),
+        ]:
+            with self.subTest(content_type=content_type):
+                response = self.post(body, content_type)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("parse error", response.data["detail"])
+
+
+@override_settings(COMPRESSION_MIN_SIZE=10)
+class CompressionMiddlewareTests(SimpleTestCase):
+    content = b'{"name": "Anxiety"}' * 100
+
+    def compress(self, accept_encoding):
+        middleware = CompressionMiddleware(lambda request: HttpResponse(self.content))
+        request = RequestFactory().get(
+            "/", headers={"accept-encoding": accept_encoding}
+        )
+        return middleware(request)
+
+    def test_pads_brotli_and_gzip_against_breach(self):
+        for encoding, decompress in [
+            ("br", brotli.decompress),
+            ("gzip", gzip.decompress),
+        ]:
+            with self.subTest(encoding=encoding):
+                responses = [self.compress(f"{encoding}, deflate") for _ in range(20)]
+                for response in responses:
+                    self.assertEqual(response["Content-Encoding"], encoding)
+                    self.assertEqual(decompress(response.content), self.content)
+                lengths = {len(response.content) for response in responses}
+                self.assertGreater(len(lengths), 1)
+
+    def test_prefers_brotli(self):
+        self.assertEqual(self.compress("gzip, br")["Content-Encoding"], "br")
+        self.assertNotIn("Content-Encoding", self.compress("identity"))
+
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_ID = "00f067aa0ba902b7"
+
+
+@override_settings(
+    TRACING=True, TRACING_EXPORTER="therapy_connect.core.tracing.InMemorySpanExporter"
+)
+class TracingTests(SimpleTestCase):
+    def setUp(self):
+        self.spans = tracing.get_exporter().spans
+        self.addCleanup(self.spans.clear)
+
+    def test_parses_valid_traceparents_only(self):
+        valid = f"00-{TRACE_ID}-{PARENT_ID}-01"
+        self.assertEqual(tracing.parse_traceparent(valid), (TRACE_ID, PARENT_ID))
+        # Fields a later version may add are ignored
+        self.assertEqual(
+            tracing.parse_traceparent(f"01-{TRACE_ID}-{PARENT_ID}-01-extra"),
+            (TRACE_ID, PARENT_ID),
+        )
+        for invalid in [
+            None,
+            "",
+            f"00-{TRACE_ID.upper()}-{PARENT_ID}-01",
+            f"00-{TRACE_ID[:-1]}g-{PARENT_ID}-01",
+            f"00-{'0' * 32}-{PARENT_ID}-01",
+            f"00-{TRACE_ID}-{'0' * 16}-01",
+            f"ff-{TRACE_ID}-{PARENT_ID}-01",
+            f"00-{TRACE_ID}-{PARENT_ID}-01-extra",
+            f"00-{TRACE_ID}-{PARENT_ID}",
+        ]:
+            with self.subTest(traceparent=invalid):
+                self.assertEqual(tracing.parse_traceparent(invalid), (None, None))
+
+    def test_child_spans_join_the_current_one(self):
+        with tracing.span("root") as root:
+            with tracing.child_span("child") as child:
+                pass
+        self.assertEqual(self.spans, [child, root])
+        self.assertIsNone(root.parent_id)
+        self.assertEqual(child.parent_id, root.span_id)
+        self.assertEqual(child.trace_id, root.trace_id)
+
+    def test_child_spans_need_a_trace(self):
+        with tracing.child_span("stray") as stray:
+            self.assertIsNone(stray)
+        self.assertEqual(self.spans, [])
+
+    def test_joins_the_callers_trace(self):
+        with tracing.span("root", f"00-{TRACE_ID}-{PARENT_ID}-01") as root:
+            pass
+        self.assertEqual((root.trace_id, root.parent_id), (TRACE_ID, PARENT_ID))
+
+        with tracing.span("root", f"00-{'0' * 32}-{PARENT_ID}-01") as root:
+            pass
+        self.assertNotEqual(root.trace_id, "0" * 32)
+        self.assertIsNone(root.parent_id)
+
+    def test_middleware_returns_the_trace_id(self):
+        with mock.patch("therapy_connect.core.tracing.install"):
+            middleware = TracingMiddleware(lambda request: HttpResponse())
+        request = RequestFactory().get(
+            "/", headers={"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-01"}
+        )
+        response = middleware(request)
+        self.assertEqual(response["X-Trace-Id"], TRACE_ID)
+        [root] = self.spans
+        self.assertEqual(root.parent_id, PARENT_ID)
+        self.assertEqual(root.attributes["status_code"], 200)
+
+    @mock.patch("therapy_connect.core.tracing.install")
+    def test_tasks_run_in_the_trace_that_queued_them(self, install):
+        headers = {"id": "task-id", "task": "accounts.send_email"}
+        with tracing.span("root") as root:
+            tracing.start_publish_span(headers)
+            tracing.finish_publish_span(headers)
+        publish = self.spans[0]
+        self.assertEqual(headers["traceparent"], publish.traceparent)
+        self.assertEqual(publish.parent_id, root.span_id)
+
+        # In the worker
+        task = SimpleNamespace(
+            name="accounts.send_email",
+            request=SimpleNamespace(traceparent=headers["traceparent"]),
+        )
+        tracing.start_task_span("task-id", task)
+        tracing.finish_task_span("task-id", "SUCCESS")
+        task_span = self.spans[-1]
+        self.assertEqual(task_span.trace_id, root.trace_id)
+        self.assertEqual(task_span.parent_id, publish.span_id)
+        self.assertEqual(task_span.attributes["state"], "SUCCESS")
+
+    def test_publishing_outside_a_trace_adds_no_header(self):
+        headers = {"id": "task-id", "task": "accounts.send_email"}
+        tracing.start_publish_span(headers)
+        tracing.finish_publish_span(headers)
+        self.assertNotIn("traceparent", headers)
+        self.assertEqual(self.spans, [])
+
+
+class StoredSchemaViewTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = Path(directory.name) / "openapi-schema.json"
+        for format, file in schema_files(path).items():
+            write_schema(file, f"{format} schema".encode())
+        self.enterContext(override_settings(OPENAPI_SCHEMA_FILE=path))
+        get_stored_schema.cache_clear()
+        self.addCleanup(get_stored_schema.cache_clear)
+
+    def get(self, query="", **headers):
+        request = RequestFactory().get(f"/schema/{query}", headers=headers)
+        return StoredSchemaView.as_view()(request)
+
+    def test_serves_yaml_by_default(self):
+        response = self.get()
+        self.assertEqual(response.content, b"yaml schema")
+        self.assertEqual(
+            response["Content-Type"], "application/vnd.oai.openapi; charset=utf-8"
+        )
+
+    def test_serves_json_when_asked(self):
+        for response in (
+            self.get("?format=json"),
+            self.get(accept="application/vnd.oai.openapi+json"),
+            self.get(accept="application/json"),
+        ):
+            self.assertEqual(response.content, b"json schema")
+
+    def test_each_format_has_its_own_etag(self):
+        yaml, json = self.get(), self.get("?format=json")
+        self.assertNotEqual(yaml["ETag"], json["ETag"])
+        self.assertIn("Accept", yaml["Vary"])
+        revalidated = self.get(if_none_match=yaml["ETag"])
+        self.assertEqual(revalidated.status_code, 304)
+
+    def test_rejects_unknown_formats(self):
+        with self.assertRaises(Http404):
+            self.get("?format=xml")
+        self.assertEqual(self.get(accept="text/html").status_code, 406)
+
+
+@mock.patch("therapy_connect.core.profiling.is_staff", lambda request: True)
+class ProfilingMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(
+            override_settings(REQUEST_PROFILING=True, PROFILE_DIR=directory.name)
+        )
+
+    async def test_one_profile_at_a_time_on_the_event_loop(self):
+        finish = asyncio.Event()
+
+        async def get_response(request):
+            await finish.wait()
+            return HttpResponse()
+
+        middleware = ProfilingMiddleware(get_response)
+        factory = RequestFactory(headers={"X-Profile": "1"})
+        first = asyncio.create_task(middleware(factory.get("/")))
+        while not middleware.loop_profile_lock.locked():
+            await asyncio.sleep(0.01)
+
+        second = await middleware(factory.get("/"))
+        finish.set()
+        first = await first
+
+        self.assertEqual(second.status_code, 409)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn("X-Profile-Id", first)
+        third = await middleware(factory.get("/"))
+        self.assertIn("X-Profile-Id", third)
+
+
+class ArchiveDeadProcessTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+        self.enterContext(
+            mock.patch.dict("os.environ", {"PROMETHEUS_MULTIPROC_DIR": self.path})
+        )
+
+    def record(self, pid, value):
+        """Write a worker's file, as prometheus_client does."""
+        key = mmap_key("requests_total", "requests_total", [], [], "Requests.")
+        file = MmapedDict(os.path.join(self.path, f"counter_{pid}.db"))
+        file.write_value(key, value, 0.0)
+        file.close()
+
+    def total(self):
+        files = glob(os.path.join(self.path, "*.db"))
+        [metric] = MultiProcessCollector.merge(files)
+        return sum(sample.value for sample in metric.samples)
+
+    def test_dead_workers_are_folded_into_one_file(self):
+        for pid, value in ((100, 1), (101, 2), (102, 4)):
+            self.record(pid, value)
+        archive_dead_process(100)
+        archive_dead_process(101)
+
+        self.assertEqual(
+            sorted(os.listdir(self.path)), ["counter_102.db", "counter_archive.db"]
+        )
+        self.assertEqual(self.total(), 7)
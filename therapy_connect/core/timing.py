@@ -0,0 +1,87 @@
+import functools
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework.serializers import BaseSerializer
+
+# The timings of the request being handled, if it's timed
+request_timings = ContextVar("request_timings", default=None)
+
+_installed = False
+
+
+class RequestTimings:
+    """Count and total seconds per metric ("db", "validate", ...) of a request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.metrics = defaultdict(lambda: [0, 0.0])
+
+    def add(self, name, seconds):
+        metric = self.metrics[name]
+        metric[0] += 1
+        metric[1] += seconds
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+
+@contextmanager
+def timed(name):
+    """Add the time spent in the block to the current request's timings."""
+    timings = request_timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started)
+
+
+def time_query(execute, sql, params, many, context):
+    timings = request_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add("db", time.perf_counter() - started)
+
+
+def add_query_timing(sender, connection, **kwargs):
+    # Connections are reopened on the same wrapper object, so only add once
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+def install():
+    """
+    Time queries on every connection and every serializer's is_valid().
+
+    Only called by the middleware that use the timings (REQUEST_TIMING,
+    METRICS_ENABLED); outside a timed request both hooks just pass through.
+    """
+    global _installed
+    if _installed:
+        return
+    _installed = True
+
+    connection_created.connect(add_query_timing)
+    for connection in connections.all(initialized_only=True):
+        add_query_timing(None, connection)
+
+    is_valid = BaseSerializer.is_valid
+
+    @functools.wraps(is_valid)
+    def timed_is_valid(self, *args, **kwargs):
+        with timed("validate"):
+            return is_valid(self, *args, **kwargs)
+
+    BaseSerializer.is_valid = timed_is_valid
@@ -0,0 +1,309 @@
+"""
+Span tracing across requests, serializers, the ORM, caches and Celery.
+
+With TRACING on, TracingMiddleware opens a root span per request (joining
+the caller's trace if it sends a W3C `traceparent` header) and install()
+adds child spans for serializer validation, queries and cache calls. Tasks
+published during a span carry its context in a `traceparent` message
+header, and the worker runs them in a span of the same trace, so a booking
+can be followed from the view to the emails it sends.
+
+Finished spans go to the exporter named by TRACING_EXPORTER: spans are
+logged by ConsoleSpanExporter, appended as JSON lines to TRACING_FILE by
+FileSpanExporter and kept in memory by InMemorySpanExporter (for tests).
+Any class with an `export(span)` method can be used instead.
+"""
+
+import functools
+import json
+import logging
+import re
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import CacheHandler, caches
+from django.core.signals import setting_changed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from rest_framework.serializers import BaseSerializer
+
+logger = logging.getLogger(__name__)
+
+current_span = ContextVar("current_span", default=None)
+
+# Longer statements are truncated in db.query spans
+MAX_STATEMENT_LENGTH = 1000
+
+# version-trace id-parent id-flags, in lowercase hex
+TRACEPARENT = re.compile(
+    r"([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}(-.*)?"
+)
+
+_installed = False
+
+
+class Span:
+    def __init__(self, name, trace_id=None, parent_id=None, **attributes):
+        self.name = name
+        self.trace_id = trace_id or secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.status = "ok"
+        self.start = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.started
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+def parse_traceparent(value):
+    """
+    (trace id, parent span id) of a W3C traceparent, or (None, None) if it
+    isn't valid, so that the caller starts a new trace.
+    """
+    match = TRACEPARENT.fullmatch(value or "")
+    if match is None:
+        return None, None
+    version, trace_id, parent_id, rest = match.groups()
+    # Later versions may append fields; version 00 has exactly four
+    if version == "ff" or (version == "00" and rest):
+        return None, None
+    if trace_id == "0" * 32 or parent_id == "0" * 16:
+        return None, None
+    return trace_id, parent_id
+
+
+@contextmanager
+def span(name, traceparent=None, **attributes):
+    """
+    Run the block in a span, a child of the current one or, given a
+    `traceparent`, of a remote one. Starts a new trace otherwise.
+    """
+    parent = current_span.get()
+    if parent is not None:
+        trace_id, parent_id = parent.trace_id, parent.span_id
+    else:
+        trace_id, parent_id = parse_traceparent(traceparent)
+    new_span = Span(name, trace_id, parent_id, **attributes)
+    token = current_span.set(new_span)
+    try:
+        yield new_span
+    except BaseException as exc:
+        new_span.status = "error"
+        new_span.attributes["error"] = repr(exc)
+        raise
+    finally:
+        current_span.reset(token)
+        new_span.finish()
+        export(new_span)
+
+
+@contextmanager
+def child_span(name, **attributes):
+    """A span only if a trace is in progress, so stray calls don't start one."""
+    if current_span.get() is None:
+        yield None
+    else:
+        with span(name, **attributes) as new_span:
+            yield new_span
+
+
+class ConsoleSpanExporter:
+    def export(self, span):
+        logger.info("Span %s", json.dumps(span.as_dict(), default=str))
+
+
+class FileSpanExporter:
+    """Appends spans as JSON lines to TRACING_FILE."""
+
+    def __init__(self):
+        self.path = settings.TRACING_FILE
+        self.lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span.as_dict(), default=str) + "\n"
+        with self.lock, open(self.path, "a") as file:
+            file.write(line)
+
+
+class InMemorySpanExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+    def clear(self):
+        self.spans.clear()
+
+
+@functools.cache
+def get_exporter():
+    return import_string(settings.TRACING_EXPORTER)()
+
+
+@receiver(setting_changed)
+def reset_exporter(setting, **kwargs):
+    if setting in ("TRACING_EXPORTER", "TRACING_FILE"):
+        get_exporter.cache_clear()
+
+
+def export(span):
+    try:
+        get_exporter().export(span)
+    except Exception:
+        logger.exception("Couldn't export span %s", span.name)
+
+
+def trace_query(execute, sql, params, many, context):
+    if current_span.get() is None:
+        return execute(sql, params, many, context)
+    with span(
+        "db.query",
+        alias=context["connection"].alias,
+        statement=sql[:MAX_STATEMENT_LENGTH],
+        many=many,
+    ):
+        return execute(sql, params, many, context)
+
+
+def add_query_tracing(sender, connection, **kwargs):
+    if trace_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(trace_query)
+
+
+CACHE_METHODS = (
+    "get",
+    "get_many",
+    "set",
+    "set_many",
+    "add",
+    "touch",
+    "delete",
+    "delete_many",
+    "has_key",
+    "incr",
+    "decr",
+    "clear",
+)
+
+
+class TracedCache:
+    """Wraps a cache backend so the calls made during a trace get spans."""
+
+    def __init__(self, alias, cache):
+        self._alias = alias
+        self._cache = cache
+
+    def __getattr__(self, name):
+        attribute = getattr(self._cache, name)
+        if name not in CACHE_METHODS:
+            return attribute
+
+        @functools.wraps(attribute)
+        def traced(*args, **kwargs):
+            with child_span(f"cache.{name}", alias=self._alias):
+                return attribute(*args, **kwargs)
+
+        return traced
+
+
+def install():
+    """Add spans around serializer validation, queries and cache calls."""
+    global _installed
+    if _installed:
+        return
+    _installed = True
+
+    connection_created.connect(add_query_tracing)
+    for connection in connections.all(initialized_only=True):
+        add_query_tracing(None, connection)
+
+    is_valid = BaseSerializer.is_valid
+
+    @functools.wraps(is_valid)
+    def traced_is_valid(self, *args, **kwargs):
+        with child_span("serializer.validate", serializer=type(self).__name__):
+            return is_valid(self, *args, **kwargs)
+
+    BaseSerializer.is_valid = traced_is_valid
+
+    # Backends are created per thread: wrap this thread's and those created
+    # from now on
+    create_connection = CacheHandler.create_connection
+
+    @functools.wraps(create_connection)
+    def create_traced_connection(self, alias):
+        return TracedCache(alias, create_connection(self, alias))
+
+    CacheHandler.create_connection = create_traced_connection
+    for alias in caches:
+        if hasattr(caches._connections, alias):
+            caches[alias] = TracedCache(alias, caches[alias])
+
+
+# Celery: the publishing span's context travels in the message headers and
+# the worker's task span joins it. Spans started by one signal and finished
+# by another are kept by task id.
+_publish_spans = {}
+_task_spans = {}
+
+
+def start_publish_span(headers):
+    parent = current_span.get()
+    if parent is None:
+        return
+    # Not made current: nothing else runs in it
+    publish_span = Span(
+        f"celery.publish {headers['task']}",
+        parent.trace_id,
+        parent.span_id,
+        task_id=headers["id"],
+    )
+    headers["traceparent"] = publish_span.traceparent
+    _publish_spans[headers["id"]] = publish_span
+
+
+def finish_publish_span(headers):
+    publish_span = _publish_spans.pop(headers["id"], None)
+    if publish_span is not None:
+        publish_span.finish()
+        export(publish_span)
+
+
+def start_task_span(task_id, task):
+    install()
+    traceparent = getattr(task.request, "traceparent", None)
+    context = span(f"celery.task {task.name}", traceparent, task_id=task_id)
+    _task_spans[task_id] = (context, context.__enter__())
+
+
+def finish_task_span(task_id, state):
+    context, task_span = _task_spans.pop(task_id, (None, None))
+    if context is not None:
+        task_span.attributes["state"] = state
+        context.__exit__(None, None, None)
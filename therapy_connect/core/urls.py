@@ -0,0 +1,10 @@
+from django.urls import path
+
+from .views import CacheStatsView, DatabasePoolStatsView, MemoryView
+
+app_name = "core"
+urlpatterns = [
+    path("db-pool/", DatabasePoolStatsView.as_view(), name="db-pool-stats"),
+    path("cache/", CacheStatsView.as_view(), name="cache-stats"),
+    path("memory/", MemoryView.as_view(), name="memory"),
+]
@@ -0,0 +1,201 @@
+import os
+from inspect import isawaitable
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.views import View
+from drf_spectacular.views import SpectacularAPIView
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.permissions import IsAdminUser
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from . import memory, metrics
+from .cache import cache_stats
+from .db import pool_stats
+from .middleware import re_accepts_brotli, re_accepts_gzip
+from .schema import get_stored_schema
+
+
+class AsyncDispatchMixin:
+    """
+    Lets a DRF view define async handlers.
+
+    DRF's authentication, permission and throttling checks are synchronous,
+    so `initial` runs in a single thread hop before the handler is awaited.
+    Views can extend `initial` with any other blocking preparation.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(
+                    self, request.method.lower(), self.http_method_not_allowed
+                )
+            else:
+                handler = self.http_method_not_allowed
+
+            response = handler(request, *args, **kwargs)
+            if isawaitable(response):
+                response = await response
+
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+class AsyncListModelMixin(AsyncDispatchMixin):
+    """
+    Async `get` for list views; the rows are fetched with the async ORM.
+
+    Paginated views fall back to the synchronous `list`.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in ("GET", "HEAD"):
+            # Building the queryset may query too (role lookup, filter
+            # validation), so it's done in the same thread hop
+            self.object_queryset = self.filter_queryset(self.get_queryset())
+
+    async def get(self, request, *args, **kwargs):
+        if self.paginator is not None:
+            return await sync_to_async(self.list)(request, *args, **kwargs)
+        objects = [obj async for obj in self.object_queryset]
+        serializer = self.get_serializer(objects, many=True)
+        return Response(serializer.data)
+
+
+class AsyncRetrieveModelMixin(AsyncDispatchMixin):
+    """
+    Async `get` for retrieve views.
+
+    Override `aget_object` to look the object up with the async ORM; by
+    default the view's synchronous `get_object` is used.
+    """
+
+    async def aget_object(self):
+        return await sync_to_async(self.get_object)()
+
+    async def get(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data)
+
+
+class DatabasePoolStatsView(APIView):
+    """
+    Connection pool statistics of the process serving the request.
+
+    Each worker process has its own pool, so repeated calls may report
+    different workers.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({"pid": os.getpid(), "pools": pool_stats()})
+
+
+class CacheStatsView(APIView):
+    """
+    Per-tier hit counts and ratios of the tiered caches in the process
+    serving the request.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({"pid": os.getpid(), "caches": cache_stats()})
+
+
+class MemoryView(APIView):
+    """
+    Resident memory of the worker serving the request. With MEMORY_TRACING
+    on, each call also takes a tracemalloc snapshot and returns its top
+    allocators (`?limit=`, `?group_by=lineno|filename|traceback`) and the
+    growth since this worker's previous snapshot.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        group_by = request.query_params.get("group_by", "lineno")
+        if group_by not in ("lineno", "filename", "traceback"):
+            group_by = "lineno"
+        try:
+            limit = int(request.query_params.get("limit", 20))
+        except ValueError:
+            limit = 20
+        return Response(memory.memory_report(limit, group_by))
+
+
+class StoredSchemaView(View):
+    """
+    Serves the OpenAPI schema generated at build time by
+    `manage.py build_schema` instead of generating it per request.
+
+    Like SpectacularAPIView, it serves YAML unless JSON is asked for with
+    `?format=json` or the Accept header. The response is already
+    compressed, so CompressionMiddleware leaves it and its strong ETag
+    alone; clients revalidate with If-None-Match.
+    """
+
+    renderer_classes = SpectacularAPIView.renderer_classes
+
+    def get(self, request):
+        renderers = [renderer() for renderer in self.renderer_classes]
+        try:
+            renderer, _ = DefaultContentNegotiation().select_renderer(
+                Request(request), renderers
+            )
+        except NotAcceptable as exc:
+            return HttpResponse(exc.detail, status=exc.status_code)
+        schema = get_stored_schema(renderer.format)
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type += f"; charset={renderer.charset}"
+
+        accept_encoding = request.META.get("HTTP_ACCEPT_ENCODING", "")
+        if re_accepts_brotli.search(accept_encoding):
+            encoding = "br"
+        elif re_accepts_gzip.search(accept_encoding):
+            encoding = "gzip"
+        else:
+            encoding = None
+        content, etag = schema.get(encoding)
+
+        response = HttpResponse(content, content_type=content_type)
+        if encoding:
+            response["Content-Encoding"] = encoding
+        response["ETag"] = etag
+        response["Cache-Control"] = "no-cache"
+        patch_vary_headers(response, ("Accept", "Accept-Encoding"))
+        return get_conditional_response(request, etag=etag, response=response)
+
+
+class MetricsView(View):
+    """
+    Prometheus metrics of every web and Celery worker, for scrapers on the
+    internal networks in METRICS_ALLOWED_NETWORKS.
+    """
+
+    def get(self, request):
+        if not metrics.is_allowed(request.META.get("REMOTE_ADDR", "")):
+            return HttpResponseForbidden()
+        content = generate_latest(metrics.get_registry())
+        return HttpResponse(content, content_type=CONTENT_TYPE_LATEST)
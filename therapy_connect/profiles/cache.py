@@ -0,0 +1,12 @@
+from therapy_connect.core.cache import ModelCache
+
+from .models import PsychologicalIssue, TherapistProfile
+
+# The catalog of issues patients open panels for
+issue_cache = ModelCache(PsychologicalIssue)
+
+# Therapists as shown on panels and suggestions, with their user's name
+therapist_cache = ModelCache(
+    TherapistProfile,
+    TherapistProfile.objects.select_related("user").defer("user__password"),
+)
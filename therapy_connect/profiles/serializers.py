@@ -1,11 +1,40 @@
 from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework import serializers
 
 from .models import PatientProfile, PsychologicalIssue, TherapistProfile
+from .utils import queue_profile_image_resize
 
 User = get_user_model()
 
 
+class BulkPrimaryKeyRelatedField(serializers.ManyRelatedField):
+    """
+    A many=True PrimaryKeyRelatedField that looks the objects up in one
+    query instead of one per key.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, "__iter__"):
+            self.fail("not_a_list", input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail("empty")
+
+        child = self.child_relation
+        pk_field = child.get_queryset().model._meta.pk
+        pks = []
+        for pk in data:
+            try:
+                pks.append(pk_field.to_python(pk))
+            except (TypeError, ValueError, DjangoValidationError):
+                child.fail("incorrect_type", data_type=type(pk).__name__)
+        found = child.get_queryset().in_bulk(pks)
+        for pk in pks:
+            if pk not in found:
+                child.fail("does_not_exist", pk_value=pk)
+        return [found[pk] for pk in pks]
+
+
 class PatientProfileSerializer(serializers.ModelSerializer):
     first_name = serializers.CharField(source="user.first_name", read_only=True)
     last_name = serializers.CharField(source="user.last_name", read_only=True)
@@ -33,6 +62,8 @@ class PatientProfileSerializer(serializers.ModelSerializer):
         if "profile_image" in validated_data:
             instance.profile_image = validated_data["profile_image"]
             instance.save()
+            if instance.profile_image:
+                queue_profile_image_resize(instance)
             return instance
         raise serializers.ValidationError(
             {"detail": "Only profile_image can be updated."}
@@ -46,8 +77,11 @@ class TherapistProfileSerializer(serializers.ModelSerializer):
     email = serializers.EmailField(source="user.email", read_only=True)
 
     # Allow therapists to update specialties using their IDs
-    specialties = serializers.PrimaryKeyRelatedField(
-        many=True, queryset=PsychologicalIssue.objects.all(), required=False
+    specialties = BulkPrimaryKeyRelatedField(
+        child_relation=serializers.PrimaryKeyRelatedField(
+            queryset=PsychologicalIssue.objects.all()
+        ),
+        required=False,
     )
 
     is_verified = serializers.BooleanField(read_only=True)  # Read-only
@@ -87,6 +121,8 @@ class TherapistProfileSerializer(serializers.ModelSerializer):
             )  # Update ManyToMany field
 
         instance.save()
+        if validated_data.get("profile_image"):
+            queue_profile_image_resize(instance)
         return instance
 
 
@@ -1,8 +1,9 @@
 from django.contrib.auth import get_user_model
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
-from .models import PatientProfile, TherapistProfile
+from .cache import issue_cache, therapist_cache
+from .models import PatientProfile, PsychologicalIssue, TherapistProfile
 
 User = get_user_model()
 
@@ -16,3 +17,30 @@ def create_patient_profile(sender, instance, created, **kwargs):
         PatientProfile.objects.get_or_create(user=instance)
     if created and instance.role == "therapist":
         TherapistProfile.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=PsychologicalIssue)
+@receiver(post_delete, sender=PsychologicalIssue)
+def clear_cached_issue(sender, instance, **kwargs):
+    issue_cache.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=TherapistProfile)
+@receiver(post_delete, sender=TherapistProfile)
+def clear_cached_therapist(sender, instance, **kwargs):
+    therapist_cache.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def clear_cached_therapist_user(sender, instance, created, update_fields, **kwargs):
+    """
+    Cached therapist profiles include the user's name.
+    """
+    if created or instance.role != "therapist":
+        return
+    if update_fields and not {"first_name", "last_name"} & set(update_fields):
+        return
+    for pk in TherapistProfile.objects.filter(user=instance).values_list(
+        "pk", flat=True
+    ):
+        therapist_cache.invalidate(pk)
@@ -0,0 +1,45 @@
+from io import BytesIO
+
+from celery import shared_task
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image
+
+from .cache import therapist_cache
+from .models import TherapistProfile
+
+
+@shared_task(acks_late=True)
+def resize_profile_image(model_label, profile_id):
+    """
+    Shrink a profile's uploaded image to fit PROFILE_IMAGE_MAX_SIZE.
+
+    The resized copy replaces the image only if it wasn't changed again in
+    the meantime.
+    """
+    model = apps.get_model(model_label)
+    profile = model.objects.filter(pk=profile_id).first()
+    if profile is None or not profile.profile_image:
+        return
+    original = profile.profile_image.name
+
+    max_size = settings.PROFILE_IMAGE_MAX_SIZE
+    with profile.profile_image.open("rb") as file:
+        image = Image.open(file)
+        image.load()
+    if max(image.size) <= max_size:
+        return
+    image_format = image.format
+    image.thumbnail((max_size, max_size))
+    output = BytesIO()
+    image.save(output, format=image_format)
+
+    storage = profile.profile_image.storage
+    resized = storage.save(original, ContentFile(output.getvalue()))
+    updated = model.objects.filter(pk=profile_id, profile_image=original).update(
+        profile_image=resized
+    )
+    storage.delete(original if updated else resized)
+    if updated and model is TherapistProfile:
+        therapist_cache.invalidate(profile_id)
@@ -0,0 +1,186 @@
+import shutil
+import tempfile
+from io import BytesIO
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from django.urls import reverse
+from PIL import Image
+
+from therapy_connect.core.testing import QueryBudgetTestCase, create_user
+from therapy_connect.therapy.models import TherapyPanel
+
+from .models import PatientProfile, PsychologicalIssue, TherapistProfile
+
+# Queries each endpoint may make, whatever the number of related rows
+QUERY_BUDGETS = {
+    "list-patients": 2,
+    "retrieve-patient": 2,
+    "list-therapists": 3,
+    "retrieve-therapist": 3,
+    "retrieve-patient-profile": 2,
+    "update-patient-profile": 3,
+    "delete-patient-profile": 3,
+    "retrieve-therapist-profile": 3,
+    "update-therapist-profile": 7,
+    "delete-therapist-profile": 4,
+}
+
+
+def image_file():
+    content = BytesIO()
+    Image.new("RGB", (10, 10)).save(content, "JPEG")
+    return SimpleUploadedFile("photo.jpg", content.getvalue(), "image/jpeg")
+
+
+class ProfilesQueryBudgetTests(QueryBudgetTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        media_root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, media_root)
+        cls.enterClassContext(override_settings(MEDIA_ROOT=media_root))
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user("patient", 2, is_staff=True)
+        cls.patient_user = create_user("patient", 1)
+        cls.therapist_user = create_user("therapist", 1)
+        cls.patient = PatientProfile.objects.get(user=cls.patient_user)
+        cls.therapist = TherapistProfile.objects.get(user=cls.therapist_user)
+
+    def add_issues(self, count):
+        return PsychologicalIssue.objects.bulk_create(
+            PsychologicalIssue(name=f"Issue {i}") for i in range(count)
+        )
+
+    def add_patients(self, count):
+        return [
+            PatientProfile.objects.get(user=create_user("patient", 100 + i))
+            for i in range(count)
+        ]
+
+    def add_therapists(self, count):
+        """Therapists with two specialties each."""
+        issues = self.add_issues(2)
+        therapists = []
+        for i in range(count):
+            therapist = TherapistProfile.objects.get(
+                user=create_user("therapist", 100 + i)
+            )
+            therapist.specialties.set(issues)
+            therapists.append(therapist)
+        return therapists
+
+    def add_panels(self, count):
+        issue = PsychologicalIssue.objects.create(name="Anxiety")
+        return TherapyPanel.objects.bulk_create(
+            TherapyPanel(patient=self.patient, issue=issue) for _ in range(count)
+        )
+
+    def test_list_patients(self):
+        self.authenticate(self.admin)
+
+        def prepare(count):
+            self.add_patients(count)
+            url = reverse("profiles:patients-list")
+            return lambda: self.client.get(url)
+
+        self.assertQueryBudget(QUERY_BUDGETS["list-patients"], prepare)
+
+    def test_retrieve_patient(self):
+        self.authenticate(self.admin)
+
+        def prepare(count):
+            patient = self.add_patients(count)[-1]
+            url = reverse("profiles:patients-detail", args=[patient.pk])
+            return lambda: self.client.get(url)
+
+        self.assertQueryBudget(QUERY_BUDGETS["retrieve-patient"], prepare)
+
+    def test_list_therapists(self):
+        self.authenticate(self.admin)
+
+        def prepare(count):
+            self.add_therapists(count)
+            url = reverse("profiles:therapists-list")
+            return lambda: self.client.get(url)
+
+        self.assertQueryBudget(QUERY_BUDGETS["list-therapists"], prepare)
+
+    def test_retrieve_therapist(self):
+        self.authenticate(self.admin)
+
+        def prepare(count):
+            self.therapist.specialties.set(self.add_issues(count))
+            url = reverse("profiles:therapists-detail", args=[self.therapist.pk])
+            return lambda: self.client.get(url)
+
+        self.assertQueryBudget(QUERY_BUDGETS["retrieve-therapist"], prepare)
+
+    def test_retrieve_patient_profile(self):
+        self.authenticate(self.patient_user)
+
+        def prepare(count):
+            self.add_panels(count)
+            url = reverse("profiles:patient-profile")
+            return lambda: self.client.get(url)
+
+        self.assertQueryBudget(QUERY_BUDGETS["retrieve-patient-profile"], prepare)
+
+    def test_update_patient_profile(self):
+        self.authenticate(self.patient_user)
+
+        def prepare(count):
+            self.add_panels(count)
+            url = reverse("profiles:patient-profile")
+            return lambda: self.client.patch(
+                url, {"profile_image": image_file()}, format="multipart"
+            )
+
+        self.assertQueryBudget(QUERY_BUDGETS["update-patient-profile"], prepare)
+
+    def test_delete_patient_profile(self):
+        self.authenticate(self.patient_user)
+
+        def prepare(count):
+            self.add_panels(count)
+            url = reverse("profiles:patient-profile")
+            return lambda: self.client.delete(url)
+
+        self.assertQueryBudget(
+            QUERY_BUDGETS["delete-patient-profile"], prepare, status=204
+        )
+
+    def test_retrieve_therapist_profile(self):
+        self.authenticate(self.therapist_user)
+
+        def prepare(count):
+            self.therapist.specialties.set(self.add_issues(count))
+            url = reverse("profiles:therapist-profile")
+            return lambda: self.client.get(url)
+
+        self.assertQueryBudget(QUERY_BUDGETS["retrieve-therapist-profile"], prepare)
+
+    def test_update_therapist_profile(self):
+        self.authenticate(self.therapist_user)
+
+        def prepare(count):
+            issues = [issue.pk for issue in self.add_issues(count)]
+            url = reverse("profiles:therapist-profile")
+            data = {"qualifications": "PhD", "specialties": issues}
+            return lambda: self.client.patch(url, data)
+
+        self.assertQueryBudget(QUERY_BUDGETS["update-therapist-profile"], prepare)
+
+    def test_delete_therapist_profile(self):
+        self.authenticate(self.therapist_user)
+
+        def prepare(count):
+            self.therapist.specialties.set(self.add_issues(count))
+            url = reverse("profiles:therapist-profile")
+            return lambda: self.client.delete(url)
+
+        self.assertQueryBudget(
+            QUERY_BUDGETS["delete-therapist-profile"], prepare, status=204
+        )
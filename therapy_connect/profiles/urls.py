@@ -14,7 +14,8 @@ router.register(r"therapists", TherapistListView, basename="therapists")
 
 app_name = "profiles"
 urlpatterns = [
-    path("", include(router.urls)),
+    # Before the router, whose patients/<pk>/ route would match "me"
     path("patients/me/", PatientProfileView.as_view(), name="patient-profile"),
     path("therapist/me/", TherapistProfileView.as_view(), name="therapist-profile"),
+    path("", include(router.urls)),
 ]
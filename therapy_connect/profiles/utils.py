@@ -0,0 +1,10 @@
+from django.db import transaction
+
+from .tasks import resize_profile_image
+
+
+def queue_profile_image_resize(profile):
+    """Resize the profile's new image in a media worker once it's saved."""
+    transaction.on_commit(
+        lambda: resize_profile_image.delay(profile._meta.label, profile.pk)
+    )
@@ -3,6 +3,8 @@ from drf_spectacular.utils import extend_schema
 from rest_framework import generics, permissions, status, viewsets
 from rest_framework.response import Response
 
+from therapy_connect.accounts.roles import get_role_context
+
 from .models import PatientProfile, TherapistProfile
 from .permissions import (
     IsAdminUser,
@@ -38,8 +40,10 @@ class PatientProfileView(generics.RetrieveUpdateDestroyAPIView):
 
     def get_object(self):
         """Returns the logged-in user's profile."""
-        user = self.request.user
-        return get_object_or_404(PatientProfile, user=user)
+        patient_id = get_role_context(self.request).patient_id_or_404()
+        return get_object_or_404(
+            PatientProfile.objects.select_related("user"), id=patient_id
+        )
 
     def perform_destroy(self, instance):
         """
@@ -70,8 +74,10 @@ class TherapistProfileView(generics.RetrieveUpdateDestroyAPIView):
 
     def get_object(self):
         """Returns the logged-in therapist's profile."""
-        user = self.request.user
-        return get_object_or_404(TherapistProfile, user=user)
+        therapist_id = get_role_context(self.request).therapist_id_or_404()
+        return get_object_or_404(
+            TherapistProfile.objects.select_related("user"), id=therapist_id
+        )
 
     def perform_destroy(self, instance):
         """
@@ -95,7 +101,7 @@ class PatientListView(viewsets.ReadOnlyModelViewSet):
     - GET /patients/<id>/ -> Retrieve a specific patient profile (Admin only)
     """
 
-    queryset = PatientProfile.objects.all()
+    queryset = PatientProfile.objects.select_related("user")
     serializer_class = AdminPatientProfileSerializer
     permission_classes = [permissions.IsAuthenticated, IsAdminUser]
 
@@ -109,6 +115,8 @@ class TherapistListView(viewsets.ReadOnlyModelViewSet):
     - GET /therapists/<id>/ -> Retrieve a specific therapist profile (Public or Admin-only)
     """
 
-    queryset = TherapistProfile.objects.all()
+    queryset = TherapistProfile.objects.select_related("user").prefetch_related(
+        "specialties"
+    )
     serializer_class = AdminTherapistProfileSerializer
     permission_classes = [permissions.IsAuthenticated, IsAdminUser]
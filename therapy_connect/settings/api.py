@@ -0,0 +1,36 @@
+"""
+Production settings with a lean middleware stack for the JSON API.
+
+Requests under /api/ only run the instrumentation (tracing, timing, metrics,
+query inspection, profiling), security, compression, replica pinning and common
+middleware: DRF authenticates them from the JWT, so they need no session,
+CSRF token, messages or X-Frame-Options header.
+Everything else, including the admin, runs the full stack from base.py.
+"""
+
+from .production import *  # noqa
+
+ROUTED_MIDDLEWARE = {
+    "/api/": [
+        "therapy_connect.core.middleware.TracingMiddleware",
+        "therapy_connect.core.middleware.RequestTimingMiddleware",
+        "therapy_connect.core.middleware.MetricsMiddleware",
+        "therapy_connect.core.middleware.QueryInspectionMiddleware",
+        "therapy_connect.core.middleware.ProfilingMiddleware",
+        "django.middleware.security.SecurityMiddleware",
+        "therapy_connect.core.middleware.CompressionMiddleware",
+        "therapy_connect.core.middleware.ReplicaPinningMiddleware",
+        "django.middleware.common.CommonMiddleware",
+    ],
+    "": MIDDLEWARE,  # noqa F405
+}
+MIDDLEWARE = ["therapy_connect.core.middleware.RoutedMiddleware"]
+
+# SessionAuthentication can't succeed without the session middleware
+REST_FRAMEWORK["DEFAULT_AUTHENTICATION_CLASSES"] = (  # noqa F405
+    "therapy_connect.accounts.authentication.StatelessJWTAuthentication",
+)
+
+# The admin's middleware checks only look at MIDDLEWARE; the "" stack above
+# still runs the auth, messages and session middleware for the admin
+SILENCED_SYSTEM_CHECKS = ["admin.E408", "admin.E409", "admin.E410"]
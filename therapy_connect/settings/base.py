@@ -5,6 +5,7 @@ Base settings to build other settings files upon.
 from datetime import timedelta
 from pathlib import Path
 import environ  # type: ignore
+from kombu import Queue
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 env = environ.Env()
@@ -42,9 +43,41 @@ DATABASES = {
         "PASSWORD": env("POSTGRES_PASSWORD"),
         "HOST": env("POSTGRES_HOST"),
         "PORT": env("POSTGRES_PORT"),
+        # Check reused connections before handing them out (pooled or not)
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
+# Each process keeps a psycopg pool of up to DATABASE_POOL_MAX_SIZE
+# connections, reused across requests and Celery tasks. With DATABASE_POOL
+# off, connections are kept open for CONN_MAX_AGE seconds instead.
+if env.bool("DATABASE_POOL", True):
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            "min_size": env.int("DATABASE_POOL_MIN_SIZE", 2),
+            "max_size": env.int("DATABASE_POOL_MAX_SIZE", 10),
+            # Seconds to wait for a free connection before failing
+            "timeout": env.float("DATABASE_POOL_TIMEOUT", 10.0),
+            # Seconds an idle connection is kept above min_size
+            "max_idle": env.float("DATABASE_POOL_MAX_IDLE", 600.0),
+        }
+    }
+else:
+    DATABASES["default"]["CONN_MAX_AGE"] = env.int("CONN_MAX_AGE", 60)
+
+# Hosts of streaming replicas of the default database (same name and
+# credentials). Reads made while handling a request are spread across them.
+for index, host in enumerate(env.list("POSTGRES_REPLICA_HOSTS", default=[]), 1):
+    DATABASES[f"replica{index}"] = {
+        **DATABASES["default"],
+        "HOST": host,
+        "TEST": {"MIRROR": "default"},
+    }
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != "default"]
+DATABASE_ROUTERS = ["therapy_connect.core.routers.ReplicaRouter"]
+# Seconds a client keeps reading from the primary after a write
+REPLICA_PIN_SECONDS = env.int("REPLICA_PIN_SECONDS", 5)
+
 
 # URLS
 # ------------------------------------------------------------------------------
@@ -79,6 +112,7 @@ LOCAL_APPS = [
     "therapy_connect.accounts",
     "therapy_connect.profiles",
     "therapy_connect.therapy",
+    "therapy_connect.core",
 ]
 
 # https://docs.djangoproject.com/en/dev/ref/settings/#installed-apps
@@ -104,7 +138,14 @@ AUTH_PASSWORD_VALIDATORS = [
 # ------------------------------------------------------------------------------
 # https://docs.djangoproject.com/en/dev/ref/settings/#middleware
 MIDDLEWARE = [
+    "therapy_connect.core.middleware.TracingMiddleware",
+    "therapy_connect.core.middleware.RequestTimingMiddleware",
+    "therapy_connect.core.middleware.MetricsMiddleware",
+    "therapy_connect.core.middleware.QueryInspectionMiddleware",
+    "therapy_connect.core.middleware.ProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "therapy_connect.core.middleware.CompressionMiddleware",
+    "therapy_connect.core.middleware.ReplicaPinningMiddleware",
     # "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -114,6 +155,67 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     # "corsheaders.middleware.CorsMiddleware",
 ]
+# Report the time each middleware adds per request (Server-Timing header and
+# log); only applies to stacks run by core.middleware.RoutedMiddleware
+MIDDLEWARE_TIMING = env.bool("MIDDLEWARE_TIMING", False)
+# Report DB query count/time, validation, rendering and total time per
+# request (Server-Timing header and log); adds nothing when off
+REQUEST_TIMING = env.bool("REQUEST_TIMING", False)
+# Prometheus metrics served at /metrics (core/metrics.py). METRICS_DIR holds
+# the PROMETHEUS_MULTIPROC_DIR of each service whose workers are reported.
+METRICS_ENABLED = env.bool("METRICS_ENABLED", True)
+METRICS_DIR = env("METRICS_DIR", default="")
+METRICS_ALLOWED_NETWORKS = env.list(
+    "METRICS_ALLOWED_NETWORKS",
+    default=["127.0.0.0/8", "::1/128", "10.0.0.0/8", "172.16.0.0/12", "192.168.0.0/16"],
+)
+# Report N+1 and slow queries (with their plan) per request, for development
+# and staging; see core/queries.py. With QUERY_INSPECTION_RAISE (tests), an
+# N+1 not in QUERY_INSPECTION_IGNORE raises instead.
+QUERY_INSPECTION = env.bool("QUERY_INSPECTION", False)
+QUERY_INSPECTION_RAISE = env.bool("QUERY_INSPECTION_RAISE", False)
+QUERY_INSPECTION_IGNORE = env.list("QUERY_INSPECTION_IGNORE", default=[])
+NPLUSONE_THRESHOLD = env.int("NPLUSONE_THRESHOLD", 3)
+SLOW_QUERY_MS = env.int("SLOW_QUERY_MS", 100)
+# Staff can profile a request with an `X-Profile: 1` header or `?profile=1`;
+# the latest PROFILE_MAX_FILES profiles are kept (`manage.py profiles`)
+REQUEST_PROFILING = env.bool("REQUEST_PROFILING", True)
+PROFILE_DIR = env("PROFILE_DIR", default=str(BASE_DIR / "request_profiles"))
+PROFILE_MAX_FILES = env.int("PROFILE_MAX_FILES", 50)
+# Trace allocations with tracemalloc in every worker (see core/memory.py);
+# costs memory and CPU, so only turn it on to chase a leak
+MEMORY_TRACING = env.bool("MEMORY_TRACING", False)
+MEMORY_TRACING_FRAMES = env.int("MEMORY_TRACING_FRAMES", 10)
+MEMORY_TRACING_SNAPSHOTS = 5
+# Trace requests, queries, cache calls and Celery tasks (core/tracing.py);
+# finished spans go to TRACING_EXPORTER, e.g. FileSpanExporter (TRACING_FILE)
+TRACING = env.bool("TRACING", False)
+TRACING_EXPORTER = env(
+    "TRACING_EXPORTER", default="therapy_connect.core.tracing.ConsoleSpanExporter"
+)
+TRACING_FILE = env("TRACING_FILE", default=str(BASE_DIR / "traces.jsonl"))
+# Smaller responses aren't worth compressing
+COMPRESSION_MIN_SIZE = env.int("COMPRESSION_MIN_SIZE", 1024)
+# Brotli levels above 5 cost much more CPU for little gain on dynamic content
+COMPRESSION_BROTLI_QUALITY = 5
+
+# LOGGING
+# ------------------------------------------------------------------------------
+# https://docs.djangoproject.com/en/dev/topics/logging/
+# The project's own reports (request timings, slow queries, ...) go to the
+# console at INFO
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        "therapy_connect": {
+            "handlers": ["console"],
+            "level": env("LOG_LEVEL", default="INFO"),
+            "propagate": False,
+        },
+    },
+}
 
 # STATIC
 # ------------------------------------------------------------------------------
@@ -149,15 +251,53 @@ LOGIN_URL = "accounts:user_login"
 # celery configurations
 if USE_TZ:
     CELERY_TIMEZONE = TIME_ZONE
-CELERY_BROKER_URL = "redis://redis:6379/0"
-# CELERY_BROKER_URL = env("REDIS_URI")
+CELERY_BROKER_URL = env("CELERY_BROKER_URL", default="redis://redis:6379/0")
+CELERY_BROKER_TRANSPORT_OPTIONS = {"visibility_timeout": 3600 * 6}
 CELERY_ACCEPT_CONTENT = ["json"]
 CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_SERIALIZER = "json"
 CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
 CELERY_TASK_TIME_LIMIT = 5 * 60
 CELERY_TASK_SOFT_TIME_LIMIT = 5 * 50
-BROKER_TRANSPORT_OPTIONS = {"visibility_timeout": 3600 * 6}
+# Nothing reads task results; a task that needs one sets ignore_result=False
+# (and a CELERY_RESULT_BACKEND has to be configured)
+CELERY_TASK_IGNORE_RESULT = True
+# Each kind of work has its own queue, consumed by its own workers (see
+# deployment/local/docker-compose.yml), so slow jobs can't hold up emails
+CELERY_TASK_DEFAULT_QUEUE = "default"
+CELERY_TASK_QUEUES = [
+    Queue(name) for name in ("default", "email", "media", "reminders", "maintenance")
+]
+CELERY_TASK_ROUTES = {
+    "therapy_connect.accounts.tasks.send_email": {"queue": "email"},
+    "therapy_connect.accounts.tasks.send_outbox": {"queue": "email"},
+    "therapy_connect.profiles.tasks.*": {"queue": "media"},
+    "therapy_connect.*.tasks.*_reminder*": {"queue": "reminders"},
+    "therapy_connect.accounts.tasks.purge_expired_tokens": {"queue": "maintenance"},
+    "therapy_connect.accounts.tasks.update_last_logins": {"queue": "maintenance"},
+    "therapy_connect.therapy.tasks.auto_complete_appointments": {
+        "queue": "maintenance"
+    },
+}
+
+
+# EMAIL
+# ------------------------------------------------------------------------------
+# https://docs.djangoproject.com/en/dev/ref/settings/#email-backend
+EMAIL_BACKEND = env(
+    "EMAIL_BACKEND", default="django.core.mail.backends.smtp.EmailBackend"
+)
+# Emails with the same dedupe key are sent once within this many seconds
+EMAIL_DEDUPE_TIMEOUT = 60
+# A Redis list that workers drain up to EMAIL_BATCH_SIZE emails at a time,
+# over one SMTP connection. Empty: every email is its own send_email task.
+EMAIL_OUTBOX_URL = env("EMAIL_OUTBOX_URL", default="redis://redis:6379/3")
+EMAIL_BATCH_SIZE = env.int("EMAIL_BATCH_SIZE", 50)
+
+# MEDIA
+# ------------------------------------------------------------------------------
+# Uploaded profile images are shrunk to fit this many pixels per side
+PROFILE_IMAGE_MAX_SIZE = 1024
 
 
 # REST_FRAMEWORK CONFIGS
@@ -165,11 +305,18 @@ REST_FRAMEWORK = {
     # SCHEMA_CLASS
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
     "DEFAULT_RENDERER_CLASSES": [
-        "rest_framework.renderers.JSONRenderer",
+        "therapy_connect.core.renderers.ORJSONRenderer",
+        "therapy_connect.core.renderers.MessagePackRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "therapy_connect.core.parsers.ORJSONParser",
+        "therapy_connect.core.parsers.MessagePackParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
     ],
     # AUTHENTICATION_CLASSES with JWT
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "therapy_connect.accounts.authentication.StatelessJWTAuthentication",
         "rest_framework.authentication.SessionAuthentication",
     ),
 }
@@ -180,13 +327,69 @@ SIMPLE_JWT = {
     "REFRESH_TOKEN_LIFETIME": timedelta(days=50),
     "ROTATE_REFRESH_TOKENS": True,
     "BLACKLIST_AFTER_ROTATION": True,
+    "TOKEN_OBTAIN_SERIALIZER": (
+        "therapy_connect.accounts.serializers.RoleTokenObtainPairSerializer"
+    ),
+    "TOKEN_REFRESH_SERIALIZER": (
+        "therapy_connect.accounts.serializers.RoleTokenRefreshSerializer"
+    ),
+}
+
+# LOGIN
+# ------------------------------------------------------------------------------
+# Serve the async variants of hot views; only useful when running under ASGI
+ASYNC_VIEWS = env.bool("ASYNC_VIEWS", False)
+# Threads available to AsyncLoginView for password hash checks
+LOGIN_THREAD_POOL_SIZE = env.int("LOGIN_THREAD_POOL_SIZE", 4)
+# last_login updates are written once this many users logged in or after
+# this many seconds, whichever comes first
+LAST_LOGIN_BUFFER_SIZE = 100
+LAST_LOGIN_BUFFER_SECONDS = 30
+
+# Where revoked refresh tokens are kept; entries expire with the token.
+# Use "therapy_connect.accounts.blacklist.LocalBlacklist" for tests.
+TOKEN_BLACKLIST = {
+    "BACKEND": "therapy_connect.accounts.blacklist.RedisBlacklist",
+    "LOCATION": env("TOKEN_BLACKLIST_REDIS_URL", default="redis://redis:6379/1"),
+    "BLOOM_FILTER": env.bool("TOKEN_BLACKLIST_BLOOM_FILTER", False),
+}
+
+# CACHES
+# ------------------------------------------------------------------------------
+# https://docs.djangoproject.com/en/dev/ref/settings/#caches
+REDIS_CACHE_URL = env("REDIS_CACHE_URL", default="redis://redis:6379/2")
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": REDIS_CACHE_URL,
+    },
+    # Per-process LRU in front of "default" for hot reference data; writes
+    # are broadcast so every worker drops its stale copy
+    "tiered": {
+        "BACKEND": "therapy_connect.core.cache.TieredCache",
+        "LOCATION": "default",
+        "TIMEOUT": 60 * 60,
+        "OPTIONS": {
+            "L1_MAX_ENTRIES": env.int("CACHE_L1_MAX_ENTRIES", 2000),
+            "L1_TIMEOUT": env.int("CACHE_L1_TIMEOUT", 30),
+            "BUS_LOCATION": REDIS_CACHE_URL,
+        },
+    },
 }
 
+# Seconds a user's is_active/is_staff flags are cached by
+# StatelessJWTAuthentication (cleared whenever the user is saved)
+AUTH_USER_STATE_CACHE_TIMEOUT = 60
+
 SPECTACULAR_SETTINGS = {
     "TITLE": "therapy_connect API",
     "DESCRIPTION": "Documentation",
     "VERSION": "1.0.0",
 }
+# /schema/ serves this file, or the YAML copy written next to it, instead of
+# generating the schema on every request; see `manage.py build_schema`
+SERVE_STORED_SCHEMA = env.bool("SERVE_STORED_SCHEMA", True)
+OPENAPI_SCHEMA_FILE = BASE_DIR / "openapi-schema.json"
 
 
 CORS_ALLOW_ALL_ORIGINS = True
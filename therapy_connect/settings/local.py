@@ -11,6 +11,16 @@ DEBUG = True
 # ALLOWED_HOSTS = ["localhost", "0.0.0.0", "127.0.0.1"]
 ALLOWED_HOSTS = ["*"]
 
+# DATABASES
+# ------------------------------------------------------------------------------
+# A stand-in read replica: the local database under a second alias, so the
+# replica router and pinning run locally. In tests it mirrors "default".
+DATABASES["replica"] = {  # noqa F405
+    **DATABASES["default"],  # noqa F405
+    "TEST": {"MIRROR": "default"},
+}
+DATABASE_REPLICAS = ["replica"]
+
 # EMAIL
 # ------------------------------------------------------------------------------
 # https://docs.djangoproject.com/en/dev/ref/settings/#email-backend
@@ -37,4 +47,10 @@ REST_FRAMEWORK["DEFAULT_RENDERER_CLASSES"] += [
     "rest_framework.renderers.BrowsableAPIRenderer",
 ]
 
+# Report N+1 and slow queries
+QUERY_INSPECTION = env.bool("QUERY_INSPECTION", True)  # noqa F405
+
+# Generate the schema per request so it follows code changes
+SERVE_STORED_SCHEMA = env.bool("SERVE_STORED_SCHEMA", False)  # noqa F405
+
 BASE_URL = "http://localhost:8000"
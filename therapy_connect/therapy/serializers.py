@@ -1,14 +1,27 @@
 from datetime import datetime, timedelta
 
-from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from rest_framework import serializers
 
-from therapy_connect.profiles.models import PatientProfile, TherapistProfile
+from therapy_connect.accounts.roles import get_role_context
+from therapy_connect.core.metrics import BOOKING_CONFLICTS
+from therapy_connect.profiles.cache import issue_cache, therapist_cache
+from therapy_connect.profiles.models import TherapistProfile
 
 from .models import Appointment, Availability, TherapyPanel
 
 
+def issue_summary(issue_id):
+    """Return an issue as {id, name}, from the cache."""
+    issue = issue_cache.get(issue_id)
+    return {"id": issue.id, "name": issue.name}
+
+
+def therapist_summary(therapist):
+    """Return a therapist profile as {id, name}."""
+    return {"id": therapist.id, "name": therapist.user.get_full_name()}
+
+
 # # Ensure the appointment is at least 6 hours away
 # now = timezone.now()
 # if appointment.scheduled_time < now + timedelta(hours=6):
@@ -35,8 +48,7 @@ class AvailabilitySerializer(serializers.ModelSerializer):
         - No overlapping slots (excluding the current slot if updating).
         """
         request = self.context.get("request")
-        therapist = get_object_or_404(TherapistProfile, user=request.user)
-        print("therapist", therapist)
+        therapist_id = get_role_context(request).therapist_id_or_404()
         date = data.get("date")
         start_time = data.get("start_time")
         end_time = data.get("end_time")
@@ -66,7 +78,7 @@ class AvailabilitySerializer(serializers.ModelSerializer):
         # **Fix: Exclude the current slot when checking for overlaps**
         instance = self.instance  # The availability object being updated (if any)
         overlapping_slots = Availability.objects.filter(
-            therapist=therapist,
+            therapist_id=therapist_id,
             date=date,
             start_time__lt=end_time,
             end_time__gt=start_time,
@@ -78,6 +90,7 @@ class AvailabilitySerializer(serializers.ModelSerializer):
             )  # Exclude current slot
 
         if overlapping_slots.exists():
+            BOOKING_CONFLICTS.labels("availability", "overlap").inc()
             raise serializers.ValidationError(
                 "Overlapping availability time slots are not allowed."
             )
@@ -101,22 +114,30 @@ class TherapyPanelCreateSerializer(serializers.ModelSerializer):
         """
         issue_id = self.initial_data.get("issue")
         if issue_id:
-            therapists = TherapistProfile.objects.filter(specialties__id=issue_id)
-            return [{"id": t.id, "name": t.user.get_full_name()} for t in therapists]
+            therapist_ids = list(
+                TherapistProfile.objects.filter(specialties__id=issue_id).values_list(
+                    "id", flat=True
+                )
+            )
+            therapists = therapist_cache.get_many(therapist_ids)
+            return [
+                therapist_summary(therapists[pk])
+                for pk in therapist_ids
+                if pk in therapists
+            ]
         return []
 
     def get_issue_detail(self, obj):
         """Return issue as {id, name} instead of just an ID."""
-        return {"id": obj.issue.id, "name": obj.issue.name}
+        return issue_summary(obj.issue_id)
 
     def validate(self, data):
         """
         Ensure a patient doesn't already have an active panel for the same issue.
         """
-        request = self.context["request"]
-        patient = PatientProfile.objects.get(user=request.user)
+        patient_id = get_role_context(self.context["request"]).patient_id
         if TherapyPanel.objects.filter(
-            patient=patient, issue=data["issue"], status="active"
+            patient_id=patient_id, issue=data["issue"], status="active"
         ).exists():
             raise serializers.ValidationError(
                 "You already have an active therapy panel for this issue."
@@ -128,9 +149,10 @@ class TherapyPanelCreateSerializer(serializers.ModelSerializer):
         """
         Create the therapy panel with the selected therapist.
         """
-        request = self.context["request"]
-        patient = PatientProfile.objects.get(user=request.user)
-        validated_data["patient"] = patient
+        validated_data.pop("patient", None)
+        validated_data["patient_id"] = get_role_context(
+            self.context["request"]
+        ).patient_id
         return super().create(validated_data)
 
 
@@ -155,15 +177,14 @@ class TherapyPanelPatientUpdateSerializer(serializers.ModelSerializer):
 
     def get_therapist_detail(self, obj):
         """Return therapist as {id, name} instead of just ID."""
-        return {"id": obj.therapist.id, "name": obj.therapist.user.get_full_name()}
+        return therapist_summary(therapist_cache.get(obj.therapist_id))
 
     def validate(self, data):
         therapy_panel = self.instance  # Get the existing therapy panel
-        request = self.context["request"]
-        patient = request.user.patient_profile
+        context = get_role_context(self.context["request"])
 
         # Ensure only patients can update this panel
-        if not hasattr(request.user, "patient_profile"):
+        if not context.is_patient:
             raise serializers.ValidationError(
                 {"error": "Only patients can update this panel."}
             )
@@ -198,7 +219,7 @@ class TherapyPanelPatientUpdateSerializer(serializers.ModelSerializer):
             # Ensure the patient does not have an active
             # panel with this therapist for the same issue
             if TherapyPanel.objects.filter(
-                patient=patient,
+                patient_id=context.patient_id,
                 issue=therapy_panel.issue,
                 therapist=data["therapist"],
                 status="active",
@@ -261,7 +282,7 @@ class TherapyPanelTherapistUpdateSerializer(serializers.ModelSerializer):
 
     def get_issue(self, obj):
         """Return issue as {id, name} instead of just ID."""
-        return {"id": obj.issue.id, "name": obj.issue.name}
+        return issue_summary(obj.issue_id)
 
     def get_patient(self, obj):
         """Return patient as {id, name} instead of just ID."""
@@ -312,12 +333,12 @@ class TherapyPanelPatientRetrieveSerializer(serializers.ModelSerializer):
 
     def get_issue(self, obj):
         """Return issue as {id, name} instead of just ID."""
-        return {"id": obj.issue.id, "name": obj.issue.name}
+        return issue_summary(obj.issue_id)
 
     def get_therapist(self, obj):
         """Return therapist as {id, name} instead of just ID."""
-        if obj.therapist:
-            return {"id": obj.therapist.id, "name": obj.therapist.user.get_full_name()}
+        if obj.therapist_id:
+            return therapist_summary(therapist_cache.get(obj.therapist_id))
         return None
 
 
@@ -346,7 +367,7 @@ class TherapyPanelTherapistRetrieveSerializer(serializers.ModelSerializer):
 
     def get_issue(self, obj):
         """Return issue as {id, name} instead of just ID."""
-        return {"id": obj.issue.id, "name": obj.issue.name}
+        return issue_summary(obj.issue_id)
 
     def get_patient(self, obj):
         """Return patient as {id, name} instead of just ID."""
@@ -369,12 +390,12 @@ class AppointmentSerializer(serializers.ModelSerializer):
         ]
 
     def validate(self, data):
-        user = self.context["request"].user
+        context = get_role_context(self.context["request"])
         scheduled_time = data.get("scheduled_time")
         duration = data.get("duration", 60)
         panel = self.instance.panel if self.instance else data.get("panel")
 
-        if not panel or panel.patient.user != user:
+        if not panel or panel.patient_id != context.patient_id:
             raise serializers.ValidationError("Invalid therapy panel.")
 
         therapist = panel.therapist
@@ -398,6 +419,7 @@ class AppointmentSerializer(serializers.ModelSerializer):
         ).exists()
 
         if not availability:
+            BOOKING_CONFLICTS.labels("book", "unavailable").inc()
             raise serializers.ValidationError(
                 "Therapist is not available at this time."
             )
@@ -411,6 +433,7 @@ class AppointmentSerializer(serializers.ModelSerializer):
         ).exists()
 
         if overlapping_appointments:
+            BOOKING_CONFLICTS.labels("book", "overlap").inc()
             raise serializers.ValidationError(
                 "Therapist already has an appointment at this time."
             )
@@ -433,7 +456,7 @@ class RescheduleAppointmentSerializer(serializers.ModelSerializer):
         read_only_fields = ["scheduled_time"]
 
     def validate(self, data):
-        user = self.context["request"].user
+        context = get_role_context(self.context["request"])
         new_scheduled_time = data["new_scheduled_time"]
         appointment = self.instance  # Existing appointment being rescheduled
 
@@ -442,7 +465,7 @@ class RescheduleAppointmentSerializer(serializers.ModelSerializer):
                 "Only scheduled appointments can be rescheduled."
             )
 
-        if appointment.panel.patient.user != user:
+        if appointment.panel.patient_id != context.patient_id:
             raise serializers.ValidationError(
                 "You can only reschedule your own appointments."
             )
@@ -481,6 +504,7 @@ class RescheduleAppointmentSerializer(serializers.ModelSerializer):
         ).exists()
 
         if not availability:
+            BOOKING_CONFLICTS.labels("reschedule", "unavailable").inc()
             raise serializers.ValidationError(
                 "Therapist is not available at this time."
             )
@@ -523,7 +547,7 @@ class CancelAppointmentSerializer(serializers.ModelSerializer):
         fields = ["id", "cancellation_reason"]
 
     def validate(self, data):
-        user = self.context["request"].user
+        context = get_role_context(self.context["request"])
         appointment = self.instance
 
         if appointment.status != "scheduled":
@@ -531,7 +555,7 @@ class CancelAppointmentSerializer(serializers.ModelSerializer):
                 "Only scheduled appointments can be canceled."
             )
 
-        if appointment.panel.patient.user != user:
+        if appointment.panel.patient_id != context.patient_id:
             raise serializers.ValidationError(
                 "You can only cancel your own appointments."
             )
@@ -568,13 +592,13 @@ class TherapistCancelAppointmentSerializer(serializers.ModelSerializer):
         read_only_fields = ["scheduled_time"]
 
     def validate(self, data):
-        user = self.context["request"].user
+        context = get_role_context(self.context["request"])
         appointment = self.instance  # The appointment being canceled
 
         # Ensure the user is a therapist and assigned to this appointment
         if (
-            not hasattr(user, "therapist_profile")
-            or appointment.panel.therapist.user != user
+            not context.is_therapist
+            or appointment.panel.therapist_id != context.therapist_id
         ):
             raise serializers.ValidationError(
                 "You can only cancel your own scheduled appointments."
@@ -1,6 +1,8 @@
 from celery import shared_task
 from django.utils import timezone
 
+from therapy_connect.core.metrics import TASK_ROWS
+
 from .models import Appointment
 
 
@@ -15,4 +17,5 @@ def auto_complete_appointments():
         scheduled_time__lte=now - timezone.timedelta(hours=1),
     )
     count = completed_appointments.update(status="completed")
+    TASK_ROWS.labels(auto_complete_appointments.name).inc(count)
     return f"Updated {count} appointments to 'completed'"
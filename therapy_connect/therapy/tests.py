@@ -0,0 +1,464 @@
+from datetime import datetime, time, timedelta
+
+from asgiref.sync import async_to_sync
+from django.urls import resolve, reverse
+from django.utils import timezone
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.test import APIRequestFactory
+
+from therapy_connect.accounts.tokens import RoleRefreshToken
+from therapy_connect.core.testing import (
+    QueryBudgetTestCase,
+    create_user,
+    serve_async_views,
+)
+from therapy_connect.profiles.models import (
+    PatientProfile,
+    PsychologicalIssue,
+    TherapistProfile,
+)
+
+from .models import Appointment, Availability, TherapyPanel
+from .views import (
+    AsyncAppointmentRetrieveView,
+    AsyncListAvailabilityView,
+    AsyncPatientAppointmentListView,
+    AsyncTherapistAppointmentListView,
+    PatientAppointmentListView,
+)
+
+# Queries each endpoint may make, whatever the number of related rows
+QUERY_BUDGETS = {
+    "list-availability": 2,
+    "create-availability": 3,
+    "retrieve-availability": 2,
+    "update-availability": 4,
+    "delete-availability": 3,
+    "list-therapy-panels-patient": 4,
+    "list-therapy-panels-therapist": 3,
+    "create-therapy-panel": 7,
+    "retrieve-therapy-panel-patient": 4,
+    "retrieve-therapy-panel-therapist": 5,
+    "select-therapist": 9,
+    "update-therapy-panel-therapist": 6,
+    "create-appointment": 7,
+    "retrieve-appointment": 2,
+    "reschedule-appointment": 7,
+    "cancel-appointment": 3,
+    "therapist-cancel-appointment": 3,
+    "list-patient-appointments": 2,
+    "list-therapist-appointments": 2,
+}
+
+
+def day(offset):
+    return timezone.localdate() + timedelta(days=offset)
+
+
+def at(offset, hour):
+    return timezone.make_aware(datetime.combine(day(offset), time(hour)))
+
+
+class TherapyQueryBudgetTests(QueryBudgetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.issue = PsychologicalIssue.objects.create(name="Anxiety")
+        cls.patient_user = create_user("patient", 1)
+        cls.therapist_user = create_user("therapist", 1)
+        cls.patient = PatientProfile.objects.get(user=cls.patient_user)
+        cls.therapist = TherapistProfile.objects.get(user=cls.therapist_user)
+        cls.therapist.specialties.add(cls.issue)
+        cls.panel = TherapyPanel.objects.create(
+            patient=cls.patient,
+            issue=cls.issue,
+            therapist=cls.therapist,
+            assigned_at=timezone.now(),
+        )
+
+    def add_availabilities(self, count, therapist=None):
+        """A slot a day, from tomorrow, 08:00-20:00."""
+        return Availability.objects.bulk_create(
+            Availability(
+                therapist=therapist or self.therapist,
+                date=day(1 + i),
+                start_time=time(8),
+                end_time=time(20),
+            )
+            for i in range(count)
+        )
+
+    def add_appointments(self, count, panel=None):
+        """An appointment a day at 14:00, from the day after tomorrow."""
+        return Appointment.objects.bulk_create(
+            Appointment(
+                panel=panel or self.panel,
+                scheduled_time=at(2 + i, 14),
+                meeting_link=f"https://zoom.com/meeting/{i}",
+            )
+            for i in range(count)
+        )
+
+    def add_therapists(self, count, issue=None):
+        """Therapists treating the issue, with a slot each."""
+        therapists = []
+        for i in range(count):
+            therapist = TherapistProfile.objects.get(
+                user=create_user("therapist", 100 + i)
+            )
+            therapist.specialties.add(issue or self.issue)
+            therapists.append(therapist)
+        for therapist in therapists:
+            self.add_availabilities(1, therapist)
+        return therapists
+
+    def test_list_availability(self):
+        self.authenticate(self.patient_user)
+
+        def prepare(count):
+            self.add_availabilities(count)
+            url = reverse("therapy:list-availability")
+            return lambda: self.client.get(url, {"therapist_id": self.therapist.pk})
+
+        self.assertQueryBudget(QUERY_BUDGETS["list-availability"], prepare)
+
+    def test_create_availability(self):
+        self.authenticate(self.therapist_user)
+
+        def prepare(count):
+            self.add_availabilities(count)
+            url = reverse("therapy:create-availability")
+            data = {
+                "date": day(count + 5).isoformat(),
+                "start_time": "09:00",
+                "end_time": "10:00",
+            }
+            return lambda: self.client.post(url, data)
+
+        self.assertQueryBudget(
+            QUERY_BUDGETS["create-availability"], prepare, status=201
+        )
+
+    def test_retrieve_availability(self):
+        self.authenticate(self.therapist_user)
+
+        def prepare(count):
+            slot = self.add_availabilities(count)[0]
+            url = reverse("therapy:retrieve-update-availability", args=[slot.pk])
+            return lambda: self.client.get(url)
+
+        self.assertQueryBudget(QUERY_BUDGETS["retrieve-availability"], prepare)
+
+    def test_update_availability(self):
+        self.authenticate(self.therapist_user)
+
+        def prepare(count):
+            slot = self.add_availabilities(count)[0]
+            url = reverse("therapy:retrieve-update-availability", args=[slot.pk])
+            data = {
+                "date": slot.date.isoformat(),
+                "start_time": "09:00",
+                "end_time": "19:00",
+            }
+            return lambda: self.client.put(url, data)
+
+        self.assertQueryBudget(QUERY_BUDGETS["update-availability"], prepare)
+
+    def test_delete_availability(self):
+        self.authenticate(self.therapist_user)
+
+        def prepare(count):
+            slot = self.add_availabilities(count)[0]
+            url = reverse("therapy:delete-availability", args=[slot.pk])
+            return lambda: self.client.delete(url)
+
+        self.assertQueryBudget(
+            QUERY_BUDGETS["delete-availability"], prepare, status=204
+        )
+
+    def add_panels(self, count):
+        return TherapyPanel.objects.bulk_create(
+            TherapyPanel(
+                patient=self.patient,
+                issue=self.issue,
+                therapist=self.therapist,
+                status="paused",
+            )
+            for _ in range(count)
+        )
+
+    def test_list_therapy_panels_patient(self):
+        self.authenticate(self.patient_user)
+
+        def prepare(count):
+            self.add_panels(count)
+            url = reverse("therapy:list-therapy-panels")
+            return lambda: self.client.get(url)
+
+        self.assertQueryBudget(QUERY_BUDGETS["list-therapy-panels-patient"], prepare)
+
+    def test_list_therapy_panels_therapist(self):
+        self.authenticate(self.therapist_user)
+
+        def prepare(count):
+            self.add_panels(count)
+            url = reverse("therapy:list-therapy-panels")
+            return lambda: self.client.get(url)
+
+        self.assertQueryBudget(QUERY_BUDGETS["list-therapy-panels-therapist"], prepare)
+
+    def test_create_therapy_panel(self):
+        self.authenticate(self.patient_user)
+        # One the patient has no panel for
+        issue = PsychologicalIssue.objects.create(name="Insomnia")
+
+        def prepare(count):
+            self.add_therapists(count, issue)
+            url = reverse("therapy:create-therapy-panel")
+            return lambda: self.client.post(url, {"issue": issue.pk})
+
+        self.assertQueryBudget(
+            QUERY_BUDGETS["create-therapy-panel"], prepare, status=201
+        )
+
+    def test_retrieve_therapy_panel_patient(self):
+        self.authenticate(self.patient_user)
+
+        def prepare(count):
+            self.add_appointments(count)
+            url = reverse("therapy:retrieve-update-therapy-panel", args=[self.panel.pk])
+            return lambda: self.client.get(url)
+
+        self.assertQueryBudget(QUERY_BUDGETS["retrieve-therapy-panel-patient"], prepare)
+
+    def test_retrieve_therapy_panel_therapist(self):
+        self.authenticate(self.therapist_user)
+
+        def prepare(count):
+            self.add_appointments(count)
+            url = reverse("therapy:retrieve-update-therapy-panel", args=[self.panel.pk])
+            return lambda: self.client.get(url)
+
+        self.assertQueryBudget(
+            QUERY_BUDGETS["retrieve-therapy-panel-therapist"], prepare
+        )
+
+    def test_select_therapist(self):
+        self.authenticate(self.patient_user)
+
+        def prepare(count):
+            therapist = self.add_therapists(count)[-1]
+            panel = TherapyPanel.objects.create(patient=self.patient, issue=self.issue)
+            url = reverse("therapy:retrieve-update-therapy-panel", args=[panel.pk])
+            return lambda: self.client.put(url, {"therapist": therapist.pk})
+
+        self.assertQueryBudget(QUERY_BUDGETS["select-therapist"], prepare)
+
+    def test_update_therapy_panel_therapist(self):
+        self.authenticate(self.therapist_user)
+
+        def prepare(count):
+            self.add_appointments(count)
+            url = reverse("therapy:retrieve-update-therapy-panel", args=[self.panel.pk])
+            return lambda: self.client.put(url, {"progress_notes": "Improving"})
+
+        self.assertQueryBudget(QUERY_BUDGETS["update-therapy-panel-therapist"], prepare)
+
+    def test_create_appointment(self):
+        self.authenticate(self.patient_user)
+
+        def prepare(count):
+            self.add_availabilities(count)
+            self.add_appointments(count)
+            url = reverse("therapy:create-appointment")
+            data = {
+                "panel_id": self.panel.pk,
+                "scheduled_time": at(1, 9).isoformat(),
+                "duration": 60,
+            }
+            return lambda: self.client.post(url, data)
+
+        self.assertQueryBudget(QUERY_BUDGETS["create-appointment"], prepare, status=201)
+
+    def test_retrieve_appointment(self):
+        self.authenticate(self.patient_user)
+
+        def prepare(count):
+            appointment = self.add_appointments(count)[0]
+            url = reverse("therapy:retrieve-appointment", args=[appointment.pk])
+            return lambda: self.client.get(url)
+
+        self.assertQueryBudget(QUERY_BUDGETS["retrieve-appointment"], prepare)
+
+    def test_reschedule_appointment(self):
+        self.authenticate(self.patient_user)
+
+        def prepare(count):
+            self.add_availabilities(count)
+            appointment = self.add_appointments(count)[0]
+            url = reverse("therapy:update-appointment", args=[appointment.pk])
+            data = {
+                "action": "reschedule",
+                "new_scheduled_time": at(1, 9).isoformat(),
+            }
+            return lambda: self.client.patch(url, data)
+
+        self.assertQueryBudget(QUERY_BUDGETS["reschedule-appointment"], prepare)
+
+    def test_cancel_appointment(self):
+        self.authenticate(self.patient_user)
+
+        def prepare(count):
+            appointment = self.add_appointments(count)[0]
+            url = reverse("therapy:update-appointment", args=[appointment.pk])
+            data = {"action": "cancel", "cancellation_reason": "Travelling"}
+            return lambda: self.client.patch(url, data)
+
+        self.assertQueryBudget(QUERY_BUDGETS["cancel-appointment"], prepare)
+
+    def test_therapist_cancel_appointment(self):
+        self.authenticate(self.therapist_user)
+
+        def prepare(count):
+            appointment = self.add_appointments(count)[0]
+            url = reverse("therapy:cancel-appointment", args=[appointment.pk])
+            return lambda: self.client.patch(url, {"cancellation_reason": "Ill"})
+
+        self.assertQueryBudget(QUERY_BUDGETS["therapist-cancel-appointment"], prepare)
+
+    def test_list_patient_appointments(self):
+        self.authenticate(self.patient_user)
+
+        def prepare(count):
+            self.add_appointments(count)
+            url = reverse("therapy:list-patient-appointments")
+            return lambda: self.client.get(url)
+
+        self.assertQueryBudget(QUERY_BUDGETS["list-patient-appointments"], prepare)
+
+    def test_list_therapist_appointments(self):
+        self.authenticate(self.therapist_user)
+
+        def prepare(count):
+            self.add_appointments(count)
+            url = reverse("therapy:list-therapist-appointments")
+            return lambda: self.client.get(url, {"status": "scheduled"})
+
+        self.assertQueryBudget(QUERY_BUDGETS["list-therapist-appointments"], prepare)
+
+
+class PageOfTwo(PageNumberPagination):
+    page_size = 2
+
+
+class AsyncViewTests(TherapyQueryBudgetTests):
+    """
+    The query budgets above, met by the async views too, and the async
+    views answering as the sync ones do.
+    """
+
+    def setUp(self):
+        self.enterContext(serve_async_views())
+
+    def get_both(self, url, data=None):
+        """The responses of the sync and of the async view."""
+        with serve_async_views(False):
+            sync = self.client.get(url, data)
+        return sync, self.client.get(url, data)
+
+    def assertSameResponse(self, url, data=None, status=200):
+        sync, asynchronous = self.get_both(url, data)
+        self.assertEqual(sync.status_code, status, sync.json())
+        self.assertEqual(asynchronous.status_code, status)
+        self.assertEqual(asynchronous.json(), sync.json())
+        return asynchronous.json()
+
+    def add_other_patient_appointment(self):
+        patient = PatientProfile.objects.get(user=create_user("patient", 2))
+        panel = TherapyPanel.objects.create(
+            patient=patient, issue=self.issue, therapist=self.therapist
+        )
+        return self.add_appointments(1, panel)[0]
+
+    def test_routes_to_the_async_views(self):
+        for name, args, view_class in [
+            ("list-availability", [], AsyncListAvailabilityView),
+            ("retrieve-appointment", [1], AsyncAppointmentRetrieveView),
+            ("list-patient-appointments", [], AsyncPatientAppointmentListView),
+            ("list-therapist-appointments", [], AsyncTherapistAppointmentListView),
+        ]:
+            with self.subTest(name=name):
+                match = resolve(reverse(f"therapy:{name}", args=args))
+                self.assertIs(match.func.view_class, view_class)
+
+    def test_list_availability(self):
+        super().test_list_availability()
+        self.authenticate(self.patient_user)
+        self.add_availabilities(3)
+        other = TherapistProfile.objects.get(user=create_user("therapist", 2))
+        self.add_availabilities(2, other)
+        url = reverse("therapy:list-availability")
+
+        self.assertEqual(len(self.assertSameResponse(url)), 5)
+        data = self.assertSameResponse(url, {"therapist_id": other.pk})
+        self.assertEqual(len(data), 2)
+        self.assertSameResponse(url, {"ordering": "-date"})
+
+    def test_list_patient_appointments(self):
+        super().test_list_patient_appointments()
+        self.add_appointments(3)
+        self.add_other_patient_appointment()
+        url = reverse("therapy:list-patient-appointments")
+
+        self.authenticate(self.patient_user)
+        self.assertEqual(len(self.assertSameResponse(url)), 3)
+        self.authenticate(self.therapist_user)
+        self.assertSameResponse(url, status=403)
+
+    def test_list_therapist_appointments(self):
+        super().test_list_therapist_appointments()
+        self.add_appointments(3)
+        self.add_other_patient_appointment()
+        url = reverse("therapy:list-therapist-appointments")
+
+        self.authenticate(self.therapist_user)
+        for status in ("", "scheduled", "completed"):
+            with self.subTest(status=status):
+                self.assertSameResponse(url, {"status": status})
+        self.assertEqual(len(self.assertSameResponse(url)), 4)
+        self.authenticate(self.patient_user)
+        self.assertSameResponse(url, status=403)
+
+    def test_retrieve_appointment(self):
+        super().test_retrieve_appointment()
+        [appointment] = self.add_appointments(1)
+        other = self.add_other_patient_appointment()
+
+        self.authenticate(self.patient_user)
+        url = reverse("therapy:retrieve-appointment", args=[appointment.pk])
+        self.assertEqual(self.assertSameResponse(url)["id"], appointment.pk)
+        url = reverse("therapy:retrieve-appointment", args=[other.pk])
+        self.assertSameResponse(url, status=403)
+        url = reverse("therapy:retrieve-appointment", args=[other.pk + 1])
+        self.assertSameResponse(url, status=404)
+        self.client.credentials()
+        self.assertSameResponse(url, status=401)
+
+    def test_paginated_lists(self):
+        self.add_appointments(3)
+        access = RoleRefreshToken.for_user(self.patient_user).access_token
+        request = APIRequestFactory().get(
+            "/", {"page": 2}, HTTP_AUTHORIZATION=f"Bearer {access}"
+        )
+        sync = PatientAppointmentListView.as_view(pagination_class=PageOfTwo)
+        asynchronous = AsyncPatientAppointmentListView.as_view(
+            pagination_class=PageOfTwo
+        )
+
+        expected = sync(request).data
+        with self.assertNumQueries(2):
+            response = async_to_sync(asynchronous)(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, expected)
+        self.assertEqual(
+            (response.data["count"], len(response.data["results"])), (3, 1)
+        )
@@ -1,7 +1,12 @@
+from django.conf import settings
 from django.urls import path
 
 from .views import (
     AppointmentRetrieveView,
+    AsyncAppointmentRetrieveView,
+    AsyncListAvailabilityView,
+    AsyncPatientAppointmentListView,
+    AsyncTherapistAppointmentListView,
     CreateAppointmentView,
     CreateAvailabilityView,
     DeleteAvailabilityView,
@@ -16,11 +21,23 @@ from .views import (
     UpdateAvailabilityView,
 )
 
+# Under ASGI, the read-heavy views are served async (see ASYNC_VIEWS)
+if settings.ASYNC_VIEWS:
+    list_availability_view = AsyncListAvailabilityView.as_view()
+    retrieve_appointment_view = AsyncAppointmentRetrieveView.as_view()
+    list_patient_appointments_view = AsyncPatientAppointmentListView.as_view()
+    list_therapist_appointments_view = AsyncTherapistAppointmentListView.as_view()
+else:
+    list_availability_view = ListAvailabilityView.as_view()
+    retrieve_appointment_view = AppointmentRetrieveView.as_view()
+    list_patient_appointments_view = PatientAppointmentListView.as_view()
+    list_therapist_appointments_view = TherapistAppointmentListView.as_view()
+
 app_name = "therapy"
 urlpatterns = [
     # Availability Management
     path(
-        "availabilities/", ListAvailabilityView.as_view(), name="list-availability"
+        "availabilities/", list_availability_view, name="list-availability"
     ),  # GET: List all availability slots
     path(
         "availabilities/create/",
@@ -57,7 +74,7 @@ urlpatterns = [
     ),  # POST: Create appointment (panel_id in body)
     path(
         "appointments/<int:pk>/",
-        AppointmentRetrieveView.as_view(),
+        retrieve_appointment_view,
         name="retrieve-appointment",
     ),  # GET: Retrieve a specific appointment
     path(
@@ -73,13 +90,13 @@ urlpatterns = [
     # Patient-Specific Appointments
     path(
         "appointments/patient/",
-        PatientAppointmentListView.as_view(),
+        list_patient_appointments_view,
         name="list-patient-appointments",
     ),  # GET: List patient’s scheduled appointments
     # Therapist-Specific Appointments
     path(
         "appointments/therapist/",
-        TherapistAppointmentListView.as_view(),
+        list_therapist_appointments_view,
         name="list-therapist-appointments",
     ),  # GET: List therapist’s appointments with filters
 ]
@@ -1,3 +1,4 @@
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
@@ -7,7 +8,8 @@ from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
-from therapy_connect.profiles.models import PatientProfile, TherapistProfile
+from therapy_connect.accounts.roles import get_role_context
+from therapy_connect.core.views import AsyncListModelMixin, AsyncRetrieveModelMixin
 
 from .models import Appointment, Availability, TherapyPanel
 from .schemas import (
@@ -45,8 +47,8 @@ class CreateAvailabilityView(generics.CreateAPIView):
 
     def perform_create(self, serializer):
         """Assigns the therapist automatically from the authenticated user."""
-        therapist = get_object_or_404(TherapistProfile, user=self.request.user)
-        serializer.save(therapist=therapist)  # Assign therapist before saving
+        therapist_id = get_role_context(self.request).therapist_id_or_404()
+        serializer.save(therapist_id=therapist_id)  # Assign therapist before saving
 
 
 @list_availability_schema
@@ -90,9 +92,9 @@ class UpdateAvailabilityView(generics.RetrieveUpdateAPIView):
         """
         Ensure that only the therapist who created the slot can access it.
         """
-        therapist = get_object_or_404(TherapistProfile, user=self.request.user)
+        therapist_id = get_role_context(self.request).therapist_id_or_404()
         availability = get_object_or_404(
-            Availability, id=self.kwargs["pk"], therapist=therapist
+            Availability, id=self.kwargs["pk"], therapist_id=therapist_id
         )
         return availability
 
@@ -112,9 +114,9 @@ class DeleteAvailabilityView(generics.DestroyAPIView):
         """
         Ensure that only the therapist who created the slot can access it.
         """
-        therapist = get_object_or_404(TherapistProfile, user=self.request.user)
+        therapist_id = get_role_context(self.request).therapist_id_or_404()
         availability = get_object_or_404(
-            Availability, id=self.kwargs["pk"], therapist=therapist
+            Availability, id=self.kwargs["pk"], therapist_id=therapist_id
         )
         return availability
 
@@ -132,11 +134,11 @@ class TherapyPanelCreateView(generics.CreateAPIView):
         """
         Ensure only patients can create therapy panels.
         """
-        patient = PatientProfile.objects.filter(user=self.request.user).first()
-        if not patient:
+        patient_id = get_role_context(self.request).patient_id
+        if not patient_id:
             raise PermissionDenied("Only patients can create a therapy panel.")
 
-        serializer.save(patient=patient)
+        serializer.save(patient_id=patient_id)
 
 
 class TherapyPanelRetrieveUpdateView(generics.RetrieveUpdateAPIView):
@@ -162,18 +164,18 @@ class TherapyPanelRetrieveUpdateView(generics.RetrieveUpdateAPIView):
 
     def get_serializer_class(self):
         """Dynamically select serializer based on user type (Patient or Therapist)."""
-        user = self.request.user
+        context = get_role_context(self.request)
 
         if self.request.method == "GET":
-            if hasattr(user, "patient_profile"):
+            if context.is_patient:
                 return TherapyPanelPatientRetrieveSerializer
-            if hasattr(user, "therapist_profile"):
+            if context.is_therapist:
                 return TherapyPanelTherapistRetrieveSerializer
 
         elif self.request.method == "PUT":
-            if hasattr(user, "patient_profile"):
+            if context.is_patient:
                 return TherapyPanelPatientUpdateSerializer
-            if hasattr(user, "therapist_profile"):
+            if context.is_therapist:
                 return TherapyPanelTherapistUpdateSerializer
 
         raise PermissionDenied(
@@ -183,16 +185,12 @@ class TherapyPanelRetrieveUpdateView(generics.RetrieveUpdateAPIView):
     def get_object(self):
         """Ensure only the associated patient or therapist can access the panel."""
         therapy_panel = super().get_object()
-        user = self.request.user
+        context = get_role_context(self.request)
 
-        if hasattr(user, "patient_profile") and therapy_panel.patient.user == user:
+        if context.is_patient and therapy_panel.patient_id == context.patient_id:
             return therapy_panel  # Patient accessing their own panel
 
-        if (
-            hasattr(user, "therapist_profile")
-            and therapy_panel.therapist
-            and therapy_panel.therapist.user == user
-        ):
+        if context.is_therapist and therapy_panel.therapist_id == context.therapist_id:
             return therapy_panel  # Therapist accessing their assigned panel
 
         raise PermissionDenied(
@@ -212,12 +210,12 @@ class TherapyPanelListView(generics.ListAPIView):
 
     def get_serializer_class(self):
         """Dynamically select serializer based on user type (Patient or Therapist)."""
-        user = self.request.user
+        context = get_role_context(self.request)
 
         if self.request.method == "GET":
-            if hasattr(user, "patient_profile"):
+            if context.is_patient:
                 return TherapyPanelPatientRetrieveSerializer
-            if hasattr(user, "therapist_profile"):
+            if context.is_therapist:
                 return TherapyPanelTherapistRetrieveSerializer
 
         raise PermissionDenied(
@@ -226,13 +224,16 @@ class TherapyPanelListView(generics.ListAPIView):
 
     def get_queryset(self):
         """Filter therapy panels based on user type (patient or therapist)."""
-        user = self.request.user
+        context = get_role_context(self.request)
 
-        if hasattr(user, "patient_profile"):
-            return TherapyPanel.objects.filter(patient=user.patient_profile)
+        if context.is_patient:
+            return TherapyPanel.objects.filter(patient_id=context.patient_id)
 
-        if hasattr(user, "therapist_profile"):
-            return TherapyPanel.objects.filter(therapist=user.therapist_profile)
+        if context.is_therapist:
+            # The serializer shows each patient's name
+            return TherapyPanel.objects.filter(
+                therapist_id=context.therapist_id
+            ).select_related("patient__user")
 
         return TherapyPanel.objects.none()  # No access for other users
 
@@ -256,7 +257,9 @@ class CreateAppointmentView(generics.CreateAPIView):
 
         # Validate panel existence and ownership
         try:
-            panel = TherapyPanel.objects.get(id=panel_id, patient__user=request.user)
+            panel = TherapyPanel.objects.get(
+                id=panel_id, patient_id=get_role_context(request).patient_id
+            )
         except TherapyPanel.DoesNotExist:
             raise ValidationError(
                 {"panel_id": "Invalid therapy panel or unauthorized access."}
@@ -287,7 +290,9 @@ class UpdateAppointmentView(generics.UpdateAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return Appointment.objects.filter(panel__patient__user=self.request.user)
+        return Appointment.objects.filter(
+            panel__patient_id=get_role_context(self.request).patient_id
+        ).select_related("panel")
 
     def get_serializer_class(self):
         """Determine the correct serializer based on the request."""
@@ -370,10 +375,12 @@ class TherapistCancelAppointmentView(generics.UpdateAPIView):
 
     def get_queryset(self):
         """Filter to return only the appointments of the logged-in therapist."""
-        user = self.request.user
+        context = get_role_context(self.request)
 
-        if hasattr(user, "therapist_profile"):
-            return Appointment.objects.filter(panel__therapist__user=user)
+        if context.is_therapist:
+            return Appointment.objects.filter(
+                panel__therapist_id=context.therapist_id
+            ).select_related("panel")
 
         return Appointment.objects.none()  # No access for non-therapists
 
@@ -409,16 +416,17 @@ class PatientAppointmentListView(generics.ListAPIView):
         """
         Return only the scheduled appointments where the current user is the patient.
         """
-        user = self.request.user
+        context = get_role_context(self.request)
 
         # Ensure the user is a patient
-        if not hasattr(user, "patient_profile"):
+        if not context.is_patient:
             raise PermissionDenied(
                 "Only patients can view their scheduled appointments."
             )
 
         return Appointment.objects.filter(
-            panel__patient__user=user,  # Filter by logged-in patient's appointments
+            # Filter by logged-in patient's appointments
+            panel__patient_id=context.patient_id,
             status="scheduled",  # Only show scheduled appointments
         ).order_by("scheduled_time")
 
@@ -435,20 +443,17 @@ class TherapistAppointmentListView(generics.ListAPIView):
         """
         Return appointments filtered by the logged-in therapist and requested status.
         """
-        user = self.request.user
+        context = get_role_context(self.request)
 
         # Ensure the user is a therapist
-        if not hasattr(user, "therapist_profile"):
+        if not context.is_therapist:
             raise PermissionDenied("Only therapists can view their appointments.")
 
-        # Get the therapist's profile
-        therapist = user.therapist_profile
-
         # Get the status filter from query parameters
         status_filter = self.request.query_params.get("status", "").lower()
 
         # Define default queryset (all appointments for this therapist)
-        queryset = Appointment.objects.filter(panel__therapist=therapist)
+        queryset = Appointment.objects.filter(panel__therapist_id=context.therapist_id)
 
         # Apply filters based on status
         if status_filter == "scheduled":
@@ -478,19 +483,24 @@ class AppointmentRetrieveView(generics.RetrieveAPIView):
         """
         Retrieve an appointment only if the user is allowed to access it.
         """
-        user = self.request.user
+        context = get_role_context(self.request)
         appointment_id = self.kwargs.get("pk")
 
         # Get the appointment or return 404 if not found
-        appointment = get_object_or_404(Appointment, id=appointment_id)
+        appointment = get_object_or_404(
+            Appointment.objects.select_related("panel"), id=appointment_id
+        )
+        self.check_access(context, appointment)
+        return appointment
 
-        # Access control: Check if user is allowed to view this appointment
-        if hasattr(user, "patient_profile"):  # If user is a patient
-            if appointment.panel.patient.user != user:
+    def check_access(self, context, appointment):
+        """Check if the user is allowed to view this appointment."""
+        if context.is_patient:  # If user is a patient
+            if appointment.panel.patient_id != context.patient_id:
                 raise PermissionDenied("You can only view your own appointments.")
 
-        elif hasattr(user, "therapist_profile"):  # If user is a therapist
-            if appointment.panel.therapist.user != user:
+        elif context.is_therapist:  # If user is a therapist
+            if appointment.panel.therapist_id != context.therapist_id:
                 raise PermissionDenied(
                     "You can only view your own patient appointments."
                 )
@@ -498,4 +508,38 @@ class AppointmentRetrieveView(generics.RetrieveAPIView):
         else:
             raise PermissionDenied("Access denied.")
 
+
+# Async variants of the read-heavy views, served under ASGI (see ASYNC_VIEWS)
+
+
+class AsyncListAvailabilityView(AsyncListModelMixin, ListAvailabilityView):
+    pass
+
+
+class AsyncPatientAppointmentListView(AsyncListModelMixin, PatientAppointmentListView):
+    pass
+
+
+class AsyncTherapistAppointmentListView(
+    AsyncListModelMixin, TherapistAppointmentListView
+):
+    pass
+
+
+class AsyncAppointmentRetrieveView(AsyncRetrieveModelMixin, AppointmentRetrieveView):
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # May fall back to a query for tokens issued without role claims
+        get_role_context(request)
+
+    async def aget_object(self):
+        context = get_role_context(self.request)
+        try:
+            appointment = await Appointment.objects.select_related("panel").aget(
+                id=self.kwargs.get("pk")
+            )
+        except Appointment.DoesNotExist:
+            # The message get_object_or_404 gives
+            raise Http404("No Appointment matches the given query.")
+        self.check_access(context, appointment)
         return appointment
@@ -7,6 +7,8 @@ from drf_spectacular.views import (
     SpectacularSwaggerView,
 )
 
+from therapy_connect.core.views import MetricsView, StoredSchemaView
+
 # Admin URLs
 admin_urlpatterns = [
     path("admin/", admin.site.urls),
@@ -35,9 +37,20 @@ therapy_urlpatterns = [
     ),
 ]
 
-# Schema URLs
+# Core App URLs
+core_urlpatterns = [
+    path("api/core/", include("therapy_connect.core.urls", namespace="core")),
+]
+
+# Schema URLs; the swagger and redoc pages load the schema from "schema"
+if settings.SERVE_STORED_SCHEMA:
+    schema_view = StoredSchemaView.as_view()
+else:
+    schema_view = SpectacularAPIView.as_view()
+
 schema_urlpatterns = [
-    path("schema/", SpectacularAPIView.as_view(), name="schema"),
+    path("schema/", schema_view, name="schema"),
+    path("metrics", MetricsView.as_view(), name="metrics"),
     path(
         "schema/swagger-ui/",
         SpectacularSwaggerView.as_view(url_name="schema"),
@@ -54,6 +67,7 @@ urlpatterns = (
     + accounts_urlpatterns
     + profiles_urlpatterns
     + therapy_urlpatterns
+    + core_urlpatterns
     + schema_urlpatterns
 )
 